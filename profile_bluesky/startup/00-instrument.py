@@ -3,7 +3,12 @@
 start bluesky in IPython session for DYS 8-ID-I XPCS
 """
 
+from instrument import startup_profiler
+startup_profiler.start()    # only if INSTRUMENT_STARTUP_PROFILE is set
+
 from instrument.collection import *
 
+startup_profiler.finish()
+
 # show_ophyd_symbols()
 # print_RE_md(printing=False)
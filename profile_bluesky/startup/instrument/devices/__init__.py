@@ -47,3 +47,15 @@ from .ad_lambda2M import *
 
 # non-hardware support
 from .data_management import *
+from .rigaku_bin_files import *
+
+# all devices created, now wait for them at once
+from ..framework import device_registry
+from ..session_logs import logger
+# optional equipment: connect when first used, do not wait now
+for _device in (flyscan, flyz, qnw_env1, qnw_env2, qnw_env3):
+    device_registry.register(_device, lazy=True)
+device_registry.connect_all()
+device_registry.stop_recording()    # not objects created later, in plans
+logger.info("device connection times:\n%s", device_registry.report())
+del device_registry, logger, _device
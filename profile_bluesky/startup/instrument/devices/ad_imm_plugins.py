@@ -12,6 +12,7 @@ from ..session_logs import logger
 logger.info(__file__)
 
 from ..framework import db
+from .frame_stack import FrameStack
 from area_detector_handlers.handlers import HandlerBase
 from bluesky import plan_stubs as bps
 from ophyd import Component
@@ -19,7 +20,12 @@ from ophyd import Device
 from ophyd import EpicsSignalRO
 from ophyd import EpicsSignalWithRBV
 from ophyd.areadetector.plugins import FilePlugin_V34
+import collections
+import dask.array
 import numpy as np
+import os
+import re
+import scipy.sparse
 import struct
 
 
@@ -172,6 +178,36 @@ imm_fieldnames = [
 ]
 
 
+def _imm_header_dtype():
+    """numpy structured dtype equivalent of ``imm_headformat``"""
+    codes = dict(i="<i4", I="<u4", d="<f8", f="<f4", c="S1")
+    formats = []
+    for count, code in re.findall(r"(\d*)([a-zA-Z])", imm_headformat):
+        if code == "s":
+            formats.append(f"S{count}")
+        else:
+            formats += [codes[code]] * int(count or 1)
+    return np.dtype(list(zip(imm_fieldnames, formats)))
+
+
+imm_header_dtype = _imm_header_dtype()
+IMM_HEADER_SIZE = imm_header_dtype.itemsize  # 1024 bytes
+IMM_COMPRESSED = 6  # header["compression"] value of compressed frames
+
+# sparse frames as a flat list of (frame, pixel, value) events
+IMMPixels = collections.namedtuple("IMMPixels", "frame pixel value")
+
+# one row per frame: where its payload starts, how many elements it has
+imm_toc_dtype = np.dtype(
+    [
+        ("offset", "<i8"),  # byte offset of payload (just past the header)
+        ("dlen", "<i4"),  # number of pixels in the payload
+        ("compression", "<i4"),
+        ("elapsed", "<f8"),
+    ]
+)
+
+
 def readHeader(fp):
     bindata = fp.read(1024)
 
@@ -183,49 +219,286 @@ def readHeader(fp):
     return imm_header
 
 
+class IMMFile:
+    """
+    memory-mapped reader for IMM files
+
+    The table of contents (``toc``, an array of ``imm_toc_dtype``) is
+    saved beside the IMM file (``<filename>.toc.npz``) and reused by
+    later opens while the size and mtime of the IMM file are unchanged.
+
+    Frames are returned as read-only views into the memory map
+    where the file layout permits (uncompressed frames), otherwise
+    expanded on demand.
+
+    PARAMETERS
+
+    filename : str
+        name of the IMM file
+    use_index : bool
+        If `True` (default), read & write the sidecar TOC file.
+    """
+
+    index_suffix = ".toc.npz"
+    index_version = 1
+
+    def __init__(self, filename, use_index=True):
+        self.filename = filename
+        self.use_index = use_index
+        try:
+            self._mm = np.memmap(filename, dtype=np.uint8, mode="r")
+            header = self._mm[:IMM_HEADER_SIZE].view(imm_header_dtype)[0]
+        except (ValueError, TypeError) as err:
+            raise IOError("IMM file doesn't seems to be of right type") from err
+        self.header = header
+        self.rows, self.cols = int(header["rows"]), int(header["cols"])
+        self.is_compressed = bool(header["compression"] == IMM_COMPRESSED)
+
+        self.toc = self._read_index() if use_index else None
+        if self.toc is None:
+            self.toc = self._scan()
+            if use_index:
+                self._write_index()
+
+    def __len__(self):
+        return len(self.toc)
+
+    def __getstate__(self):
+        # re-open (do not copy) the memory map when pickled
+        return dict(filename=self.filename, use_index=self.use_index)
+
+    def __setstate__(self, state):
+        self.__init__(state["filename"], use_index=state["use_index"])
+
+    @property
+    def shape(self):
+        return (len(self), self.rows, self.cols)
+
+    @property
+    def index_file(self):
+        return self.filename + self.index_suffix
+
+    def close(self):
+        self._mm = None
+
+    def _file_signature(self):
+        st = os.stat(self.filename)
+        return st.st_size, st.st_mtime_ns
+
+    def _header_field(self, name, header_offsets):
+        """read one header field from many frames at once"""
+        dtype, field_offset = imm_header_dtype.fields[name][:2]
+        positions = header_offsets[:, None] + field_offset + np.arange(dtype.itemsize)
+        return self._mm[positions].view(dtype).ravel()
+
+    def _scan(self):
+        """build the table of contents by walking the frame headers"""
+        size = self._mm.size
+        npix = self.rows * self.cols
+        frame_size = IMM_HEADER_SIZE + 2 * npix
+
+        if not self.is_compressed and self.header["dlen"] == npix and size % frame_size == 0:
+            # all frames are the same size: no need to visit each header
+            header_offsets = np.arange(size // frame_size, dtype=np.int64) * frame_size
+        else:
+            # each header's payload length locates the next header
+            comp_offset = imm_header_dtype.fields["compression"][1]
+            dlen_offset = imm_header_dtype.fields["dlen"][1]
+            offsets = []
+            pos = 0
+            while pos + IMM_HEADER_SIZE <= size:
+                (compression,) = struct.unpack_from("<i", self._mm, pos + comp_offset)
+                (dlen,) = struct.unpack_from("<i", self._mm, pos + dlen_offset)
+                if dlen < 0:
+                    raise IOError("IMM file doesn't seems to be of right type")
+                payload_size = dlen * (6 if compression == IMM_COMPRESSED else 2)
+                if pos + IMM_HEADER_SIZE + payload_size > size:
+                    logger.warning(
+                        "IMM file %s: ignoring incomplete frame %d",
+                        self.filename, len(offsets),
+                    )
+                    break
+                offsets.append(pos)
+                pos += IMM_HEADER_SIZE + payload_size
+            header_offsets = np.array(offsets, dtype=np.int64)
+
+        toc = np.zeros(len(header_offsets), dtype=imm_toc_dtype)
+        toc["offset"] = header_offsets + IMM_HEADER_SIZE
+        for name in "dlen compression elapsed".split():
+            toc[name] = self._header_field(name, header_offsets)
+        logger.debug("IMM file %s: %d frames", self.filename, len(toc))
+        return toc
+
+    def _read_index(self):
+        """return the saved TOC if it still describes the IMM file, else None"""
+        if not os.path.exists(self.index_file):
+            return None
+        try:
+            with np.load(self.index_file) as index:
+                signature = tuple(int(v) for v in index["signature"])
+                if int(index["version"]) != self.index_version:
+                    return None
+                if signature != self._file_signature():
+                    return None
+                return index["toc"].astype(imm_toc_dtype, copy=False)
+        except Exception as exc:
+            logger.debug("ignoring IMM index %s: %s", self.index_file, exc)
+            return None
+
+    def _write_index(self):
+        """save the TOC, atomically so concurrent readers never see half a file"""
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, "wb") as f:
+                np.savez(
+                    f,
+                    toc=self.toc,
+                    signature=np.array(self._file_signature(), dtype=np.int64),
+                    version=self.index_version,
+                )
+            os.replace(temp_file, self.index_file)
+        except OSError as exc:
+            # such as a read-only data directory: next open will scan again
+            logger.debug("could not write IMM index %s: %s", self.index_file, exc)
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _payload(self, i):
+        offset, dlen = int(self.toc["offset"][i]), int(self.toc["dlen"][i])
+        if self.toc["compression"][i] == IMM_COMPRESSED:
+            # (pixel index, pixel value) pairs, each a view of the memory map
+            indexes = self._mm[offset : offset + 4 * dlen].view("<u4")
+            values = self._mm[offset + 4 * dlen : offset + 6 * dlen].view("<u2")
+            return indexes, values
+        return None, self._mm[offset : offset + 2 * dlen].view("<u2")
+
+    def frame(self, i):
+        """return frame ``i`` as a (rows, cols) image"""
+        indexes, values = self._payload(i)
+        if indexes is None:
+            return values.reshape(self.rows, self.cols)
+        image = np.zeros(self.rows * self.cols, dtype=values.dtype)
+        image[indexes] = values
+        return image.reshape(self.rows, self.cols)
+
+    def frames(self, start=0, stop=None):
+        """return frames ``start`` .. ``stop-1`` as a (n, rows, cols) array"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        n = max(stop - start, 0)
+        offsets = self.toc["offset"][start:stop]
+        frame_bytes = 2 * self.rows * self.cols
+        uncompressed = not np.any(self.toc["compression"][start:stop] == IMM_COMPRESSED)
+        if n > 0 and uncompressed and np.all(self.toc["dlen"][start:stop] * 2 == frame_bytes):
+            strides = np.diff(offsets)
+            if n == 1 or np.all(strides == strides[0]):
+                # evenly spaced frames: one strided view, no copy
+                return np.ndarray(
+                    shape=(n, self.rows, self.cols),
+                    dtype="<u2",
+                    buffer=self._mm,
+                    offset=int(offsets[0]),
+                    strides=(int(strides[0]) if n > 1 else frame_bytes, 2 * self.cols, 2),
+                )
+        stack = np.zeros((n, self.rows, self.cols), dtype="<u2")
+        for k in range(n):
+            stack[k] = self.frame(start + k)
+        return stack
+
+    def pixels(self, start=0, stop=None):
+        """
+        return non-zero pixels of frames ``start`` .. ``stop-1`` as ``IMMPixels``
+
+        ``frame`` is relative to ``start`` and ``pixel`` is the flat
+        (``row * cols + col``) pixel index.  Compressed frames are
+        copied straight from the file, never expanded to full images.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        frame, pixel, value = [], [], []
+        for k in range(max(stop - start, 0)):
+            indexes, values = self._payload(start + k)
+            if indexes is None:
+                indexes = np.flatnonzero(values)
+                values = values[indexes]
+            frame.append(np.full(len(indexes), k, dtype=np.uint32))
+            pixel.append(indexes)
+            value.append(values)
+        if len(frame) == 0:
+            return IMMPixels(
+                np.zeros(0, np.uint32), np.zeros(0, "<u4"), np.zeros(0, "<u2")
+            )
+        return IMMPixels(
+            np.concatenate(frame), np.concatenate(pixel), np.concatenate(value)
+        )
+
+    def sparse_frames(self, start=0, stop=None):
+        """
+        return frames ``start`` .. ``stop-1`` as a CSR matrix
+
+        One row per frame, one column per (flat) pixel: shape is
+        ``(n, rows * cols)``.  Sums and products over frames stay sparse,
+        for example ``sparse_frames().sum(axis=0)`` is the summed image.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        events = self.pixels(start, stop)
+        n = max(stop - start, 0)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(events.frame, minlength=n), out=indptr[1:])
+        return scipy.sparse.csr_matrix(
+            (events.value, events.pixel, indptr),
+            shape=(n, self.rows * self.cols),
+        )
+
+    def to_dask(self, start=0, stop=None, chunk_frames=100):
+        """return frames ``start`` .. ``stop-1`` as a lazy dask array"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stack = FrameStack(self, start, stop)
+        return dask.array.from_array(
+            stack,
+            chunks=(chunk_frames, self.rows, self.cols),
+            name=f"imm-{self.filename}-{self._file_signature()}-{start}-{stop}",
+            lock=False,
+            fancy=False,
+        )
+
+
 class IMMHandler(HandlerBase):
+    """
+    databroker handler for IMM files
+
+    Returns a lazy dask array of the frames of each datum.
+    """
+
+    specs = {"IMM"}
+
     def __init__(self, filename, frames_per_point):
-        self.file = open(filename, "rb")
+        self.imm = IMMFile(filename)
         self.frames_per_point = frames_per_point
-        header = readHeader(self.file)
-        self.rows, self.cols = header["rows"], header["cols"]
-        self.is_compressed = bool(header["compression"] == 6)
-        self.file.seek(0)
-        self.toc = []  # (start byte, element count) pairs
-        while True:
-            try:
-                header = readHeader(self.file)
-                print("header rows and cols", header["rows"], header["cols"])
-                cur = self.file.tell()
-                payload_size = header["dlen"] * (6 if header["compression"] == 6 else 2)
-                self.toc.append((cur, header["dlen"]))
-                file_pos = payload_size + cur
-                self.file.seek(file_pos)
-                # Check for end of file.
-                if not self.file.read(4):
-                    break
-                self.file.seek(file_pos)
-            except Exception as err:
-                raise IOError("IMM file doesn't seems to be of right type") from err
+        self.rows, self.cols = self.imm.rows, self.imm.cols
+        self.is_compressed = self.imm.is_compressed
 
     def close(self):
-        self.file.close()
+        self.imm.close()
+
+    def __call__(self, index):
+        logger.info(f"index: {index}")
+        start = index * self.frames_per_point
+        return self.imm.to_dask(start, start + self.frames_per_point)
+
+
+class IMMSparseHandler(IMMHandler):
+    """
+    databroker handler for IMM files, returning sparse frames
+
+    Each datum is a ``scipy.sparse.csr_matrix`` with one row per frame.
+    To use (instead of dense frames)::
+
+        db.reg.register_handler("IMM", IMMSparseHandler, overwrite=True)
+    """
 
     def __call__(self, index):
         logger.info(f"index: {index}")
-        result = np.zeros((self.frames_per_point, self.rows * self.cols), np.uint32)
-        for i in range(self.frames_per_point):
-            # looping through plane 'i' of chunk 'index'
-            start_byte, num_pixels = self.toc[index * self.frames_per_point + i]
-            self.file.seek(start_byte)
-            indexes = np.fromfile(self.file, dtype=np.uint32, count=num_pixels)
-            values = np.fromfile(self.file, dtype=np.uint16, count=num_pixels)
-            # if self.is_compressed:
-
-            result[i, indexes] = values
-            # else:
-            #    result = dense_array
-        return result.reshape(self.frames_per_point, self.rows, self.cols)
+        start = index * self.frames_per_point
+        return self.imm.sparse_frames(start, start + self.frames_per_point)
 
 
 db.reg.register_handler("IMM", IMMHandler, overwrite=True)
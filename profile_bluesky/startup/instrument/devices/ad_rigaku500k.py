@@ -6,6 +6,7 @@ __all__ = [
     "rigaku500k",
 ]
 
+from ..framework import device_registry
 from .ad_acquire_detector_base import AD_AcquireDetectorBase
 from .ad_acquire_detector_base import AD_AcquireDetectorCamBase
 from .ad_imm_plugins import IMM_DeviceMixinBase
@@ -23,7 +24,6 @@ from ophyd import Staged
 from ophyd.areadetector import CamBase
 from ophyd.areadetector import DetectorBase
 import os
-import time as ttime
 
 logger.info(__file__)
 
@@ -60,9 +60,9 @@ class Rigaku500k(
     _status_type = ADTriggerStatus
 
 
-# wait a bit for all previous PV connections to complete
+# wait (no longer than needed) for all previous PV connections to complete
 _delay = 2.5  # empirical determination (1.0 is too short, 2 tests OK)
-logger.info("Sleeping for %s seconds before creating rigaku500k object.", _delay)
-ttime.sleep(_delay)
+logger.info("Waiting up to %s seconds before creating rigaku500k object.", _delay)
+device_registry.connect_all(timeout=_delay)
 
 rigaku500k = Rigaku500k(IOC_PREFIX, name="rigaku500k")
@@ -9,6 +9,7 @@ __all__ = [
     "adrigaku",
 ]
 
+from ..framework import device_registry
 from .ad_acquire_detector_base import AD_AcquireDetectorBase
 from .ad_acquire_detector_base import AD_AcquireDetectorCamBase
 from .ad_imm_plugins import IMM_DeviceMixinBase
@@ -26,7 +27,6 @@ from ophyd import Staged
 from ophyd.areadetector import CamBase
 from ophyd.areadetector import DetectorBase
 import os
-import time as ttime
 
 logger.info(__file__)
 
@@ -205,9 +205,9 @@ class RigakuUfxcDetector(
         raise NotImplementedError("must override in subclass")
 
 
-# wait a bit for all previous PV connections to complete
+# wait (no longer than needed) for all previous PV connections to complete
 _delay = 2.5  # empirical determination (1.0 is too short, 2 tests OK)
-logger.info("Sleeping for %s seconds before creating adrigaku object.", _delay)
-ttime.sleep(_delay)
+logger.info("Waiting up to %s seconds before creating adrigaku object.", _delay)
+device_registry.connect_all(timeout=_delay)
 
 adrigaku = RigakuUfxcDetector(IOC_PREFIX, name="adrigaku")
\ No newline at end of file
@@ -14,13 +14,17 @@ logger.info(__file__)
 import apstools.devices
 from ophyd import Device, Component, Signal
 
+from ..framework import device_registry
 from ..framework import sd
 
 
 aps = apstools.devices.ApsMachineParametersDevice(name="aps")
-try:
-    aps.wait_for_connection(timeout=5.0)
-except TimeoutError:
+undulator = apstools.devices.ApsUndulatorDual("ID08", name="undulator")
+# wait for both at once
+_not_connected = device_registry.connect(aps, undulator, timeout=5.0)
+
+if aps in _not_connected:
+    device_registry.forget(aps)
     cycle=aps.aps_cycle.get()
     class SimulatedAPSDevice(Device):
         aps_cycle = Component(Signal, value=cycle)
@@ -32,10 +36,8 @@ except TimeoutError:
 
 sd.baseline.append(aps)
 
-undulator = apstools.devices.ApsUndulatorDual("ID08", name="undulator")
-try:
-    undulator.wait_for_connection(timeout=5.0)
-except TimeoutError:
+if undulator in _not_connected:
+    device_registry.forget(undulator)
     class SimulatedUndulatorDevice(Device):
         simulator = Component(Signal, value=True)
     undulator=SimulatedUndulatorDevice(name='undulator')
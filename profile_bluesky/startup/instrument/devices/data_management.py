@@ -15,9 +15,12 @@ __all__ = [
 from instrument.session_logs import logger
 logger.info(__file__)
 
+from bluesky import plan_stubs as bps
 from ophyd import Component, Device, EpicsMotor, EpicsSignal
 from spec_support.APS_DM_8IDI import DM_Workflow
 from ..devices import aps
+import time
+import uuid
 
 
 xpcs_qmap_file = "Lambda_qmap.h5"		# dm_workflow.set_xpcs_qmap_file("new_name.h5")
@@ -113,6 +116,81 @@ class DataManagementMetadata(Device):
     xspec = Component(EpicsSignal, "8idi:Reg15")
     zspec = Component(EpicsSignal, "8idi:Reg16")
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._register_queue = {}  # values waiting for commit_registers()
+        self._register_cache = {}  # values written by commit_registers()
+        self.register_latency = {}  # seconds per register, last commit
+
+    def queue_registers(self, **values):
+        """
+        remember new register values, to be written by commit_registers()
+
+        Keywords are the names of the components, such as::
+
+            dm_pars.queue_registers(data_begin=1, data_end=num_images)
+
+        Not a bluesky "plan" (no "yield from")
+        """
+        for name in values:
+            if name not in self.component_names:
+                raise KeyError(f"'{name}' is not a register of {self.name}")
+        self._register_queue.update(values)
+
+    def commit_registers(self, force=False):
+        """
+        (plan) write all queued register values in one step
+
+        All puts are issued together and waited for as one group.
+        A register is skipped if its value has not changed since
+        the last commit (and the register still reports that value),
+        unless ``force=True``.  The time each register took to complete
+        is kept in ``register_latency``.
+        """
+        queue, self._register_queue = self._register_queue, {}
+        writes = {}
+        for name, value in queue.items():
+            signal = getattr(self, name)
+            unchanged = (
+                name in self._register_cache
+                and self._register_cache[name] == value
+                and signal.get() == value  # monitored, no CA round trip
+            )
+            if force or not unchanged:
+                writes[name] = value
+        logger.debug(
+            "commit_registers: writing %d of %d registers", len(writes), len(queue)
+        )
+        self.register_latency = {}
+        if len(writes) == 0:
+            return
+
+        def make_callback(name, value, t0):
+            def callback(status):
+                self.register_latency[name] = time.time() - t0
+                if status.success:
+                    self._register_cache[name] = value
+            return callback
+
+        group = f"commit_registers-{uuid.uuid4()}"
+        t0 = time.time()
+        for name, value in writes.items():
+            # in case this put fails, force the next commit to try again
+            self._register_cache.pop(name, None)
+            status = yield from bps.abs_set(getattr(self, name), value, group=group)
+            status.add_callback(make_callback(name, value, t0))
+        yield from bps.wait(group=group)
+
+        logger.debug(
+            "commit_registers: %d registers in %.3fs", len(writes), time.time() - t0
+        )
+        if len(self.register_latency) > 0:
+            slowest = max(self.register_latency, key=self.register_latency.get)
+            logger.debug(
+                "commit_registers: slowest register %s, %.3fs",
+                slowest, self.register_latency[slowest],
+            )
+
 
 dm_pars = DataManagementMetadata(name="dm_pars")
 dm_workflow = DM_Workflow(
@@ -0,0 +1,44 @@
+"""
+Array-like stack of frames, read on demand from a file reader
+
+Used by the IMM and Rigaku readers (``to_dask()``).
+"""
+
+__all__ = [
+    "FrameStack",
+]
+
+from ..session_logs import logger
+
+logger.info(__file__)
+
+import numpy as np
+
+
+class FrameStack:
+    """
+    array-like adapter so dask reads frames of a file on demand
+
+    PARAMETERS
+
+    reader : object
+        has ``rows``, ``cols`` and ``frames(start, stop)``, such as
+        ``IMMFile`` or ``RigakuBinFile``
+    start, stop : int
+        frames ``start`` .. ``stop-1`` of the reader
+    dtype : numpy dtype, optional
+        of the frames, default: ``<u2``
+    """
+
+    def __init__(self, reader, start, stop, dtype="<u2"):
+        self.reader = reader
+        self.start = start
+        self.shape = (max(stop - start, 0), reader.rows, reader.cols)
+        self.dtype = np.dtype(dtype)
+        self.ndim = 3
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        first, last, step = key[0].indices(self.shape[0])
+        frames = self.reader.frames(self.start + first, self.start + last)
+        return frames[(slice(None, None, step),) + tuple(key[1:])]
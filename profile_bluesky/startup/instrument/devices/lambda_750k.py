@@ -36,6 +36,7 @@ from ophyd import EpicsSignalWithRBV
 from ophyd import Signal
 import itertools
 import os
+import threading
 import time
 import uuid
 
@@ -330,12 +331,16 @@ class Lambda750kLocal(
     stats1 = Component(StatsLocal, "Stats1:")
     image = Component(ExternalFileReference, value="", shape=[])
 
+    # seconds to wait for the detector to be ready for frame triggers
+    ext_trigger_timeout = 5
+
     # 8LAMBDA1:set1:userScript1 is a luascript record
     # lua_A = Component(EpicsSignal, "set1:userScript.A", kind="config") # TODO: where is this PV?
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._assets_docs_cache = []
+        self.ext_trigger_ready = None  # status, from trigger()
 
     @property
     def chk_ccdc(self):
@@ -471,26 +476,46 @@ class Lambda750kLocal(
                 shutter.close()
                 logger.info(f"status={status}")
 
-        shutter.open()
-        time.sleep(0.005)  # wait for the shutter to move out of the way
-        self.cam.state.subscribe(watch_state)
-        self.imm1.capture.subscribe(watch_acquire)
-        self.imm1.capture.put(1, wait=False)
-        self.cam.acquire.put(start_value, wait=False)
+        def watch_ready(value=None, **kwargs):
+            """
+            detector reports (to soft glue) when it is ready for frame triggers
+            """
+            with lock:
+                if value == 1 and not ready.done:
+                    logger.debug("ready for frame triggers after %.3fs", time.time() - t0)
+                    ready.set_finished()
+
+        def start_acquisition(shutter_status):
+            """
+            shutter is out of the way: start the detector
+            """
+            if not shutter_status.success:
+                exc = RuntimeError(f"could not open {shutter.name}")
+                status.set_exception(exc)
+                if ready is not None and not ready.done:
+                    ready.set_exception(exc)
+                return
+            self.cam.state.subscribe(watch_state)
+            self.imm1.capture.subscribe(watch_acquire)
+            self.imm1.capture.put(1, wait=False)
+            self.cam.acquire.put(start_value, wait=False)
+            if ready is not None:
+                signal = soft_glue.acquire_ext_trig_status
+                cid = signal.subscribe(watch_ready, run=False)
+                ready.add_callback(lambda st: signal.unsubscribe(cid))
+                watch_ready(value=signal.get())  # in case no new monitor event
+
+        t0 = time.time()
+        lock = threading.Lock()
+        ready = None
         if self.cam.EXT_TRIGGER > 0:
-            # t0 = time.time()
-            # while soft_glue.acquire_ext_trig_status.get() != 1:
-            #     # detector reports (to soft glue) when it is ready for frame triggers
-            #     # Lambda manufacturer recommends this is 0.5 sec or so
-            #     time.sleep(0.025)
-            #     t = time.time() - t0
-            #     if t > 5:
-            #         emsg = f"Lambda detector not ready for frame triggers after {t:.3f}s"
-            #         raise TimeoutError(emsg)
-            # t = time.time() - t0
-            # if t > .2e-10:
-            #     logger.debug(f"waited {t:.3f}s for detector to become ready for frame triggers")
-            time.sleep(0.5)  # manufacturer's minimum recommendation
+            # Wait for this (not a fixed 0.5 s, the manufacturer's minimum
+            # recommendation) before sending frame triggers.
+            ready = DeviceStatus(self, timeout=self.ext_trigger_timeout)
+        self.ext_trigger_ready = ready
+        # returns at once, start_acquisition() is called when shutter is open
+        shutter.set("open").add_callback(start_acquisition)
+
         index = next(self._datum_counter)
         datum_id = f"{self._resource_uid}/{index}"
         datum_doc = {
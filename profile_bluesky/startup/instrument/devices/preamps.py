@@ -8,6 +8,7 @@ __all__ = ['preamps',]
 from instrument.session_logs import logger
 logger.info(__file__)
 
+from ..framework.pv_metadata_cache import signal_metadata
 from ophyd import Component, Device, EpicsSignalRO
 
 
@@ -24,7 +25,8 @@ class PreampUnitNumberDevice(Device):
 
     @property
     def amp_scale(self):
-        enums = self.number.enum_strs
+        # cached from last session until number connects
+        enums = signal_metadata(self.number, "enum_strs")
         sensitivity_index = self.number.get()
         sensitivity = float(enums[sensitivity_index])
 
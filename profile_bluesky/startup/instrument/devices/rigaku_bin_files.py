@@ -0,0 +1,321 @@
+"""
+Support for the Rigaku zero-dead-time (ZDT) ``.bin`` files
+
+So databroker can read the files (resource ``spec: "RIGAKU"``).
+
+The file is a sequence of little-endian 64-bit events, one per
+non-zero pixel of each frame, in frame order::
+
+    bits 63..40   frame number
+    bits 36..16   pixel number (flat: ``row * cols + col``)
+    bits 11..0    counts (2-bit in ZDT mode)
+
+(the layout decoded by the Rigaku reader of the 8-ID XPCS viewer:
+``frame = w >> 40``, ``pixel = (w >> 16) & (2**21 - 1)``,
+``counts = w & 0xFFF``)
+
+Frames without any counts have no events.
+"""
+
+__all__ = """
+    RigakuBinFile
+    RigakuHandler
+    RigakuSparseHandler
+""".split()
+
+from ..session_logs import logger
+
+logger.info(__file__)
+
+from ..framework import db
+from .frame_stack import FrameStack
+from area_detector_handlers.handlers import HandlerBase
+import collections
+import dask.array
+import numpy as np
+import os
+import scipy.sparse
+
+RIGAKU_ROWS = 512
+RIGAKU_COLS = 1024
+RIGAKU_FRAME_SHIFT = 40
+RIGAKU_PIXEL_SHIFT = 16
+RIGAKU_PIXEL_MASK = (1 << 21) - 1
+RIGAKU_COUNT_MASK = (1 << 12) - 1
+RIGAKU_SCAN_CHUNK = 1 << 24  # events decoded at a time while indexing
+
+# sparse frames as a flat list of (frame, pixel, value) events
+RigakuPixels = collections.namedtuple("RigakuPixels", "frame pixel value")
+
+
+class RigakuBinFile:
+    """
+    memory-mapped reader for Rigaku ZDT ``.bin`` files
+
+    The frame index (``indptr``: events of frame ``i`` are
+    ``indptr[i]`` .. ``indptr[i+1]-1``) is built once, in one
+    vectorized pass, and saved beside the file
+    (``<filename>.toc.npz``).  Later opens reuse it while the size and
+    mtime of the file are unchanged.  Any frame is then found in O(1).
+The largest pixel number is kept with it: a file with pixels outside
+``rows * cols`` (corrupt, or another detector shape) raises
+``ValueError`` when opened.
+
+    PARAMETERS
+
+    filename : str
+        name of the ``.bin`` file
+    rows : int
+        default: 512
+    cols : int
+        default: 1024
+    use_index : bool
+        If `True` (default), read & write the sidecar index file.
+    """
+
+    index_suffix = ".toc.npz"
+    index_version = 2
+    dtype = np.dtype("<u2")
+
+    def __init__(self, filename, rows=RIGAKU_ROWS, cols=RIGAKU_COLS, use_index=True):
+        self.filename = filename
+        self.rows, self.cols = rows, cols
+        self.use_index = use_index
+        size = os.path.getsize(filename)
+        if size % 8 != 0:
+            logger.warning(
+                "Rigaku file %s: ignoring %d trailing bytes", filename, size % 8
+            )
+        if size < 8:
+            self._events = np.zeros(0, dtype="<u8")
+        else:
+            self._events = np.memmap(
+                filename, dtype="<u8", mode="r", shape=(size // 8,)
+            )
+
+        index = self._read_index() if use_index else None
+        if index is None:
+            self.indptr, self.max_pixel = self._scan()
+            if use_index:
+                self._write_index()
+        else:
+            self.indptr, self.max_pixel = index
+        if self.max_pixel >= rows * cols:
+            raise ValueError(
+                f"Rigaku file {filename}: pixel {self.max_pixel} is outside"
+                f" a {rows}x{cols} detector (corrupt file or wrong shape)"
+            )
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getstate__(self):
+        # re-open (do not copy) the memory map when pickled
+        return dict(
+            filename=self.filename,
+            rows=self.rows,
+            cols=self.cols,
+            use_index=self.use_index,
+        )
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def shape(self):
+        return (len(self), self.rows, self.cols)
+
+    @property
+    def index_file(self):
+        return self.filename + self.index_suffix
+
+    def close(self):
+        self._events = None
+
+    def _file_signature(self):
+        st = os.stat(self.filename)
+        return st.st_size, st.st_mtime_ns
+
+    def _scan(self):
+        """
+        build the frame index: count the events of each frame
+
+        RETURNS
+
+        (indptr, largest pixel number, -1 if no events)
+        """
+        counts = np.zeros(0, dtype=np.int64)
+        last_frame = 0
+        max_pixel = -1
+        for first in range(0, len(self._events), RIGAKU_SCAN_CHUNK):
+            events = self._events[first : first + RIGAKU_SCAN_CHUNK]
+            pixel = (events >> RIGAKU_PIXEL_SHIFT) & RIGAKU_PIXEL_MASK
+            max_pixel = max(max_pixel, int(pixel.max()))
+            frame = events >> RIGAKU_FRAME_SHIFT
+            if frame[0] < last_frame or np.any(frame[1:] < frame[:-1]):
+                raise IOError(f"Rigaku file {self.filename}: events not in frame order")
+            last_frame = frame[-1]
+            chunk_counts = np.bincount(frame.astype(np.int64))
+            if len(chunk_counts) > len(counts):
+                chunk_counts[: len(counts)] += counts
+                counts = chunk_counts
+            else:
+                counts[: len(chunk_counts)] += chunk_counts
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        logger.debug(
+            "Rigaku file %s: %d frames, %d events",
+            self.filename, len(counts), len(self._events),
+        )
+        return indptr, max_pixel
+
+    def _read_index(self):
+        """return the saved (indptr, max_pixel) if still valid, else None"""
+        if not os.path.exists(self.index_file):
+            return None
+        try:
+            with np.load(self.index_file) as index:
+                signature = tuple(int(v) for v in index["signature"])
+                if int(index["version"]) != self.index_version:
+                    return None
+                if signature != self._file_signature():
+                    return None
+                return (
+                    index["indptr"].astype(np.int64, copy=False),
+                    int(index["max_pixel"]),
+                )
+        except Exception as exc:
+            logger.debug("ignoring Rigaku index %s: %s", self.index_file, exc)
+            return None
+
+    def _write_index(self):
+        """save the index, atomically so concurrent readers never see half a file"""
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, "wb") as f:
+                np.savez(
+                    f,
+                    indptr=self.indptr,
+                    max_pixel=self.max_pixel,
+                    signature=np.array(self._file_signature(), dtype=np.int64),
+                    version=self.index_version,
+                )
+            os.replace(temp_file, self.index_file)
+        except OSError as exc:
+            # such as a read-only data directory: next open will scan again
+            logger.debug("could not write Rigaku index %s: %s", self.index_file, exc)
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _range(self, start, stop):
+        """
+        frames ``start`` .. ``stop-1``
+
+        Frames past the last event (no counts) are empty, not missing.
+        """
+        length = len(self) if stop is None else max(len(self), stop)
+        start, stop, _ = slice(start, stop).indices(length)
+        return start, max(stop, start)
+
+    def pixels(self, start=0, stop=None):
+        """
+        return the events of frames ``start`` .. ``stop-1`` as ``RigakuPixels``
+
+        ``frame`` is relative to ``start`` and ``pixel`` is the flat
+        (``row * cols + col``) pixel index.  Decoded (vectorized) from
+        the memory map, never expanded to full images.
+        """
+        start, stop = self._range(start, stop)
+        last = len(self)
+        first_event = self.indptr[min(start, last)]
+        last_event = self.indptr[min(stop, last)]
+        events = self._events[first_event:last_event]
+        frame = (events >> RIGAKU_FRAME_SHIFT).astype(np.uint32)
+        frame -= np.uint32(start)
+        pixel = ((events >> RIGAKU_PIXEL_SHIFT) & RIGAKU_PIXEL_MASK).astype(np.uint32)
+        value = (events & RIGAKU_COUNT_MASK).astype(self.dtype)
+        return RigakuPixels(frame, pixel, value)
+
+    def frame(self, i):
+        """return frame ``i`` as a (rows, cols) image"""
+        return self.frames(i, i + 1)[0]
+
+    def frames(self, start=0, stop=None):
+        """return frames ``start`` .. ``stop-1`` as a (n, rows, cols) array"""
+        start, stop = self._range(start, stop)
+        events = self.pixels(start, stop)
+        npix = self.rows * self.cols
+        stack = np.zeros((stop - start) * npix, dtype=self.dtype)
+        stack[events.frame.astype(np.int64) * npix + events.pixel] = events.value
+        return stack.reshape(stop - start, self.rows, self.cols)
+
+    def sparse_frames(self, start=0, stop=None):
+        """
+        return frames ``start`` .. ``stop-1`` as a CSR matrix
+
+        One row per frame, one column per (flat) pixel: shape is
+        ``(n, rows * cols)``.  The row pointers come from the frame
+        index, without decoding the frame numbers.
+        """
+        start, stop = self._range(start, stop)
+        events = self.pixels(start, stop)
+        last = len(self)
+        indptr = self.indptr[np.minimum(np.arange(start, stop + 1), last)]
+        return scipy.sparse.csr_matrix(
+            (events.value, events.pixel, indptr - indptr[0]),
+            shape=(stop - start, self.rows * self.cols),
+        )
+
+    def to_dask(self, start=0, stop=None, chunk_frames=100):
+        """return frames ``start`` .. ``stop-1`` as a lazy dask array"""
+        start, stop = self._range(start, stop)
+        stack = FrameStack(self, start, stop, self.dtype)
+        return dask.array.from_array(
+            stack,
+            chunks=(chunk_frames, self.rows, self.cols),
+            name=f"rigaku-{self.filename}-{self._file_signature()}-{start}-{stop}",
+            lock=False,
+            fancy=False,
+        )
+
+
+class RigakuHandler(HandlerBase):
+    """
+    databroker handler for Rigaku ZDT ``.bin`` files
+
+    Returns a lazy dask array of the frames of each datum.
+    """
+
+    specs = {"RIGAKU"}
+
+    def __init__(self, filename, frames_per_point):
+        self.rigaku = RigakuBinFile(filename)
+        self.frames_per_point = frames_per_point
+        self.rows, self.cols = self.rigaku.rows, self.rigaku.cols
+
+    def close(self):
+        self.rigaku.close()
+
+    def __call__(self, index):
+        logger.info(f"index: {index}")
+        start = index * self.frames_per_point
+        return self.rigaku.to_dask(start, start + self.frames_per_point)
+
+
+class RigakuSparseHandler(RigakuHandler):
+    """
+    databroker handler for Rigaku ZDT files, returning sparse frames
+
+    Each datum is a ``scipy.sparse.csr_matrix`` with one row per frame.
+    To use (instead of dense frames)::
+
+        db.reg.register_handler("RIGAKU", RigakuSparseHandler, overwrite=True)
+    """
+
+    def __call__(self, index):
+        logger.info(f"index: {index}")
+        start = index * self.frames_per_point
+        return self.rigaku.sparse_frames(start, start + self.frames_per_point)
+
+
+db.reg.register_handler("RIGAKU", RigakuHandler, overwrite=True)
@@ -22,67 +22,74 @@ from .shutters import shutter_control, shutter_override, shutteroff
 from bluesky import plan_stubs as bps
 from ophyd import Component, Device, DeviceStatus
 from ophyd import Signal, EpicsSignal, EpicsSignalRO
-import apstools.utils
+from ophyd.utils import InvalidState
+import collections
 import itertools
 import os
-import psutil
-import subprocess
+import threading
 import time
 import uuid
+from spec_support.rigaku_client import RigakuClient
 
 
-def get_process_info(pid):
-    process_info = psutil.Process(pid)
-    logger.info("process_info status: %s", process_info.status())
-    return process_info
+RIGAKU_HOST = "rigaku1.xray.aps.anl.gov"
+RIGAKU_PORT = 10000
+# Does the LabView server answer each command with a line?  Not yet
+# verified (it was used as ``echo ... | nc``): until it is, a command
+# is done once sent.
+RIGAKU_REPLIES = False
 
 
-class UnixCommandSignal(Signal):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        self.unix_command = None
-        self.unix_output = None
-        self.unix_error = None
-        self.process = None
-
-    def set(self, unix_command):
-        status = DeviceStatus(self)
-        self.unix_command = unix_command
-
-        # see: https://github.com/aps-8id-dys/ipython-8idiuser/issues/195
-
-        self.process = subprocess.Popen(
-            unix_command,
-            shell=True,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        pi = get_process_info(self.process.pid)
-        logger.info(
-            "command: %s - process info: pid=%s, info=%s",
-            unix_command,
-            self.process.pid,
-            pi,
-        )
+class RigakuCommandSignal(Signal):
+    """
+    send commands to the Rigaku LabView server (was: ``echo ... | nc``)
 
-        @apstools.utils.run_in_thread
-        def watch_process():
-            self.unix_output, self.unix_error = self.process.communicate()
-            self.process = None
-            status._finished()
+    ``set(command)`` returns at once (commands may be pipelined),
+    its status finishes with the server's reply (once sent, if
+    ``replies=False``).
+    ``put(command)`` waits for the reply.
+    ``get()`` returns the last reply text.
+    """
 
-        watch_process()
+    def __init__(self, *args, host=RIGAKU_HOST, port=RIGAKU_PORT,
+                 timeout=5.0, replies=RIGAKU_REPLIES, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = RigakuClient(host, port, timeout=timeout, replies=replies)
+        self.last_reply = None
+
+    def set(self, command):
+        status = DeviceStatus(self, timeout=self.client.timeout)
+        future = self.client.send(command)
+
+        def finished(future):
+            try:
+                self.last_reply = future.result()
+                logger.debug(
+                    "rigaku %s: %r in %.4fs",
+                    command,
+                    self.last_reply.text,
+                    self.last_reply.latency,
+                )
+                status.set_finished()
+            except Exception as exc:
+                logger.error("rigaku %s: %s", command, exc)
+                status.set_exception(exc)
+
+        def timed_out(status):
+            if not status.success:
+                self.client.abandon(future)     # no reply is coming
+
+        future.add_done_callback(finished)
+        status.add_callback(timed_out)
         return status
 
-    def put(self, unix_command):
-        status = self.set(unix_command)
-        while not status.done:
-            time.sleep(0.001)
+    def put(self, command):
+        self.last_reply = self.client.command(command)
 
     def get(self):
-        return self.unix_output.decode(), self.unix_error.decode()
+        if self.last_reply is None:
+            return ""
+        return self.last_reply.text
 
 
 class ShutterModeSignal(EpicsSignal):
@@ -162,11 +169,12 @@ class Rigaku_8IDI(AD_AcquireDetectorBase, DM_DeviceMixinAreaDetector, Device):
         "8idi:softGlueC:AND-4_IN2_Signal", name="shutter_mode"
     )
 
-    unix_process = Component(UnixCommandSignal)
+    control = Component(RigakuCommandSignal)
 
     batch_name = Component(Signal, value="A001")
 
     detector_number = 46  # 8-ID-I numbering of this detector
+    trigger_timeout = 60    # seconds
 
     _assets_docs_cache = []
     _datum_counter = None
@@ -176,6 +184,10 @@ class Rigaku_8IDI(AD_AcquireDetectorBase, DM_DeviceMixinAreaDetector, Device):
     cam = Component(RigakuFakeCam)
     image = Component(RigakuFakeImage)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.trigger_latency = collections.deque(maxlen=100)
+
     def stage(self):
         # prepare to write the document stream for Xi-CAM handling
         root = os.path.join("/", "home", "8-id-i-stage/")
@@ -209,31 +221,64 @@ class Rigaku_8IDI(AD_AcquireDetectorBase, DM_DeviceMixinAreaDetector, Device):
         # shutter_control.put() is required for data mode
         # For legacy reasons, it is here and not in data_mode().
         shutter_control.put("Open")
-        cmd = f"echo FILE:F:{self.batch_name.get()} | nc rigaku1.xray.aps.anl.gov 10000"
-        self.unix_process.put(cmd)
+        self.control.put(f"FILE:F:{self.batch_name.get()}")
 
     def trigger(self):
-        # Tell Rigaku to stop acquisition and wait until it's ready
-        # self.acquire_start.put(0)
-        while self.acquire_complete.get() in (1, "High"):
-            time.sleep(0.1)
-
-        # Getting ready to watch acquisition complete
-        status = DeviceStatus(self)
-
-        def watch_acquire(value, old_value, **kwargs):
-            if value == 1 and old_value == 0:
-                # self.acquire_start.put(0)
-                self.acquire_complete.clear_sub(watch_acquire)
-                status._finished()
-
-        # Start acquisition
-        self.acquire_complete.subscribe(watch_acquire)
-        time.sleep(0.1)  # QZ 06/28/20: No reason. Put it there to improve stability
-        # self.acquire_start.put(1)
-        self.unix_process.put("echo EXPOSURE | nc rigaku1.xray.aps.anl.gov 10000")
-        time.sleep(0.1)  # could be shorter, this works now
-        # self.acquire_start.put(0)  # Stop acquisition
+        """
+        start an exposure once the detector is ready, monitor-driven
+
+        State machine, driven by ``acquire_complete`` monitor events:
+        wait until the detector is ready (not ``High``), then send
+        ``EXPOSURE``, then finish on the next rising edge.
+        Fails after ``trigger_timeout`` seconds, or as soon as the
+        server rejects ``EXPOSURE`` (or can not be reached).
+        """
+        status = DeviceStatus(self, timeout=self.trigger_timeout)
+        times = dict(trigger=time.time())
+        lock = threading.Lock()
+
+        def start_exposure():
+            times["ready"] = time.time()
+            # no need to wait for the reply, acquire_complete tells when done
+            sent = self.control.set("EXPOSURE")
+            sent.add_callback(exposure_failed)
+            times["sent"] = time.time()
+
+        def exposure_failed(sent):
+            # ERR reply or no connection: fail now, not after trigger_timeout
+            if not sent.success:
+                try:
+                    status.set_exception(sent.exception())
+                except InvalidState:
+                    pass    # already done
+
+        def watch_acquire(value=None, old_value=None, **kwargs):
+            with lock:
+                if status.done:
+                    return
+                if "ready" not in times:
+                    if value not in (1, "High"):
+                        start_exposure()
+                elif value == 1 and old_value == 0:
+                    times["complete"] = time.time()
+                    status.set_finished()
+
+        def record_latency(status):
+            self.acquire_complete.unsubscribe(cid)
+            if status.success:
+                latency = dict(
+                    wait_ready=times["ready"] - times["trigger"],
+                    send=times["sent"] - times["ready"],
+                    exposure=times["complete"] - times["sent"],
+                    total=times["complete"] - times["trigger"],
+                )
+                self.trigger_latency.append(latency)
+                logger.debug("rigaku trigger latency (s): %s", latency)
+
+        cid = self.acquire_complete.subscribe(watch_acquire, run=False)
+        status.add_callback(record_latency)
+        # in case the detector is ready already (no new monitor event)
+        watch_acquire(value=self.acquire_complete.get())
 
         # write the document stream for Xi-CAM handling
         index = next(self._datum_counter)
@@ -19,6 +19,7 @@ __all__ = """
 from ..session_logs import logger
 logger.info(__file__)
 
+from ..framework import device_registry
 from .data_management import DM_DeviceMixinScaler
 from ophyd.scaler import ScalerCH
 from ophyd import Kind
@@ -109,23 +110,10 @@ class LocalScalerCH(DM_DeviceMixinScaler, FixScalerCH):
 
 
 _scaler_pv = "8idi:scaler1"
-RETRIES = 5
-for _retry in range(RETRIES):
-    scaler1 = None
-    try:
-        scaler1 = LocalScalerCH(_scaler_pv, name='scaler1', labels=["scalers", "detectors"])
-        break            # success!
-    except TimeoutError:
-        logger.error(f"attempt #{_retry + 1} failed to connect with PV '{_scaler_pv}'")
-        # no need to sleep since each connection attempt has 1 second timeout
-
-if scaler1 is None:
-    emsg = f"could not connect with PV '{_scaler_pv}' in {RETRIES} attempts"
-    logger.error(emsg)
-    raise TimeoutError(emsg)
-
-
-scaler1.select_channels()   # choose just the channels with EPICS names
+scaler1 = LocalScalerCH(_scaler_pv, name='scaler1', labels=["scalers", "detectors"])
+
+# choose just the channels with EPICS names, once connected
+device_registry.register(scaler1, on_connect=lambda scaler: scaler.select_channels())
 
 timebase = scaler1.channels.chan01.s
 pind1 = scaler1.channels.chan02.s
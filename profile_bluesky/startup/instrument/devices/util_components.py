@@ -10,6 +10,8 @@ from ophyd import (
 from ..session_logs import logger
 logger.info(__file__)
 
+from ..framework.pv_metadata_cache import signal_metadata
+
 
 class DoneSignal(Signal):
     """ Signal that tracks if two values become the same. """
@@ -100,7 +102,8 @@ class PVPositionerSoftDone(PVPositioner):
 
     @property
     def precision(self):
-        return self.setpoint.precision
+        # cached from last session until setpoint connects
+        return signal_metadata(self.setpoint, "precision")
 
     def cb_readback(self, *args, **kwargs):
         """
@@ -2,6 +2,8 @@ from .check_python import *
 from .check_bluesky import *
 
 from .initialize import *
+from .pv_metadata_cache import *
+from .device_registry import *
 from .user_dir import *
 from .metadata import *
 from .callbacks import *
@@ -0,0 +1,306 @@
+"""
+connect the ophyd devices concurrently, report the connection times
+
+Every top-level ophyd object is registered when it is created (until
+``stop_recording()``, once the startup devices exist).  The registry
+keeps only weak references: objects deleted since are forgotten.
+Creating an object does not wait for its PVs to connect.
+``device_registry.connect_all()`` (called once all devices are
+created) then waits for all of them at the same time, with one
+deadline, so the startup wait is that of the slowest device,
+not the sum of all.
+
+Devices registered with ``lazy=True``, and those not connected by
+the deadline, keep connecting in the background.  Their PVs wait
+for the connection at first use.  ``on_connect`` runs once per
+device, whichever waiter sees it connect first.
+
+With a ``pv_cache``, devices whose PV metadata are known from the
+previous session are not waited for at all.  They are checked in the
+background, which also refreshes their cached metadata.
+
+EXAMPLE::
+
+    device_registry.register(scaler1, on_connect=lambda d: d.select_channels())
+    device_registry.connect_all(timeout=5)
+    print(device_registry.report())
+"""
+
+__all__ = [
+    "device_registry",
+]
+
+from ..session_logs import logger
+
+logger.info(__file__)
+
+from .pv_metadata_cache import pv_metadata_cache
+from ophyd.ophydobj import OphydObject
+import concurrent.futures
+import pyRestTable
+import threading
+import time
+import weakref
+
+
+class _Entry:
+    """bookkeeping for one registered device"""
+
+    def __init__(self, device, lazy=False, on_connect=None, on_delete=None):
+        self._device = weakref.ref(device, on_delete)
+        self.lazy = lazy
+        self.on_connect = on_connect
+        self.t_created = time.time()
+        self.connect_time = None    # seconds from creation to connection
+        self.connected = False      # setup (on_connect) started
+        self.ready = False          # connected and on_connect has run
+        self.cached = False         # not waited for, known from PV cache
+        self.waiting = False        # a background waiter is running
+        self.lock = threading.Lock()
+
+    @property
+    def device(self):
+        """the device, None if it has been deleted"""
+        return self._device()
+
+
+class DeviceRegistry:
+    """
+    ophyd devices, connected concurrently
+
+    PARAMETERS
+
+    timeout : float, optional
+        default deadline (s) for ``connect_all()``, default: 5
+    workers : int, optional
+        number of threads waiting for connections, default: 16
+    background_timeout : float, optional
+        how long (s) to keep waiting, in the background, for devices
+        not connected by the deadline, default: 60
+    pv_cache : PVMetadataCache, optional
+        PV metadata from the previous session, default: None
+    """
+
+    def __init__(self, timeout=5.0, workers=16, background_timeout=60.0,
+                 pv_cache=None):
+        self.timeout = timeout
+        self.workers = workers
+        self.background_timeout = background_timeout
+        self.pv_cache = pv_cache
+        self.recording = True
+        self._entries = {}  # {id(device): _Entry}
+        self._lock = threading.Lock()
+
+    def _new_entry(self, device):
+        key = id(device)
+
+        def on_delete(ref):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry._device is ref:
+                    del self._entries[key]
+
+        return _Entry(device, on_delete=on_delete)
+
+    def _instantiated(self, obj):
+        """ophyd instantiation callback: register top-level objects"""
+        if not self.recording:
+            return
+        if getattr(obj, "parent", None) is None and hasattr(obj, "wait_for_connection"):
+            with self._lock:
+                if id(obj) not in self._entries:
+                    self._entries[id(obj)] = self._new_entry(obj)
+
+    def stop_recording(self):
+        """do not register objects as they are created (startup is done)"""
+        self.recording = False
+
+    def register(self, device, lazy=False, on_connect=None):
+        """
+        (re)register ``device``, returns it
+
+        PARAMETERS
+
+        lazy : bool, optional
+            If True, ``connect_all()`` does not wait for this device.
+        on_connect : callable, optional
+            ``on_connect(device)`` is called once the device is connected.
+        """
+        with self._lock:
+            entry = self._entries.get(id(device))
+            if entry is None or entry.device is not device:
+                entry = self._new_entry(device)
+                self._entries[id(device)] = entry
+            entry.lazy = lazy
+            entry.on_connect = on_connect
+        return device
+
+    def forget(self, device):
+        """remove ``device`` (such as one replaced by a simulator)"""
+        with self._lock:
+            self._entries.pop(id(device), None)
+
+    @property
+    def devices(self):
+        """list of the registered devices"""
+        with self._lock:
+            devices = [entry.device for entry in self._entries.values()]
+        return [device for device in devices if device is not None]
+
+    def _wait(self, entry, deadline):
+        """wait (until ``deadline``) for one device, True if connected"""
+        if entry.connected:
+            return True
+        device = entry.device
+        if device is None:
+            return False
+        try:
+            device.wait_for_connection(timeout=max(0.001, deadline - time.time()))
+        except TimeoutError:
+            return False
+        except Exception as exc:
+            logger.warning("%s: %s", device.name, exc)
+            return False
+        self._setup(entry, device)
+        return True
+
+    def _setup(self, entry, device):
+        """complete the setup of a connected device, only once"""
+        with entry.lock:
+            if entry.connected:
+                return
+            entry.connected = True
+        entry.connect_time = time.time() - entry.t_created
+        if self.pv_cache is not None:
+            for pvname in self.pv_cache.update_from(device):
+                logger.warning("%s: PV metadata changed since last session: %s",
+                               device.name, pvname)
+        if entry.on_connect is not None:
+            try:
+                entry.on_connect(device)
+            except Exception as exc:
+                logger.error("%s: on_connect failed: %s", device.name, exc)
+        entry.ready = True
+
+    def connect(self, *devices, timeout=None):
+        """
+        wait (concurrently) for ``devices`` to connect
+
+        Returns the list of devices not connected by the deadline.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        entries = []
+        for device in devices:
+            if id(device) not in self._entries:
+                self.register(device)
+            entries.append(self._entries[id(device)])
+        return self._connect(entries, timeout)
+
+    def connect_all(self, timeout=None):
+        """
+        wait (concurrently) for all registered devices, except lazy ones
+
+        Devices known to ``pv_cache`` are checked in the background.
+        Returns the list of devices not connected by the deadline.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            entries = [
+                entry
+                for entry in self._entries.values()
+                if not (entry.lazy or entry.connected or entry.cached)
+                and entry.device is not None
+            ]
+        if self.pv_cache is not None:
+            cached = [e for e in entries if self.pv_cache.knows(e.device)]
+            for entry in cached:
+                entry.cached = True
+                self._wait_in_background(entry)
+            if len(cached) > 0:
+                logger.info("%d device(s) known from PV cache, checked in background",
+                            len(cached))
+            entries = [e for e in entries if not e.cached]
+        return self._connect(entries, timeout)
+
+    def _wait_in_background(self, entry):
+        """wait in a thread (complete the setup when connected), one per device"""
+        device = entry.device
+        with entry.lock:
+            if entry.waiting or entry.connected or device is None:
+                return
+            entry.waiting = True
+        name = device.name
+        del device      # the waiter holds only the entry (weak reference)
+
+        def waiter():
+            try:
+                if not self._wait(entry, time.time() + self.background_timeout):
+                    logger.warning("%s: not connected after %s s",
+                                   name, self.background_timeout)
+            finally:
+                entry.waiting = False
+
+        threading.Thread(
+            target=waiter,
+            name=f"connect_{name}",
+            daemon=True,
+        ).start()
+
+    def _connect(self, entries, timeout):
+        if len(entries) == 0:
+            return []
+        t0 = time.time()
+        deadline = t0 + timeout
+        workers = max(1, min(self.workers, len(entries)))
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="connect"
+        ) as executor:
+            results = list(executor.map(lambda e: self._wait(e, deadline), entries))
+        waiting = [e for e, ok in zip(entries, results) if not ok]
+        logger.info(
+            "%d of %d device(s) connected in %.3f s",
+            len(entries) - len(waiting),
+            len(entries),
+            time.time() - t0,
+        )
+        for entry in waiting:
+            device = entry.device
+            if device is None:
+                continue
+            logger.warning(
+                "%s: not connected yet, will connect in background", device.name)
+            if entry.on_connect is not None:
+                # complete the device's setup when it does connect
+                self._wait_in_background(entry)
+        if self.pv_cache is not None:
+            self.pv_cache.save()
+        devices = [entry.device for entry in waiting]
+        return [device for device in devices if device is not None]
+
+    def report(self):
+        """table of the devices, slowest connection first"""
+
+        def sort_key(entry):
+            if entry.connect_time is None:
+                return float("inf")
+            return entry.connect_time
+
+        with self._lock:
+            entries = sorted(self._entries.values(), key=sort_key, reverse=True)
+        table = pyRestTable.Table()
+        table.labels = "name class lazy cached connected connect_time(s)".split()
+        for entry in entries:
+            device = entry.device
+            if device is None:
+                continue
+            connected = entry.ready or bool(getattr(device, "connected", False))
+            seconds = "" if entry.connect_time is None else f"{entry.connect_time:.3f}"
+            table.addRow(
+                (device.name, device.__class__.__name__, entry.lazy, entry.cached,
+                 connected, seconds)
+            )
+        return table
+
+
+device_registry = DeviceRegistry(pv_cache=pv_metadata_cache)
+OphydObject.add_instantiation_callback(device_registry._instantiated)
@@ -0,0 +1,139 @@
+"""
+remember PV metadata (enum_strs, precision, units) between sessions
+
+The metadata of each connected EPICS signal is saved (keyed by PV
+name) when the session ends.  In the next session, a device whose
+PVs are all known is not waited for at startup: it is checked in the
+background and any metadata changed in the IOC is reported then.
+Until its PVs connect, ``signal_metadata()`` answers from the cache.
+
+EXAMPLE::
+
+    enums = signal_metadata(preamps.pind1.number, "enum_strs")
+"""
+
+__all__ = [
+    "pv_metadata_cache",
+    "signal_metadata",
+]
+
+from ..session_logs import logger
+
+logger.info(__file__)
+
+import atexit
+import json
+import os
+import threading
+import time
+
+CACHE_FILE = os.path.join(
+    os.environ.get("HOME", "/tmp"), ".config", "bluesky_pv_metadata.json"
+)
+CACHE_VERSION = 1
+METADATA_KEYS = "enum_strs precision units".split()
+
+
+def epics_signals(obj):
+    """list of the EPICS signals of ophyd ``obj`` (a Device or a Signal)"""
+    if hasattr(obj, "walk_signals"):
+        signals = [walk.item for walk in obj.walk_signals(include_lazy=False)]
+    else:
+        signals = [obj]
+    return [signal for signal in signals if hasattr(signal, "pvname")]
+
+
+class PVMetadataCache:
+    """
+    PV metadata, loaded from (and saved to) a JSON file
+
+    PARAMETERS
+
+    cache_file : str, optional
+        default: ``~/.config/bluesky_pv_metadata.json``
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or CACHE_FILE
+        self.pvs = {}   # {pvname: {key: value}}
+        self._changed = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """read the cache file, if any"""
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r") as f:
+                cache = json.load(f)
+            if cache["version"] == CACHE_VERSION:
+                with self._lock:
+                    self.pvs.update(cache["pvs"])
+        except Exception as exc:
+            logger.debug("ignoring PV metadata cache %s: %s", self.cache_file, exc)
+
+    def save(self):
+        """write the cache file (only if anything changed)"""
+        with self._lock:
+            if not self._changed:
+                return
+            cache = dict(version=CACHE_VERSION, pvs=dict(self.pvs))
+            self._changed = False
+        temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(temp_file, "w") as f:
+                json.dump(cache, f)
+            os.replace(temp_file, self.cache_file)
+        except OSError as exc:
+            logger.debug("could not write PV metadata cache %s: %s", self.cache_file, exc)
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def get(self, pvname, key, default=None):
+        return self.pvs.get(pvname, {}).get(key, default)
+
+    def knows(self, obj):
+        """Are all EPICS signals of ophyd ``obj`` in the cache?"""
+        signals = epics_signals(obj)
+        return len(signals) > 0 and all(s.pvname in self.pvs for s in signals)
+
+    def update_from(self, obj):
+        """
+        record the metadata of the connected signals of ophyd ``obj``
+
+        Returns the names of the PVs whose metadata had changed.
+        """
+        changed = []
+        for signal in epics_signals(obj):
+            if not signal.connected:
+                continue
+            live = signal.metadata
+            md = {key: live.get(key) for key in METADATA_KEYS}
+            if md["enum_strs"] is not None:
+                md["enum_strs"] = list(md["enum_strs"])
+            with self._lock:
+                previous = self.pvs.get(signal.pvname)
+                if previous is None or {k: previous.get(k) for k in METADATA_KEYS} != md:
+                    if previous is not None:
+                        changed.append(signal.pvname)
+                    md["timestamp"] = time.time()
+                    self.pvs[signal.pvname] = md
+                    self._changed = True
+        return changed
+
+
+def signal_metadata(signal, key):
+    """
+    metadata ``key`` of EPICS ``signal``: live if connected, else cached
+    """
+    if signal.connected:
+        value = signal.metadata.get(key)
+        if value is not None:
+            return value
+    return pv_metadata_cache.get(signal.pvname, key)
+
+
+pv_metadata_cache = PVMetadataCache()
+atexit.register(pv_metadata_cache.save)
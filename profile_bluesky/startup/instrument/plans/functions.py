@@ -3,11 +3,14 @@
 various functions
 """
 
-__all__ = ["taylor_series", ]
+__all__ = ["taylor_series", "wait_status", ]
 
 from instrument.session_logs import logger
 logger.info(__file__)
 
+from bluesky import plan_stubs as bps
+import asyncio
+
 
 def taylor_series(x, coefficients):
     """
@@ -19,3 +22,24 @@ def taylor_series(x, coefficients):
     for a in reversed(coefficients):
         v = v*x + a
     return v
+
+
+def wait_status(status):
+    """
+    (plan) wait for an ophyd status object, driven by its callback
+
+    Returns True if it succeeded, False if it failed (or timed out).
+    """
+    def awaitable():
+        loop = asyncio.get_event_loop()     # the RunEngine's loop
+        future = loop.create_future()
+
+        def done(st):
+            loop.call_soon_threadsafe(
+                lambda: future.done() or future.set_result(st.success))
+
+        status.add_callback(done)
+        return future
+
+    yield from bps.wait_for([awaitable])
+    return status.success
@@ -6,7 +6,10 @@ Bluesky plans to use the EPICS PV registers
 __all__ = """
     get_detector_number_by_name
     pv_reg_read
+    pv_reg_read_range
     pv_reg_write
+    pv_reg_write_range
+    register_bank
     beam_params_backup
     beam_params_restore
     select_LAMBDA
@@ -21,7 +24,10 @@ from ..devices import detu, detd, dm_pars, dm_workflow
 # from ..devices import shutter_override
 from ..devices import soft_glue
 from ophyd import EpicsSignal
+import concurrent.futures
+import numpy as np
 import pyRestTable
+import threading
 # from .shutters import blockbeam
 
 
@@ -42,15 +48,122 @@ PV_REG_MAP = {
     "burst mode pv" : "8idi:Reg124",    # added May 2019
 }
 
-PV_REG_MAP["registers"] = [     # each register is a signal
-    EpicsSignal(
-        PV_REG_MAP["template"] % (i+1),
-        name="pv_reg%d" % (i+1)
-        )
-    for i in range(PV_REG_MAP["highest register"])
-    ]
+class PVRegisterBank:
+    """
+    EPICS PV registers (``8idi:Reg1`` .. ``8idi:Reg200``), created on demand
+
+    No register is created (or connected) until first used.
+    A range of registers is created, then read (or written) in one
+    concurrent step.  The last values read or written are kept
+    in ``values`` (numpy array, indexed by register number, NaN if
+    not known).  Item ``bank[num]`` is the ``EpicsSignal`` of register
+    ``num`` (``None`` for 0 since there is no ``8idi:Reg0``).
+
+    EXAMPLE::
+
+        bank.read(11, 10)                       # values of Reg11..Reg20
+        yield from bank.write(91, [1, 2, 3])    # Reg91..Reg93, one step
+        yield from bank.copy(11, 91, 10)        # Reg11..20 -> Reg91..100
+    """
 
-PV_REG_MAP["registers"].insert(0, None)     # offset since no 8idi:Reg0
+    def __init__(self, template, highest):
+        self.template = template
+        self.highest = highest
+        self._signals = [None] * (highest + 1)
+        self.values = np.full(highest + 1, np.nan)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.highest + 1
+
+    def __getitem__(self, num):
+        if num == 0:
+            return None
+        return self.signals(num, 1)[0]
+
+    def _range(self, first, count):
+        if first < 1 or count < 0 or first + count - 1 > self.highest:
+            raise IndexError(
+                f"registers {first}..{first + count - 1}"
+                f" not in range 1..{self.highest}"
+            )
+        return range(first, first + count)
+
+    def signals(self, first, count):
+        """list of EpicsSignals for registers ``first`` .. ``first+count-1``"""
+        numbers = self._range(first, count)
+        with self._lock:
+            for i in numbers:
+                if self._signals[i] is None:
+                    # connects in the background, all at once
+                    self._signals[i] = EpicsSignal(
+                        self.template % i, name=f"pv_reg{i}"
+                    )
+        return [self._signals[i] for i in numbers]
+
+    def read(self, first, count):
+        """read (concurrently) registers ``first`` .. ``first+count-1``"""
+        signals = self.signals(first, count)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(16, max(1, count))
+        ) as executor:
+            values = list(executor.map(lambda signal: signal.get(), signals))
+        values = np.array(values, dtype=float)
+        self.values[first : first + count] = values
+        return values
+
+    def write(self, first, values):
+        """(plan) write ``values`` to registers starting at ``first``, one step"""
+        values = np.asarray(values, dtype=float)
+        signals = self.signals(first, len(values))
+        if len(signals) == 0:
+            return
+        args = []
+        for signal, value in zip(signals, values):
+            args += [signal, value]
+        yield from bps.mv(*args)
+        self.values[first : first + len(values)] = values
+
+    def diff(self, first_a, first_b, count):
+        """
+        compare register ranges, returns register offsets that differ
+
+        ``read()`` both ranges first (or use ``self.values``).
+        """
+        a = self.values[first_a : first_a + count]
+        b = self.values[first_b : first_b + count]
+        # equal NaN are equal
+        return np.flatnonzero(~((a == b) | (np.isnan(a) & np.isnan(b))))
+
+    def copy(self, source, target, count, table=None):
+        """
+        (plan) copy registers ``source..`` to ``target..`` in one step
+
+        Only registers that differ are written.
+        Rows (value, from, to) are added to optional pyRestTable ``table``.
+        """
+        values = self.read(source, count)
+        self.read(target, count)
+        changed = self.diff(source, target, count)
+        if table is not None:
+            for i, value in enumerate(values):
+                table.addRow(
+                    (value, self.template % (source + i), self.template % (target + i))
+                )
+        if len(changed) == 0:
+            return
+        signals = self.signals(target, count)
+        args = []
+        for i in changed:
+            args += [signals[i], values[i]]
+        yield from bps.mv(*args)
+        self.values[target : target + count] = values
+
+
+register_bank = PVRegisterBank(
+    PV_REG_MAP["template"], PV_REG_MAP["highest register"]
+)
+PV_REG_MAP["registers"] = register_bank    # register_bank[num] is a signal
 
 
 def get_detector_number_by_name(detName):
@@ -69,6 +182,11 @@ def pv_reg_read(num):
         return register.get()
 
 
+def pv_reg_read_range(first, count):
+    """read ``count`` PV registers starting at ``first``, as numpy array"""
+    return register_bank.read(first, count)
+
+
 def pv_reg_write(num, value):
     """read a value to PV register (indexed by number)"""
     global PV_REG_MAP
@@ -77,6 +195,11 @@ def pv_reg_write(num, value):
         yield from bps.mv(register, value)
 
 
+def pv_reg_write_range(first, values):
+    """write ``values`` to PV registers starting at ``first``, in one step"""
+    yield from register_bank.write(first, values)
+
+
 def beam_params_backup():
     """
     copy detector registers from current to detector
@@ -97,11 +220,8 @@ def beam_params_backup():
     t.addLabel("value")
     t.addLabel("from")
     t.addLabel("to")
-    for i in range(PV_REG_MAP["registers/detector"]):
-        target = PV_REG_MAP["registers"][i + offset]
-        source = PV_REG_MAP["registers"][i + offset_current]
-        t.addRow((source.get(), source.pvname, target.pvname))
-        yield from bps.mv(target, source.get())
+    yield from register_bank.copy(
+        offset_current, offset, PV_REG_MAP["registers/detector"], table=t)
     logger.debug(f"Detector {detName} Beam Params are Backed up\n{t}")
 
 
@@ -125,12 +245,8 @@ def beam_params_restore():
     t.addLabel("value")
     t.addLabel("from")
     t.addLabel("to")
-    for i in range(PV_REG_MAP["registers/detector"]):
-        source = PV_REG_MAP["registers"][i + offset]
-        target = PV_REG_MAP["registers"][i + offset_current]
-        t.addRow((source.get(), source.pvname, target.pvname))
-        yield from bps.mv(target, source.get())
-        # logger.debug(f"{target.pvname} = {target.get()}")
+    yield from register_bank.copy(
+        offset, offset_current, PV_REG_MAP["registers/detector"], table=t)
     logger.debug(f"Detector {detName} Beam Params are restored\n{t}")
 
 
@@ -1,5 +1,3 @@
-
-
 """
 Acquisition of Rigaku Zero-Dead-Time 52 kHz mode
 Bypassing EPICS file plugin and save directly as .bin binary format
@@ -11,46 +9,94 @@ __all__ = [
     'Rigaku_52kHz',
 ]
 
+from instrument.session_logs import logger
+logger.info(__file__)
 
-
+from .functions import wait_status
 from ophyd import Device
 from ophyd import EpicsSignal
 from ophyd import Component as Cpt
+from ophyd.status import SubscriptionStatus
+from ophyd.utils import InvalidState
 from bluesky import plan_stubs as bps
+import time
 
 
-def Rigaku_52kHz(rigaku500k, num_repeats=5):
+def _wait_det_state(rigaku500k, idle, timeout):
+    """
+    (plan) wait (on monitor events) for ``det_state`` to be (not) ``Idle``
+
+    Returns True if it did within ``timeout`` s.
     """
-    Modularized code that handles **only** Rigaku ZDT acquisition 
-    Does not talk to DM Workflow     
+    def is_ready(value=None, **kwargs):
+        return (value == "Idle") == idle
+
+    signal = rigaku500k.cam1.det_state
+    status = SubscriptionStatus(signal, is_ready, run=True, timeout=timeout)
+    # run=True only replays a monitor event already received, if any
+    if not status.done and is_ready(value=signal.get(as_string=True)):
+        try:
+            status.set_finished()
+        except InvalidState:
+            pass    # a monitor event finished it meanwhile
+    return (yield from wait_status(status))
+
+
+def Rigaku_52kHz(
+    rigaku500k,
+    num_repeats=5,
+    idle_timeout=300,
+    start_timeout=1.0,
+    start_retries=10,
+):
+    """
+    Modularized code that handles **only** Rigaku ZDT acquisition
+    Does not talk to DM Workflow
     Completely independent from other detectors or even other modes on the same detector
+
+    Waits (by monitor, no polling) up to ``idle_timeout`` s for the detector
+    to be ``Idle``, then starts an acquisition.  The start is repeated if
+    the detector has not left ``Idle`` after ``start_timeout`` s
+    (at most ``start_retries`` times).  Reports the latency of each start.
     """
 
-    yield from bps.mv(rigaku500k.cam1.acquire_time, 20e-6)    
-    yield from bps.mv(rigaku500k.cam1.image_mode, 5)   
-    yield from bps.mv(rigaku500k.cam1.trigger_mode, 4)   
-    yield from bps.mv(rigaku500k.cam1.num_images, 100000)   
-    yield from bps.mv(rigaku500k.cam1.corrections, "Enabled")       
+    yield from bps.mv(rigaku500k.cam1.acquire_time, 20e-6)
+    yield from bps.mv(rigaku500k.cam1.image_mode, 5)
+    yield from bps.mv(rigaku500k.cam1.trigger_mode, 4)
+    yield from bps.mv(rigaku500k.cam1.num_images, 100000)
+    yield from bps.mv(rigaku500k.cam1.corrections, "Enabled")
     yield from bps.mv(rigaku500k.cam1.data_type, "UInt32")
 
 
 
-    # TO-DO: 
-    # Read folder name, etc. from Init_User 
+    # TO-DO:
+    # Read folder name, etc. from Init_User
     # Read sample name from Init_QNW. For now assume all users will use QNW.
-    yield from bps.mv(rigaku500k.cam1.file_path, '2021-3/bluesky202112/')  
+    yield from bps.mv(rigaku500k.cam1.file_path, '2021-3/bluesky202112/')
 
     for ival in range(1, num_repeats):
-    
+
         _filename= "ZDT{:02d}_{:06d}.bin".format(1,ival)
 
-        while rigaku500k.cam1.det_state.get(as_string=True) != "Idle":
-            yield from bps.sleep(0.1)
+        t0 = time.time()
+        if not (yield from _wait_det_state(rigaku500k, True, idle_timeout)):
+            raise TimeoutError(
+                f"Rigaku not Idle after {idle_timeout} s, before {_filename}")
+        t_idle = time.time()
 
         print(f"Start Rigaku Acquire: {_filename}")
-    
-        while rigaku500k.cam1.det_state.get(as_string=True) == "Idle":
-            yield from bps.sleep(0.1)
-            yield from bps.mv(rigaku500k.cam1.file_name, _filename)  
-            yield from bps.mv(rigaku500k.cam1.acquire, 1) 
-             
+
+        for attempt in range(1, start_retries + 1):
+            yield from bps.mv(rigaku500k.cam1.file_name, _filename)
+            yield from bps.mv(rigaku500k.cam1.acquire, 1)
+            if (yield from _wait_det_state(rigaku500k, False, start_timeout)):
+                break
+            logger.warning("Rigaku did not start (attempt %d): %s", attempt, _filename)
+        else:
+            raise TimeoutError(
+                f"Rigaku did not start after {start_retries} attempts: {_filename}")
+
+        logger.info(
+            "Rigaku %s: waited %.3f s for Idle, started in %.3f s (%d attempt(s))",
+            _filename, t_idle - t0, time.time() - t_idle, attempt,
+        )
@@ -5,6 +5,7 @@ Acquire an XPCS measurement with a supported area detector
 
 __all__ = """
     AD_Acquire
+    flush_workflow_pipeline
 """.split()
 
 from instrument.session_logs import logger
@@ -15,12 +16,15 @@ from ..devices import aps, dm_pars, dm_workflow
 from ..devices import Atten1, Atten2, scaler1
 from ..devices import timebase, pind1, pind2, T_A, T_SET
 from ..framework import db, RE
+from ..utils.g2_quicklook import g2_quicklook
+from .functions import wait_status
 from bluesky import plan_stubs as bps
 from bluesky import preprocessors as bpp
-import apstools.utils
 import datetime
+import functools
 import ophyd.signal
 import os
+from spec_support.unique_filename import unique_filename
 
 
 def AD_Acquire(areadet,
@@ -31,6 +35,8 @@ def AD_Acquire(areadet,
                path=None,
                submit_xpcs_job=True,
                atten=0,
+               pipelined=False,
+               quicklook=False,
                md={}):
     """
     acquisition sequence initiating data management workflow
@@ -45,6 +51,14 @@ def AD_Acquire(areadet,
       scalers and devices such as temperature
     * trigger area detector while monitoring the
       above params
+
+    With ``pipelined=True``, the HDF5 workflow file is written
+    (and the DM job submitted) in the background while the next
+    acquisition proceeds.  The registers are read before this plan
+    returns.  Call ``flush_workflow_pipeline()`` at the end of a series.
+
+    With ``quicklook=True``, g2 is also computed locally (in the
+    background) from the acquired frames, see ``g2_quicklook``.
     """
     logger.info("AD_Acquire starting")
 
@@ -66,6 +80,8 @@ def AD_Acquire(areadet,
         num_images = num_images,
         file_name = file_name,
         submit_xpcs_job = str(submit_xpcs_job),
+        pipelined = str(pipelined),
+        quicklook = str(quicklook),
     )
     if atten is not None:
         plan_args["atten"] = atten
@@ -78,7 +94,8 @@ def AD_Acquire(areadet,
     assert atten in (Atten1, Atten2)
 
     # select the detector's number
-    yield from bps.mv(dm_pars.detNum, areadet.detector_number)
+    dm_pars.queue_registers(detNum=areadet.detector_number)
+    yield from dm_pars.commit_registers()
 
     # yield from areadet.cam.setup_modes(num_images)
     # yield from areadet.cam.setTime(acquire_time, acquire_period)
@@ -125,115 +142,78 @@ def AD_Acquire(areadet,
         if path.startswith("/data"):
             path = os.path.join("/", "home", "8ididata", *path.split("/")[2:])
             logger.debug(f"modified path: {path}")
-            if not os.path.exists(path):
-                os.makedirs(path)
-                logger.debug(f"created path: {path}")
         fname = (
             f"{file_name}"
             f"_{dm_pars.data_begin.get():04.0f}"
             f"-{dm_pars.data_end.get():04.0f}"
         )
-        fullname = os.path.join(path, f"{fname}.hdf")
-        suffix = 0
-        while os.path.exists(fullname):
-            suffix += 1
-            fullname = os.path.join(path, f"{fname}__{suffix:03d}.hdf")
-        if suffix > 0:
-            logger.info(f"using modified file name: {fullname}")
-        return fullname
+        # claims the name (creates an empty file), safe with the SPEC helper
+        return unique_filename(path, fname)
 
     def update_metadata_prescan():
         detNum = int(dm_pars.detNum.get())
         det_pars = dm_workflow.detectors.getDetectorByNumber(detNum)
         logger.info(f"detNum={detNum}, det_pars={det_pars}")
-        yield from bps.mv(
+        dm_pars.queue_registers(
             # StrReg 2-7 in order
-            dm_pars.root_folder, file_path,
-        )
-        # logger.debug("dm_pars.root_folder")
-
-        yield from bps.mv(
-            dm_pars.user_data_folder, os.path.dirname(file_path),   # just last item in path
-        )
-        # logger.debug("dm_pars.user_data_folder")
-
-        yield from bps.mv(
-            dm_pars.data_folder, file_name,
-        )
-        # logger.debug("dm_pars.data_folder")
-
-        yield from bps.mv(
-            dm_pars.source_begin_datetime, timestamp_now(),
-        )
-        # logger.debug("dm_pars.source_begin_datetime")
-
-        yield from bps.mv(
+            root_folder=file_path,
+            user_data_folder=os.path.dirname(file_path),   # just last item in path
+            data_folder=file_name,
+            source_begin_datetime=timestamp_now(),
             # Reg 121
-            dm_pars.source_begin_current, aps.current.get(),
+            source_begin_current=aps.current.get(),
             # Reg 101-110 in order
-            dm_pars.roi_x1, 0,
-            dm_pars.roi_x2, det_pars["ccdHardwareColSize"]-1,
-            dm_pars.roi_y1, 0,
-            dm_pars.roi_y2, det_pars["ccdHardwareRowSize"]-1,
-            dm_pars.cols, det_pars["ccdHardwareColSize"],
-            dm_pars.rows, det_pars["ccdHardwareRowSize"],
-            dm_pars.kinetics_state, 0,                  # FIXME: SPEC generated this
-            dm_pars.kinetics_window_size, 0,            # FIXME:
-            dm_pars.kinetics_top, 0,                    # FIXME:
-            dm_pars.attenuation, atten.get(),
-        )
-        # logger.debug("Reg 121, 101-110 done")
-
-        yield from bps.mv(
+            roi_x1=0,
+            roi_x2=det_pars["ccdHardwareColSize"]-1,
+            roi_y1=0,
+            roi_y2=det_pars["ccdHardwareRowSize"]-1,
+            cols=det_pars["ccdHardwareColSize"],
+            rows=det_pars["ccdHardwareRowSize"],
+            kinetics_state=0,                  # FIXME: SPEC generated this
+            kinetics_window_size=0,            # FIXME:
+            kinetics_top=0,                    # FIXME:
+            attenuation=atten.get(),
             # Reg 111-120 in order
-            #dm_pars.dark_begin, -1,            #  edit if detector needs this
-            #dm_pars.dark_end, -1,              #  op cit
-            dm_pars.data_begin, 1,
-            dm_pars.data_end, num_images,
-            dm_pars.exposure_time, acquire_time,
-            dm_pars.exposure_period, acquire_period,
-            # dm_pars.specscan_dark_number, -1,   #  not used, detector takes no darks
-            dm_pars.stage_x, detu.x.position,
-            dm_pars.stage_z, detu.z.position,
+            #dark_begin=-1,            #  edit if detector needs this
+            #dark_end=-1,              #  op cit
+            data_begin=1,
+            data_end=num_images,
+            exposure_time=acquire_time,
+            exposure_period=acquire_period,
+            # specscan_dark_number=-1,   #  not used, detector takes no darks
+            stage_x=detu.x.position,
+            stage_z=detu.z.position,
+            # Reg 124-127 in order
+            burst_mode_state=0,   # 0 for Lambda, other detector might use this
+            number_of_bursts=0,   # 0 for Lambda, other detector might use this
+            first_usable_burst=0,   # 0 for Lambda, other detector might use this
+            last_usable_burst=0,   # 0 for Lambda, other detector might use this
         )
-        # logger.debug("Reg 111-120 done")
-
-        # yield from bps.mv(
-        #     # Reg 123-127 in order
-        #     dm_pars.I0mon, I0Mon.get(),
-        #     dm_pars.burst_mode_state, 0,   # 0 for Lambda, other detector might use this
-        #     dm_pars.number_of_bursts, 0,   # 0 for Lambda, other detector might use this
-        #     dm_pars.first_usable_burst, 0,   # 0 for Lambda, other detector might use this
-        #     dm_pars.last_usable_burst, 0,   # 0 for Lambda, other detector might use this
-        # )
-        # # logger.debug("Reg 123-127 done")
 
         try:
-            yield from bps.mv(
-                # Reg 123-127 in order
-                dm_pars.I0mon, I0Mon.get(),
-                dm_pars.burst_mode_state, 0,   # 0 for Lambda, other detector might use this
-                dm_pars.number_of_bursts, 0,   # 0 for Lambda, other detector might use this
-                dm_pars.first_usable_burst, 0,   # 0 for Lambda, other detector might use this
-                dm_pars.last_usable_burst, 0,   # 0 for Lambda, other detector might use this
-            )
+            # Reg 123
+            dm_pars.queue_registers(I0mon=I0Mon.get())
         except ophyd.signal.ReadTimeoutError as exc:
             logger.warn("EPICS ReadTimeoutError from scaler (ignoring): %s", str(exc))
 
+        # all registers written at once
+        yield from dm_pars.commit_registers()
+        logger.debug("pre-scan registers: %s", dm_pars.register_latency)
 
     def update_metadata_postscan():
         # since we inherited ALL the user's namespace, we have RE and db
         scan_id = RE.md["scan_id"]
         uid = db[-1].start["uid"]
-        yield from bps.mv(
+        dm_pars.queue_registers(
             # source end values
-            dm_pars.source_end_datetime, timestamp_now(),
-            dm_pars.source_end_current, aps.current.get(),
-            dm_pars.uid, uid,
-            dm_pars.scan_id, int(scan_id),
-            dm_pars.datafilename, areadet.plugin_file_name,
+            source_end_datetime=timestamp_now(),
+            source_end_current=aps.current.get(),
+            uid=uid,
+            scan_id=int(scan_id),
+            datafilename=areadet.plugin_file_name,
         )
-        # logger.debug("dm_pars.datafilename")
+        yield from dm_pars.commit_registers()
+        logger.debug("post-scan registers: %s", dm_pars.register_latency)
 
     def inner_count(devices, md={}):
         yield from bps.open_run(md=md)
@@ -246,6 +226,11 @@ def AD_Acquire(areadet,
                 no_wait = False
                 yield from bps.trigger(obj, group=grp)
         if areadet.cam.EXT_TRIGGER > 0:
+            # detector must be ready before the first frame trigger
+            ready = getattr(areadet, "ext_trigger_ready", None)
+            if ready is not None and not (yield from wait_status(ready)):
+                raise TimeoutError(
+                    f"{areadet.name} not ready for frame triggers: {ready}")
             yield from soft_glue.start_trigger()
         # Skip 'wait' if none of the devices implemented a trigger method.
         if not no_wait:
@@ -293,32 +278,66 @@ def AD_Acquire(areadet,
         logger.debug("after count()")
 
         yield from update_metadata_postscan()
+        if quicklook:
+            uid = db[-1].start["uid"]
+            qmap_file = os.path.join(
+                dm_workflow.QMAP_FOLDER_PATH, dm_workflow.XPCS_QMAP_FILENAME)
+            g2_quicklook.submit(
+                uid, functools.partial(_series_frames, uid, areadet), qmap_file)
+            logger.info("g2 quick look of %s started, qmap: %s", uid, qmap_file)
+
         hdf_with_fullpath = make_hdf5_workflow_filename()
         print(f"HDF5 workflow file name: {hdf_with_fullpath}")
 
-        if not os.path.exists(os.path.dirname(hdf_with_fullpath)):
-            os.makedirs(os.path.dirname(hdf_with_fullpath))
-
-        dm_workflow.create_hdf5_file(hdf_with_fullpath)
-
         # update these str values from the string registers
         dm_workflow.transfer = dm_pars.transfer.get()
         dm_workflow.analysis = dm_pars.analysis.get()
 
+        if pipelined:
+            # wait (without blocking the RunEngine) for room in the backlog
+            while dm_workflow.pipeline.full:
+                yield from bps.sleep(0.1)
+            dm_workflow.queue_workflow(hdf_with_fullpath, analysis=submit_xpcs_job)
+            logger.info(
+                "HDF5 workflow file queued (%d pending): analysis:%s",
+                dm_workflow.pipeline.pending, submit_xpcs_job)
+            return
+
+        dm_workflow.create_hdf5_file(hdf_with_fullpath)
+
         # no need to yield from since the function is not a plan
-        kickoff_DM_workflow(hdf_with_fullpath, analysis=submit_xpcs_job)
-
-    @apstools.utils.run_in_thread
-    def kickoff_DM_workflow(hdf_workflow_file, analysis=True):
-        logger.info(f"DM workflow kickoff starting: analysis:{analysis}  file:{hdf_workflow_file}")
-        if analysis:
-            out, err = dm_workflow.DataAnalysis(hdf_workflow_file)
-        else:
-            out, err = dm_workflow.DataTransfer(hdf_workflow_file)
-        logger.info("DM workflow kickoff done")
-        logger.info(out)
-        if len(err) > 0:
-            logger.error(err)
+        # returns immediately, see dm_workflow.ListSubmissions()
+        key = dm_workflow.submit_job(hdf_with_fullpath, analysis=submit_xpcs_job)
+        logger.info(f"DM workflow job {key} queued: analysis:{submit_xpcs_job}")
 
     logger.info("calling full_acquire_procedure()")
     return (yield from full_acquire_procedure(md=md))
+
+
+
+def _series_frames(uid, areadet):
+    """
+    frames of run ``uid``, lazy (read by the detector's databroker handler)
+    """
+    return next(db[uid].data(f"{areadet.name}_image", fill=True))
+
+
+def flush_workflow_pipeline(timeout=None, poll_interval=0.1):
+    """
+    wait until all pipelined HDF5 workflow files are written
+
+    Use at the end of a series of ``AD_Acquire(..., pipelined=True)``.
+    Their DM jobs are queued by then, see ``dm_workflow.ListSubmissions()``.
+    """
+    t0 = datetime.datetime.now()
+    logger.info("flushing %d pipelined workflow(s)", dm_workflow.pipeline.pending)
+    while dm_workflow.pipeline.pending > 0:
+        elapsed = (datetime.datetime.now() - t0).total_seconds()
+        if timeout is not None and elapsed > timeout:
+            raise TimeoutError(
+                f"{dm_workflow.pipeline.pending} workflow file(s)"
+                f" not written after {timeout} s"
+            )
+        yield from bps.sleep(poll_interval)
+    # report any failures
+    dm_workflow.flush_workflows(timeout=0)
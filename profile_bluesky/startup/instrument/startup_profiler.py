@@ -0,0 +1,251 @@
+"""
+measure the session startup: imports, ophyd objects, PV connections
+
+Enabled by environment variable ``INSTRUMENT_STARTUP_PROFILE``.
+Its value is the JSON file to write, or ``1`` for the default
+(``.logs/startup_profile.json``).  When not set, nothing is changed.
+
+Records the wall time (inclusive and self) of each module imported
+from the ``instrument`` and ``spec_support`` packages, the time to
+construct each top-level ophyd object, the time spent waiting for
+it to connect (``wait_for_connection()``), and the connection times
+from ``device_registry``.
+
+USAGE (in ``00-instrument.py``)::
+
+    from instrument import startup_profiler
+    startup_profiler.start()
+
+    from instrument.collection import *
+
+    startup_profiler.finish()
+
+Compare two sessions with::
+
+    INSTRUMENT_STARTUP_PROFILE=/tmp/before.json ipython --profile=bluesky
+"""
+
+__all__ = []
+
+import importlib.abc
+import json
+import os
+import pyRestTable
+import sys
+import threading
+import time
+
+ENVIRONMENT_VARIABLE = "INSTRUMENT_STARTUP_PROFILE"
+DEFAULT_FILE = os.path.join(os.getcwd(), ".logs", "startup_profile.json")
+PACKAGES = ("instrument", "spec_support")
+TABLE_LENGTH = 25
+
+_profiler = None
+
+
+class _TimedLoader:
+    """wraps a module loader, timing ``exec_module()``"""
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler.timing("import", module.__name__):
+            self._loader.exec_module(module)
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    """finds modules (with the other finders) of ``PACKAGES``, times them"""
+
+    def __init__(self, profiler):
+        self._profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname.split(".")[0] not in PACKAGES:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self._profiler)
+                return spec
+        return None
+
+
+class _Timing:
+    """context manager for one timed step"""
+
+    def __init__(self, profiler, kind, name):
+        self.profiler = profiler
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self.children = 0.0
+        self.profiler._stack().append(self)
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        stack = self.profiler._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.profiler.record(self.kind, self.name, elapsed, elapsed - self.children)
+
+
+class StartupProfiler:
+    """
+    collects (kind, name, seconds, self_seconds) of the startup steps
+    """
+
+    def __init__(self, json_file=None):
+        self.json_file = json_file or DEFAULT_FILE
+        self.records = []
+        self.t_start = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._finder = _TimingFinder(self)
+        self._restore = []
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def timing(self, kind, name):
+        return _Timing(self, kind, name)
+
+    def record(self, kind, name, seconds, self_seconds=None):
+        if self_seconds is None:
+            self_seconds = seconds
+        with self._lock:
+            self.records.append(
+                dict(kind=kind, name=name, seconds=seconds, self_seconds=self_seconds)
+            )
+
+    def install(self):
+        """start timing imports and ophyd objects"""
+        sys.meta_path.insert(0, self._finder)
+        self._patch_ophyd()
+
+    def uninstall(self):
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        for cls, attr, original in reversed(self._restore):
+            setattr(cls, attr, original)
+        self._restore = []
+
+    def _patch(self, cls, attr, kind):
+        """time calls of ``cls.attr`` made on top-level objects"""
+        original = getattr(cls, attr)
+        profiler = self
+
+        def wrapper(obj, *args, **kwargs):
+            if kwargs.get("parent") is not None or getattr(obj, "parent", None) is not None:
+                return original(obj, *args, **kwargs)
+            busy = getattr(profiler._local, "busy", None)
+            if busy is None:
+                busy = profiler._local.busy = set()
+            key = (id(obj), attr)
+            if key in busy:     # subclass calls via super()
+                return original(obj, *args, **kwargs)
+            busy.add(key)
+            name = kwargs.get("name") or getattr(obj, "name", None) or "?"
+            try:
+                with profiler.timing(kind, f"{name} ({obj.__class__.__name__})"):
+                    return original(obj, *args, **kwargs)
+            finally:
+                busy.discard(key)
+
+        wrapper.__wrapped__ = original
+        setattr(cls, attr, wrapper)
+        self._restore.append((cls, attr, original))
+
+    def _patch_ophyd(self):
+        from ophyd import Device
+        from ophyd.signal import EpicsSignalBase
+
+        for cls in (Device, EpicsSignalBase):
+            self._patch(cls, "__init__", "construct")
+            self._patch(cls, "wait_for_connection", "connect_wait")
+
+    def _collect_registry(self):
+        """connection times as seen by device_registry"""
+        registry = sys.modules.get("instrument.framework.device_registry")
+        if registry is None:
+            return
+        for entry in list(registry.device_registry._entries.values()):
+            device = entry.device
+            if entry.connect_time is not None and device is not None:
+                name = f"{device.name} ({device.__class__.__name__})"
+                self.record("connected", name, entry.connect_time)
+
+    def summary(self):
+        """dictionary for the JSON file"""
+        totals = {}
+        for r in self.records:
+            totals[r["kind"]] = totals.get(r["kind"], 0) + r["self_seconds"]
+        return dict(
+            started=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.t_start)),
+            elapsed=time.time() - self.t_start,
+            totals=totals,
+            records=sorted(self.records, key=lambda r: r["self_seconds"], reverse=True),
+        )
+
+    def table(self, summary=None, length=TABLE_LENGTH):
+        """ranked (by self time) table of the slowest steps"""
+        summary = summary or self.summary()
+        table = pyRestTable.Table()
+        table.labels = "# kind name seconds self_seconds".split()
+        for i, r in enumerate(summary["records"][:length], start=1):
+            table.addRow(
+                (i, r["kind"], r["name"], f"{r['seconds']:.3f}", f"{r['self_seconds']:.3f}")
+            )
+        return table
+
+    def finish(self):
+        """stop, print the ranked table, write the JSON file"""
+        self.uninstall()
+        self._collect_registry()
+        summary = self.summary()
+        print(f"startup: {summary['elapsed']:.3f} s")
+        print(self.table(summary))
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.json_file)), exist_ok=True)
+            with open(self.json_file, "w") as f:
+                json.dump(summary, f, indent=2)
+            print(f"startup profile written to {self.json_file}")
+        except OSError as exc:
+            print(f"could not write startup profile {self.json_file}: {exc}")
+        return summary
+
+
+def start():
+    """start the profiler, if enabled by the environment variable"""
+    global _profiler
+    value = os.environ.get(ENVIRONMENT_VARIABLE, "").strip()
+    if value in ("", "0") or _profiler is not None:
+        return
+    json_file = None if value == "1" else value
+    _profiler = StartupProfiler(json_file)
+    _profiler.install()
+
+
+def finish():
+    """report the profile (if the profiler was started)"""
+    global _profiler
+    if _profiler is None:
+        return None
+    summary = _profiler.finish()
+    _profiler = None
+    return summary
@@ -1,2 +1,3 @@
 from .explorer import *
+from .g2_quicklook import *
 from .load_eiger import *
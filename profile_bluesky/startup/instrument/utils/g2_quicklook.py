@@ -0,0 +1,137 @@
+"""
+local quick-look g2 of an AD_Acquire series (not waiting for DM)
+
+After the series, its frames are read (through databroker and the
+detector's handler: IMM, HDF5 or Rigaku) in chunks and streamed to
+``StreamingG2`` (a pool of worker processes), using the detector's
+qmap partitions.  The per-q g2 curves are kept in ``results`` (last
+few series) and passed to each ``subscribe()``-d callback.
+
+EXAMPLE::
+
+    g2_quicklook.subscribe(lambda uid, result: print(result.g2[:, 0]))
+    RE(AD_Acquire(lambdadet, "A001", 0.01, 0.01, 1000, path=path, quicklook=True))
+    print(g2_quicklook.table())
+"""
+
+__all__ = [
+    "g2_quicklook",
+]
+
+from ..session_logs import logger
+
+logger.info(__file__)
+
+from spec_support.qmap import load_qmap
+from spec_support.xpcs_multitau import StreamingG2
+import collections
+import concurrent.futures
+import numpy as np
+import pyRestTable
+import time
+
+
+class G2QuickLook:
+    """
+    compute g2 of acquired series in the background
+
+    PARAMETERS
+
+    workers : int, optional
+        worker processes for each series, default: 4
+    chunk_frames : int, optional
+        frames read (and sent to the workers) at a time, default: 500
+    buffer_size : int, optional
+        frames kept at each multi-tau level, default: 16
+    history : int, optional
+        number of results kept, default: 10
+    """
+
+    def __init__(self, workers=4, chunk_frames=500, buffer_size=16, history=10):
+        self.workers = workers
+        self.chunk_frames = chunk_frames
+        self.buffer_size = buffer_size
+        self.results = collections.OrderedDict()    # {uid: G2Result}
+        self.history = history
+        self._callbacks = []
+        # one series at a time, in submission order
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="g2_quicklook"
+        )
+
+    def subscribe(self, callback):
+        """``callback(uid, result)`` is called with each new G2Result"""
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def submit(self, uid, frames, qmap_file):
+        """
+        compute g2 of ``frames`` in the background, returns a Future
+
+        PARAMETERS
+
+        uid : str
+            key of the result (the run's uid)
+        frames : array-like (n, rows, cols) or callable
+            the frames (such as a lazy dask array) or a function
+            returning them, called in the background
+        qmap_file : str
+            name of the qmap file
+        """
+        return self._executor.submit(self._correlate, uid, frames, qmap_file)
+
+    def _correlate(self, uid, frames, qmap_file):
+        t0 = time.time()
+        try:
+            qmap = load_qmap(qmap_file)   # cached
+            if callable(frames):
+                frames = frames()
+            correlator = StreamingG2(
+                qmap.dynamic,
+                workers=self.workers,
+                buffer_size=self.buffer_size,
+            )
+            try:
+                for start in range(0, len(frames), self.chunk_frames):
+                    chunk = np.asarray(frames[start : start + self.chunk_frames])
+                    correlator.put(chunk)
+            except Exception:
+                correlator.close()
+                raise
+            result = correlator.finish()
+        except Exception as exc:
+            logger.error("g2 quick look of %s failed: %s", uid, exc)
+            raise
+
+        self.results[uid] = result
+        while len(self.results) > self.history:
+            self.results.popitem(last=False)
+        logger.info(
+            "g2 quick look of %s: %d frames, %d q bins, %.3f s",
+            uid, result.num_frames, len(result.g2), time.time() - t0,
+        )
+        for callback in list(self._callbacks):
+            try:
+                callback(uid, result)
+            except Exception as exc:
+                logger.warning("g2 quick look callback %s: %s", callback, exc)
+        return result
+
+    def table(self, uid=None):
+        """table of contrast (g2 at the shortest tau) and q, of the last result"""
+        if len(self.results) == 0:
+            return None
+        uid = uid or next(reversed(self.results))
+        result = self.results[uid]
+        table = pyRestTable.Table()
+        table.labels = "bin q g2(tau_min) g2(tau_max)".split()
+        for k, curve in enumerate(result.g2):
+            q = "" if result.q is None or k >= len(result.q) else f"{result.q[k]:.5g}"
+            table.addRow((k + 1, q, f"{curve[0]:.4f}", f"{curve[-1]:.4f}"))
+        return table
+
+
+g2_quicklook = G2QuickLook()
@@ -16,23 +16,114 @@ near future.
 These workflows are stored in ~8idiuser/DM_Workflows/ and in https://subversion.xray.aps.anl.gov/xpcs/DM_Workflows/
 """
 
+import atexit
+import concurrent.futures
+import contextlib
+import dataclasses
 import datetime
 import h5py
 import logging
 import math
 import os
+import pyRestTable
+import queue
 import re
+import sqlite3
 import subprocess
 import sys
 import threading
 import time
+import uuid
 
 from . import detector_parameters
+from .unique_filename import unique_filename
 
 
 logger = logging.getLogger(f"main.{__name__}")
 
 
+# (name, type) of each register written to the HDF5 workflow file
+WORKFLOW_REGISTERS = (
+    ("hdf_metadata_version", float),
+    ("dark_begin", float),
+    ("dark_end", float),
+    ("data_begin", float),
+    ("data_end", float),
+    ("specscan_dark_number", float),
+    ("specscan_data_number", float),
+    ("attenuation", float),
+    ("beam_size_H", float),
+    ("beam_size_V", float),
+    ("specfile", str),
+    ("root_folder", str),
+    ("data_subfolder", str),
+    ("user_data_folder", str),
+    ("data_folder", str),
+    ("datafilename", str),
+    ("beam_center_x", float),
+    ("beam_center_y", float),
+    ("stage_zero_x", float),
+    ("stage_zero_z", float),
+    ("stage_x", float),
+    ("stage_z", float),
+    ("compression", float),
+    ("geometry_num", float),
+    ("xspec", float),
+    ("zspec", float),
+    ("ccdxspec", float),
+    ("ccdzspec", float),
+    ("angle", float),
+    ("source_begin_beam_intensity_incident", float),
+    ("source_begin_beam_intensity_transmitted", float),
+    ("source_begin_current", float),
+    ("source_begin_energy", float),
+    ("source_begin_datetime", str),
+    ("source_end_current", float),
+    ("source_end_datetime", str),
+    ("temperature_A", float),
+    ("temperature_B", float),
+    ("temperature_A_set", float),
+    ("temperature_B_set", float),
+    ("translation_x", float),
+    ("translation_y", float),
+    ("translation_z", float),
+    ("translation_table_x", float),
+    ("translation_table_y", float),
+    ("translation_table_z", float),
+    ("sample_pitch", float),
+    ("sample_roll", float),
+    ("sample_yaw", float),
+    ("detNum", int),
+    ("exposure_time", float),
+    ("exposure_period", float),
+    ("burst_mode_state", float),
+    ("number_of_bursts", float),
+    ("first_usable_burst", float),
+    ("last_usable_burst", float),
+    ("detector_distance", float),
+    ("kinetics_state", float),
+    ("kinetics_top", float),
+    ("kinetics_window_size", float),
+    ("roi_x1", float),
+    ("roi_y1", float),
+    ("roi_x2", float),
+    ("roi_y2", float),
+)
+SNAPSHOT_THREADS = 16   # parallel register reads in snapshot_registers()
+
+DM_SETUP_COMMAND = "source /home/dm/etc/dm.setup.sh"
+DM_START_JOB_COMMAND = "dm-start-processing-job"
+DM_USE_SESSION = True   # False: new shell (and DM setup) for every command
+DM_JOB_TABLE_FILE = os.path.join(
+    os.environ.get("HOME", "/tmp"), ".config", "dm_workflow", "jobs.sqlite"
+)
+
+WorkflowSnapshot = dataclasses.make_dataclass(
+    "WorkflowSnapshot", WORKFLOW_REGISTERS, frozen=True
+)
+WorkflowSnapshot.__doc__ = "register values for the HDF5 workflow file"
+
+
 def unix(command, raises=True):
     """
     run a UNIX command, returns (stdout, stderr)
@@ -96,6 +187,494 @@ def run_in_thread(func):
     return wrapper
 
 
+class DM_NotStarted(RuntimeError):
+    """the DM command certainly did not run (or did not start a job)"""
+
+
+class DM_ShellSession:
+    """
+    long-lived shell with the DM environment already loaded
+
+    ``DM_SETUP_COMMAND`` is sourced once, when the shell starts.
+    Commands are then piped to the shell, one at a time.
+    The shell is restarted if it exits or a command times out.
+
+    PARAMETERS
+
+    timeout : float
+        seconds to wait for any one command (default: 120)
+    """
+
+    def __init__(self, timeout=120):
+        self.timeout = timeout
+        self.process = None
+        self._lock = threading.Lock()
+
+    def _reader(self, stream, lines):
+        for line in iter(stream.readline, b""):
+            lines.put(line)
+        lines.put(None)     # shell has exited
+
+    def _start(self):
+        t0 = time.time()
+        self.process = subprocess.Popen(
+            ["/bin/bash", "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._stdout, self._stderr = queue.Queue(), queue.Queue()
+        for stream, lines in ((self.process.stdout, self._stdout),
+                              (self.process.stderr, self._stderr)):
+            threading.Thread(
+                target=self._reader, args=(stream, lines), daemon=True
+            ).start()
+        stdout, stderr, status = self._run(DM_SETUP_COMMAND)
+        logger.info(f"DM shell session started in {time.time()-t0:.3f}s")
+        if len(stderr) > 0:
+            logger.debug(f"DM setup reported: {stderr}")
+
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def _collect(self, lines, marker, t_end):
+        text = b""
+        while True:
+            line = lines.get(timeout=max(t_end - time.time(), 0))
+            if line is None:
+                raise RuntimeError("DM shell session exited")
+            p = line.find(marker)
+            if p >= 0:
+                return text + line[:p], line[p + len(marker):]
+            text += line
+
+    def _send(self, command):
+        marker = f"__DM_SESSION_{uuid.uuid4().hex}__".encode()
+        script = (
+            # stdin is the session's pipe: give the command EOF, as unix() does
+            f"{{ {command}\n}} </dev/null\n"
+            f"echo \"{marker.decode()}$?\"\n"
+            f"echo \"{marker.decode()}\" >&2\n"
+        )
+        self.process.stdin.write(script.encode())
+        self.process.stdin.flush()
+        return marker
+
+    def _receive(self, marker):
+        t_end = time.time() + self.timeout
+        stdout, status = self._collect(self._stdout, marker, t_end)
+        stderr, _ = self._collect(self._stderr, marker, t_end)
+        try:
+            status = int(status.strip() or 0)
+        except ValueError:
+            raise RuntimeError(f"no exit status from the DM shell: {status!r}")
+        return stdout, stderr, status
+
+    def _run(self, command):
+        return self._receive(self._send(command))
+
+    def execute(self, command):
+        """
+        run ``command`` in the session, returns (stdout, stderr, exit status)
+
+        Raises ``DM_NotStarted`` if the command could not be given to
+        the shell, ``RuntimeError`` if it was given but did not finish
+        (it may have done its work).
+        """
+        with self._lock:
+            try:
+                if self.process is None or self.process.poll() is not None:
+                    self._start()
+                marker = self._send(command)
+            except (queue.Empty, RuntimeError, OSError) as exc:
+                self.close()    # start a new shell next time
+                raise DM_NotStarted(f"DM shell session: {command}: {exc!r}") from exc
+            try:
+                return self._receive(marker)
+            except (queue.Empty, RuntimeError) as exc:
+                self.close()
+                raise RuntimeError(f"DM shell session: {command}: {exc!r}") from exc
+
+    def run(self, command, raises=True):
+        """
+        run ``command`` in the session, returns (stdout, stderr)
+
+        same conventions as ``unix()``
+        """
+        stdout, stderr, status = self.execute(command)
+
+        if len(stderr) > 0:
+            emsg = f"dm_command({command}) returned error:\n{stderr}"
+            logger.error(emsg)
+            if raises:
+                raise RuntimeError(emsg)
+        return stdout, stderr
+
+
+_dm_sessions = threading.local()    # one shell session per thread
+_all_dm_sessions = []
+
+
+@atexit.register
+def _close_dm_sessions():
+    for session in _all_dm_sessions:
+        session.close()
+
+
+def dm_session():
+    """this thread's ``DM_ShellSession``"""
+    session = getattr(_dm_sessions, "session", None)
+    if session is None:
+        session = DM_ShellSession()
+        _dm_sessions.session = session
+        _all_dm_sessions.append(session)
+    return session
+
+
+def dm_command(command, raises=True):
+    """
+    run a DM command (needs the DM environment), returns (stdout, stderr)
+
+    Uses this thread's ``DM_ShellSession`` unless ``DM_USE_SESSION``
+    is False, then starts a new shell for the command.
+    """
+    if not DM_USE_SESSION:
+        return unix(f"{DM_SETUP_COMMAND}; {command}", raises=raises)
+    return dm_session().run(command, raises=raises)
+
+
+def start_processing_job_command(workflow_name, args):
+    """
+    DM command to start a processing job
+
+    PARAMETERS
+
+    workflow_name : str
+        name of the DM workflow
+    args : dict
+        workflow arguments, such as ``{"filePath": "/path/to/file.hdf"}``
+    """
+    cmd = f"{DM_START_JOB_COMMAND} --workflow-name={workflow_name}"
+    for k, v in args.items():
+        cmd += f" {k}:{v}"
+    return cmd
+
+
+def shell_job_runner(workflow_name, args):
+    """
+    start a DM processing job, returns (stdout, stderr)
+
+    Raises ``DM_NotStarted`` only when no job can have been created:
+    the command could not be run, or it exited with an error and
+    reported no job id.  Any other failure (timeout, ...) may have
+    happened after DM accepted the job.
+    """
+    command = start_processing_job_command(workflow_name, args)
+    if DM_USE_SESSION:
+        stdout, stderr, status = dm_session().execute(command)
+    else:
+        try:
+            process = subprocess.run(
+                f"{DM_SETUP_COMMAND}; {command}", shell=True, capture_output=True)
+        except OSError as exc:
+            raise DM_NotStarted(f"{command}: {exc!r}") from exc
+        stdout, stderr, status = process.stdout, process.stderr, process.returncode
+    if status != 0 and "id" not in parse_job_output(stdout.decode()):
+        raise DM_NotStarted(
+            f"{command}: exit status {status}: {stderr.decode().strip()}")
+    return stdout, stderr
+
+
+def parse_job_output(text):
+    """
+    return dict of the ``key=value`` items reported for a new DM job
+
+    EXAMPLE::
+
+        id=a5b0f25e-b8e1-4fa2-9c22-580379d47d0c owner=8idiuser status=pending ...
+    """
+    return dict(re.findall(r"(\w+)=(\S+)", text))
+
+
+class DM_JobTable:
+    """
+    persistent table of DM workflow jobs submitted from this account
+
+    Kept in an SQLite file so the bluesky session and the SPEC
+    helper can both add to it and read it at the same time.
+
+    PARAMETERS
+
+    path : str, optional
+        name of the SQLite file, default: ``DM_JOB_TABLE_FILE``
+    """
+
+    columns = (
+        "key workflow filename status dm_id dm_status"
+        " attempts submitted updated message"
+    ).split()
+
+    def __init__(self, path=None):
+        self.path = path or DM_JOB_TABLE_FILE
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " key TEXT PRIMARY KEY, workflow TEXT, filename TEXT,"
+            " status TEXT, dm_id TEXT, dm_status TEXT, attempts INTEGER,"
+            " submitted REAL, updated REAL, message TEXT)"
+        )
+
+    def _execute(self, sql, parameters=()):
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as db:
+            with db:    # commits
+                return db.execute(sql, parameters).fetchall()
+
+    def add(self, workflow, filename):
+        """add a new (queued) job, returns its key"""
+        key = str(uuid.uuid4())
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs VALUES (?, ?, ?, 'queued', '', '', 0, ?, ?, '')",
+            (key, workflow, filename, now, now),
+        )
+        return key
+
+    def update(self, key, **fields):
+        """change fields of job ``key``"""
+        for k in fields:
+            if k not in self.columns[1:]:
+                raise KeyError(f"unknown job table column: {k}")
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{k}=?" for k in fields)
+        self._execute(
+            f"UPDATE jobs SET {assignments} WHERE key=?",
+            tuple(fields.values()) + (key,),
+        )
+
+    def get(self, key):
+        """return job ``key`` as a dict (or None)"""
+        rows = self._execute(
+            f"SELECT {', '.join(self.columns)} FROM jobs WHERE key=?", (key,))
+        if len(rows) == 0:
+            return None
+        return dict(zip(self.columns, rows[0]))
+
+    def recent(self, n=10):
+        """return the ``n`` most recent jobs (newest first) as dicts"""
+        rows = self._execute(
+            f"SELECT {', '.join(self.columns)} FROM jobs"
+            " ORDER BY submitted DESC LIMIT ?",
+            (n,),
+        )
+        return [dict(zip(self.columns, row)) for row in rows]
+
+
+class DM_Submitter:
+    """
+    bounded pool that starts DM workflow jobs
+
+    Jobs wait in a queue (at most ``backlog`` of them) and are started
+    by ``workers`` threads.  Starting a job is not idempotent, so a
+    start is retried (up to ``retries`` times, waiting ``backoff``,
+    then twice as long, ... between tries) only if the runner raised
+    ``DM_NotStarted``.  After any other failure, the job may have
+    started: its status is "unknown" and it is not submitted again.
+    The DM job ``id`` and ``status`` reported at the start
+    are recorded in the job table.
+
+    PARAMETERS
+
+    job_table : DM_JobTable
+        where to record the jobs
+    runner : callable, optional
+        ``runner(workflow_name, args)`` starts a job and returns
+        (stdout, stderr), raises ``DM_NotStarted`` if it certainly did
+        not, default: ``shell_job_runner``
+    """
+
+    def __init__(self, job_table, runner=None,
+                 workers=2, backlog=100, retries=3, backoff=2.0):
+        self.job_table = job_table
+        self.runner = runner or shell_job_runner
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.queue = queue.Queue(maxsize=backlog)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"DM_Submitter_{len(self._threads)+1}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, workflow_name, args, filename, timeout=None):
+        """
+        queue a DM workflow job, returns its key in the job table
+
+        Blocks (up to ``timeout`` s) only when the backlog is full.
+        """
+        key = self.job_table.add(workflow_name, filename)
+        self._start_workers()
+        try:
+            self.queue.put((key, workflow_name, args), timeout=timeout)
+        except queue.Full:
+            self.job_table.update(key, status="failed", message="backlog full")
+            raise
+        logger.info(f"DM job {key} queued: workflow:{workflow_name}  file:{filename}")
+        return key
+
+    def wait(self):
+        """block until all queued jobs have been started (or have failed)"""
+        self.queue.join()
+
+    def _worker(self):
+        while True:
+            key, workflow_name, args = self.queue.get()
+            try:
+                self._start_job(key, workflow_name, args)
+            except Exception as exc:
+                logger.error(f"DM job {key}: {exc}")
+            finally:
+                self.queue.task_done()
+
+    def _start_job(self, key, workflow_name, args):
+        message = ""
+        for attempt in range(1, self.retries + 1):
+            self.job_table.update(key, status="starting", attempts=attempt)
+            t0 = time.time()
+            try:
+                out, err = self.runner(workflow_name, args)
+            except DM_NotStarted as exc:
+                message = str(exc)
+                logger.warning(f"DM job {key} attempt {attempt} failed: {exc}")
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+                continue
+            except Exception as exc:
+                self._unknown(key, str(exc))
+                return
+            out = out.decode().strip() if isinstance(out, bytes) else out.strip()
+            fields = parse_job_output(out)
+            if "id" not in fields:
+                self._unknown(key, f"no job id reported: {out} {err}")
+                return
+            self.job_table.update(
+                key,
+                status="submitted",
+                dm_id=fields["id"],
+                dm_status=fields.get("status", ""),
+                message=out,
+            )
+            logger.info(
+                f"DM job {key} submitted in {time.time()-t0:.3f}s:"
+                f" id={fields['id']}"
+            )
+            return
+        self.job_table.update(key, status="failed", message=message)
+        logger.error(f"DM job {key} failed after {self.retries} attempts")
+
+    def _unknown(self, key, message):
+        """the job may have started: record that, do not submit it again"""
+        self.job_table.update(key, status="unknown", message=message)
+        logger.error(
+            f"DM job {key} may have started (check DM), not resubmitted: {message}")
+
+
+class DM_WorkflowPipeline:
+    """
+    write HDF5 workflow files and queue their DM jobs in the background
+
+    Lets the next acquisition start while the workflow file of the
+    previous one is written.  Files are written in order, by one
+    thread, from register snapshots taken when each job is queued.
+    At most ``backlog`` jobs wait; ``put()`` blocks when full.
+
+    PARAMETERS
+
+    workflow : DM_Workflow
+        writes the files and submits the DM jobs
+    backlog : int, optional
+        maximum number of jobs waiting, default: 4
+    """
+
+    def __init__(self, workflow, backlog=4):
+        self.workflow = workflow
+        self.queue = queue.Queue(maxsize=backlog)
+        self.failed = []    # (filename, exception)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def full(self):
+        """Is the backlog full?"""
+        return self.queue.full()
+
+    @property
+    def pending(self):
+        """number of jobs not finished (waiting or in progress)"""
+        return self.queue.unfinished_tasks
+
+    def _start_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._worker,
+                    name="DM_WorkflowPipeline",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def put(self, filename, snapshot, workflow_name, args, timeout=None):
+        """
+        queue writing ``filename`` then submitting its DM job
+
+        Blocks (up to ``timeout`` s) only when the backlog is full.
+        """
+        self._start_worker()
+        self.queue.put(
+            (filename, snapshot, workflow_name, args), timeout=timeout)
+        logger.debug(f"workflow file queued ({self.pending} pending): {filename}")
+
+    def flush(self, timeout=None):
+        """
+        wait until all queued files are written and their jobs submitted
+
+        Returns True when the pipeline is empty, False on timeout.
+        """
+        t0 = time.time()
+        while self.pending > 0:
+            if timeout is not None and time.time() - t0 > timeout:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _worker(self):
+        while True:
+            filename, snapshot, workflow_name, args = self.queue.get()
+            try:
+                t0 = time.time()
+                self.workflow.create_hdf5_file(filename, snapshot=snapshot)
+                logger.debug(
+                    f"workflow file written in {time.time()-t0:.3f}s: {filename}")
+                key = self.workflow.submitter.submit(workflow_name, args, filename)
+                logger.info(f"DM workflow job {key} queued: {filename}")
+            except Exception as exc:
+                logger.error(f"workflow file {filename}: {exc}")
+                self.failed.append((filename, exc))
+            finally:
+                self.queue.task_done()
+
+
 class DM_Workflow:
     """
     support for the APS Data Management tools
@@ -123,10 +702,16 @@ class DM_Workflow:
     get_workflow_filename   decide absolute file name for the APS data management workflow
     start_workflow          commence the APS data management workflow
     set_xpcs_qmap_file      (re)define the name of HDF5 workflow file
+    snapshot_registers      read all registers for the HDF5 workflow file, at once
     create_hdf5_file        Reads camera data from EPICS PVs and writes to an hdf5 file
+    hdf5_layout             describe the HDF5 workflow file, from the register snapshot
     DataTransfer            initiate data transfer
     DataAnalysis            initiate data analysis
+    submit_job              queue data transfer or analysis, do not wait
+    queue_workflow          snapshot now, write file and submit job in background
+    flush_workflows         wait for the files and jobs queued by queue_workflow
     ListJobs                list current jobs in the workflow
+    ListSubmissions         list jobs submitted from this account (no DM query)
     ======================  ===========================================
     """
 
@@ -153,6 +738,10 @@ class DM_Workflow:
 
         self.hdf_workflow_file = None
 
+        self.job_table = DM_JobTable()
+        self.submitter = DM_Submitter(self.job_table)
+        self.pipeline = DM_WorkflowPipeline(self)
+
     def cleanupFilename(self, text):
         """
         convert text so it can be used as a file name
@@ -205,14 +794,8 @@ class DM_Workflow:
             f"_{registers.data_begin.get():04.0f}"
             f"-{registers.data_end.get():04.0f}"
         )
-        fullname = os.path.join(path, f"{fname}.hdf")
-        suffix = 0
-        while os.path.exists(fullname):
-            suffix += 1
-            fullname = os.path.join(path, f"{fname}__{suffix:03d}.hdf")
-        if suffix > 0:
-            logger.info(f"using modified file name: {fullname}")
-        return fullname
+        # claims the name: creates an empty file
+        return unique_filename(path, fname)
 
     def start_workflow(self, analysis=True):
         """
@@ -230,43 +813,17 @@ class DM_Workflow:
         analysis = analysis in (1, 1.0, True)
         wf_name = {True: "analysis", False: "transfer"}[analysis]
         logger.info(f"starting start_workflow(): workflow:{wf_name}")
-        
-        @run_in_thread
-        def kickoff_DM_workflow():
-            msg = f"DM workflow starting: workflow:{wf_name}  file:{self.hdf_workflow_file}"
-            logger.info(f"{msg}")
-            t1 = time.time()
-            try:
-                func = {
-                    True: self.DataAnalysis, 
-                    False: self.DataTransfer
-                }[analysis]
-                out_err = func(self.hdf_workflow_file)
-                out = out_err[0].decode().strip()
-                err = out_err[1].decode().strip()
-            except Exception as exc:
-                logger.warning(f"Exception {exc}")
-            dt1 = time.time() - t1
-            logger.info(f"{out}")
-            # TODO: this is the place to get the job's UID
-            # out="id=a5b0f25e-b8e1-4fa2-9c22-580379d47d0c owner=8idiuser status=pending startTime=1571151502.86 startTimestamp=2019/10/15 09:58:22 CDT"
-            # if len(out) > 20:
-            #     uid = out.split()[0].split("=")[-1]
-            logger.info(f"DM workflow kickoff done: {dt1:.3f}s")
-            if len(err) > 0:
-                logger.info(f"{err}")
-        
+
         logger.info("starting start_workflow()")
         self.hdf_workflow_file = self.get_workflow_filename()
         logger.info(f"creating hdf_workflow_file = {self.hdf_workflow_file}")
         self.create_hdf5_file(self.hdf_workflow_file)
         logger.info(f"hdf_workflow_file exists: {os.path.exists(self.hdf_workflow_file)}")
 
-        logger.debug("calling kickoff_DM_workflow()")
         t0 = time.time()
-        kickoff_DM_workflow()
+        key = self.submit_job(self.hdf_workflow_file, analysis=analysis)
         dt = time.time() - t0
-        logger.debug(f"after kickoff_DM_workflow(): {dt:.3f}s")
+        logger.debug(f"after submit_job(): {dt:.3f}s, job {key}")
 
     def set_xpcs_qmap_file(self, xpcs_qmap_file):
         """
@@ -282,7 +839,31 @@ class DM_Workflow:
             xpcs_qmap_file = os.path.splitext(xpcs_qmap_file)[0] + ext
         self.XPCS_QMAP_FILENAME = xpcs_qmap_file
 
-    def create_hdf5_file(self, filename, **kwargs):
+    def snapshot_registers(self):
+        """
+        read all registers needed for the HDF5 workflow file, at once
+
+        The registers are read in parallel and converted to
+        their declared types (see ``WORKFLOW_REGISTERS``).
+
+        RETURNS
+
+        WorkflowSnapshot
+        """
+        registers = self.registers
+        t0 = time.time()
+
+        def reader(item):
+            name, kind = item
+            return kind(getattr(registers, name).get())
+
+        with concurrent.futures.ThreadPoolExecutor(SNAPSHOT_THREADS) as executor:
+            values = list(executor.map(reader, WORKFLOW_REGISTERS))
+        snapshot = WorkflowSnapshot(*values)
+        logger.debug(f"snapshot of {len(values)} registers in {time.time()-t0:.3f}s")
+        return snapshot
+
+    def create_hdf5_file(self, filename, snapshot=None, **kwargs):
         """
         write metadata from EPICS PVs to new HDF5 file
         
@@ -290,371 +871,282 @@ class DM_Workflow:
         
         filename : str
             name of the HDF5 file to be written
+        snapshot : WorkflowSnapshot, optional
+            register values to be written, default: ``snapshot_registers()``
         """
-        registers = self.registers
-
-        # Gets Python Dict stored in other file
-        masterDict = self.detectors.getMasterDict()
+        snapshot = snapshot or self.snapshot_registers()
+        layout = self.hdf5_layout(snapshot)
 
         logger.info(f"creating HDF5 file {filename}")
+        t0 = time.time()
         
+        # an empty file is the name claimed by get_workflow_filename()
+        mode = "w" if os.path.isfile(filename) and os.path.getsize(filename) == 0 else "w-"
+        opened = False
         # any exception here will be handled by caller
-        with h5py.File(filename, "w-") as f:
-            # get a version number so we can make changes without breaking client code
-            f.create_dataset("/hdf_metadata_version",
-                data=[[registers.hdf_metadata_version.get()]]) #same as batchinfo_ver for now
-            ##version 15 (May 2019) is start of burst mode support (rigaku) 
-
-            #######/measurement/instrument/acquisition
-            #######some new acq fields to replace batchinfo
-            f.create_dataset("/measurement/instrument/acquisition/dark_begin",
-                data=[[registers.dark_begin.get()]],
-                dtype='uint64'
-                )
-
-            f.create_dataset("/measurement/instrument/acquisition/dark_end",
-                data=[[registers.dark_end.get()]],
-                dtype='uint64'
-                )
-
-            f.create_dataset("/measurement/instrument/acquisition/data_begin",
-                data=[[registers.data_begin.get()]],
-                dtype='uint64'
-                )
-
-            f.create_dataset("/measurement/instrument/acquisition/data_end",
-                data=[[registers.data_end.get()]],
-                dtype='uint64'
-                )
-
-            f.create_dataset("/measurement/instrument/acquisition/specscan_dark_number",
-                data=[[registers.specscan_dark_number.get()]],
-                dtype='uint64'
-                )
-
-            f.create_dataset("/measurement/instrument/acquisition/specscan_data_number",
-                data=[[registers.specscan_data_number.get()]],
-                dtype='uint64'
-                )
-
-            f.create_dataset("/measurement/instrument/acquisition/attenuation",
-                data=[[registers.attenuation.get()]])
-            
-            f.create_dataset("/measurement/instrument/acquisition/beam_size_H",
-                data=[[registers.beam_size_H.get()]])
-            
-            f.create_dataset("/measurement/instrument/acquisition/beam_size_V",
-                data=[[registers.beam_size_V.get()]])
-
-            f["/measurement/instrument/acquisition/specfile"] = registers.specfile.get()
-
-            # registers.root_folder: '/home/8-id-i/2019-2/jemian_201908/A024/'
-            # registers.data_subfolder: 'A186_DOHE04_Yb010_att0_Uq0_00150'
-            # root_folder: '/home/8-id-i/2019-2/jemian_201908/A024/A186_DOHE04_Yb010_att0_Uq0_00150/'
-            root_folder = os.path.join(
-                registers.root_folder.get(),
-                registers.data_subfolder.get()
-            ).rstrip("/") + "/"  # ensure one and only one trailing `/`
-            f["/measurement/instrument/acquisition/root_folder"] = root_folder
-
-            # In [1]: registers.user_data_folder.get()
-            # Out[1]: '/home/8-id-i/2019-2/jemian_201908/A024'
-            # pick "jemian_201908" part
-            parent_folder = registers.user_data_folder.get()
-            if parent_folder.find("/") > -1:
-                parent_folder = parent_folder.split("/")[-2]
-            f["/measurement/instrument/acquisition/parent_folder"] = parent_folder
-
-            f["/measurement/instrument/acquisition/data_folder"] = registers.data_folder.get()
-            f["/measurement/instrument/acquisition/datafilename"] = registers.datafilename.get()
-
-            f.create_dataset("/measurement/instrument/acquisition/beam_center_x",
-                data=[[registers.beam_center_x.get()]])
-
-            f.create_dataset("/measurement/instrument/acquisition/beam_center_y",
-                data=[[registers.beam_center_y.get()]])
-
-            f.create_dataset("/measurement/instrument/acquisition/stage_zero_x",
-                data=[[registers.stage_zero_x.get()]])
-
-            f.create_dataset("/measurement/instrument/acquisition/stage_zero_z",
-                data=[[registers.stage_zero_z.get()]])
-
-            f.create_dataset("/measurement/instrument/acquisition/stage_x",
-                data=[[registers.stage_x.get()]])
-
-            f.create_dataset("/measurement/instrument/acquisition/stage_z",
-                data=[[registers.stage_z.get()]])
-
-            v = {True: "ENABLED", 
-                 False: "DISABLED"}[registers.compression.get() == 1]
-            f["/measurement/instrument/acquisition/compression"] = v
-
-            if registers.geometry_num.get() == 1: ##reflection geometry
-                f.create_dataset("/measurement/instrument/acquisition/xspec",
-                    data=[[float(registers.xspec.get())]],
-                    dtype='float64')
-
-                f.create_dataset("/measurement/instrument/acquisition/zspec",
-                    data=[[float(registers.zspec.get())]],
-                    dtype='float64')
-
-                f.create_dataset("/measurement/instrument/acquisition/ccdxspec",
-                    data=[[float(registers.ccdxspec.get())]],
-                    dtype='float64')
-
-                f.create_dataset("/measurement/instrument/acquisition/ccdzspec",
-                    data=[[float(registers.ccdzspec.get())]],
-                    dtype='float64')
-
-                f.create_dataset("/measurement/instrument/acquisition/angle",
-                    data=[[float(registers.angle.get())]],
-                    dtype='float64')
-
-            elif registers.geometry_num.get() == 0: ##transmission geometry
-                f["/measurement/instrument/acquisition/xspec"] = [[float(-1)]]
-                f["/measurement/instrument/acquisition/zspec"] = [[float(-1)]]
-                f["/measurement/instrument/acquisition/ccdxspec"] = [[float(-1)]]
-                f["/measurement/instrument/acquisition/ccdzspec"] = [[float(-1)]]
-                f["/measurement/instrument/acquisition/angle"] = [[float(-1)]]
-
-            #/measurement/instrument/source_begin
-            f.create_dataset("/measurement/instrument/source_begin/beam_intensity_incident",
-                data=[[registers.source_begin_beam_intensity_incident.get()]])
-
-            f.create_dataset("/measurement/instrument/source_begin/beam_intensity_transmitted",
-                data=[[registers.source_begin_beam_intensity_transmitted.get()]])
-
-            f.create_dataset("/measurement/instrument/source_begin/current",
-                data=[[registers.source_begin_current.get()]])
-        
-            f.create_dataset("/measurement/instrument/source_begin/energy",
-			     data=[[registers.source_begin_energy.get()]])
-
-            f["/measurement/instrument/source_begin/datetime"] = registers.source_begin_datetime.get()
-
-            #/measurement/instrument/source_end (added in January 2019)
-            f.create_dataset("/measurement/instrument/source_end/current",
-                data=[[registers.source_end_current.get()]])
-
-            f["/measurement/instrument/source_end/datetime"] = registers.source_end_datetime.get()
-
-            ########################################################################################
-            #/measurement/instrument/sample
-            f.create_dataset("/measurement/sample/thickness", data=[[1.0]])
-            
-            f.create_dataset("/measurement/sample/temperature_A",
-                data=[[registers.temperature_A.get()]])
-
-            f.create_dataset("/measurement/sample/temperature_B",
-                data=[[registers.temperature_B.get()]])
-
-            f.create_dataset("/measurement/sample/temperature_A_set",
-                data=[[registers.temperature_A_set.get()]])
-            # data=[[registers.pid1.get()]])
-
-            f.create_dataset("/measurement/sample/temperature_B_set",
-                data=[[registers.temperature_B_set.get() ]])
-
-            f.create_dataset(
-                "/measurement/sample/translation",
-                data=[
-                    [
-                        registers.translation_x.get(),
-                        registers.translation_y.get(),
-                        registers.translation_z.get(),
-                        ]
-                    ]
-                )
-            
-            ##new dataset added on Oct 15,2018 (2018-3) to additionally add table params
-            f.create_dataset(
-                "/measurement/sample/translation_table",
-                data=[
-                    [
-                        registers.translation_table_x.get(),
-                        registers.translation_table_y.get(),
-                        registers.translation_table_z.get(),
-                         ]
-                    ]
-                )
-
-            f.create_dataset(
-                "/measurement/sample/orientation",
-                data=[
-                    [
-                        registers.sample_pitch.get(),
-                        registers.sample_roll.get(),
-                        registers.sample_yaw.get()
-                        ]
-                    ]
-                )
-
-            #######/measurement/instrument/detector#########################
-            detector_specs = masterDict[registers.detNum.get()]
-
-            f["/measurement/instrument/detector/manufacturer"] = detector_specs["manufacturer"]
-
-            ##f["/measurement/instrument/detector/model"] = detector_specs.get("model", "UNKNOWN")
-    
-            ##f["/measurement/instrument/detector/serial_number"] = detector_specs.get("serial_number", "UNKNOWN")
-
-            f.create_dataset("/measurement/instrument/detector/bit_depth",
-                data=[[math.ceil(math.log(detector_specs["saturation"],2))]],
-                dtype='uint32')
-
-            f.create_dataset("/measurement/instrument/detector/x_pixel_size",
-                data=[[detector_specs["dpix"]]])
-
-            f.create_dataset("/measurement/instrument/detector/y_pixel_size",
-                data=[[detector_specs["dpix"]]])
-
-            f.create_dataset("/measurement/instrument/detector/x_dimension",
-                data=[[int(detector_specs["ccdHardwareColSize"])]],
-                dtype='uint32')
-
-            f.create_dataset("/measurement/instrument/detector/y_dimension",
-                data=[[int(detector_specs["ccdHardwareRowSize"])]],
-                dtype='uint32')
-
-            f.create_dataset("/measurement/instrument/detector/x_binning",
-                data=[[1]],
-                dtype='uint32')
-
-            f.create_dataset("/measurement/instrument/detector/y_binning",
-                data=[[1]],
-                dtype='uint32')
-
-            f.create_dataset("/measurement/instrument/detector/exposure_time",
-                data=[[registers.exposure_time.get()]])
-
-            f.create_dataset("/measurement/instrument/detector/exposure_period",
-                data=[[registers.exposure_period.get()]])
-
-            if registers.burst_mode_state.get() == 1:
-                f.create_dataset("/measurement/instrument/detector/burst/number_of_bursts",
-                    data=[[registers.number_of_bursts.get()]], dtype='uint32')
-
-                f.create_dataset("/measurement/instrument/detector/burst/first_usable_burst",
-                    data=[[registers.first_usable_burst.get()]], dtype='uint32')
-
-                f.create_dataset("/measurement/instrument/detector/burst/last_usable_burst",
-                    data=[[registers.last_usable_burst.get()]], dtype='uint32')
-            else:
-                f.create_dataset("/measurement/instrument/detector/burst/number_of_bursts",
-                    data=[[0]], dtype='uint32')
-
-                f.create_dataset("/measurement/instrument/detector/burst/first_usable_burst",
-                    data=[[0]], dtype='uint32')
-            
-                f.create_dataset("/measurement/instrument/detector/burst/last_usable_burst",
-                    data=[[0]], dtype='uint32')
+        try:
+            with h5py.File(filename, mode) as f:
+                opened = True
+                for address, value, dtype in layout:
+                    if dtype is None:
+                        f[address] = value
+                    else:
+                        f.create_dataset(address, data=value, dtype=dtype)
+            # Close file closes automatically due to the "with" opener
+        except Exception:
+            if mode == "w" or opened:
+                # do not leave the claimed name (or a partial file) behind
+                try:
+                    os.remove(filename)
+                except OSError as exc:
+                    logger.warning(f"could not remove {filename}: {exc}")
+            raise
+        logger.debug(f"wrote {len(layout)} datasets in {time.time()-t0:.3f}s")
+
+    def hdf5_layout(self, snapshot):
+        """
+        describe the HDF5 workflow file, from the register snapshot
 
-            f.create_dataset("/measurement/instrument/detector/distance",
-                data=[[registers.detector_distance.get()]])
+        Computed before the file is opened, no EPICS communications.
 
+        RETURNS
 
-            choices = {True: "ENABLED", False: "DISABLED"}
-            v = choices[detector_specs["flatfield"] == 1]
-            f["/measurement/instrument/detector/flatfield_enabled"] = v
+        list of (HDF5 address, value, dtype) tuples.
+        Where dtype is None, value is written with ``h5py`` defaults.
+        """
+        r = snapshot
+
+        layout = []
+
+        def add(address, value, dtype=None):
+            layout.append((address, value, dtype))
+
+        # get a version number so we can make changes without breaking client code
+        add("/hdf_metadata_version", [[r.hdf_metadata_version]]) #same as batchinfo_ver for now
+        ##version 15 (May 2019) is start of burst mode support (rigaku) 
+
+        #######/measurement/instrument/acquisition
+        #######some new acq fields to replace batchinfo
+        acquisition = "/measurement/instrument/acquisition"
+        add(f"{acquisition}/dark_begin", [[r.dark_begin]], "uint64")
+        add(f"{acquisition}/dark_end", [[r.dark_end]], "uint64")
+        add(f"{acquisition}/data_begin", [[r.data_begin]], "uint64")
+        add(f"{acquisition}/data_end", [[r.data_end]], "uint64")
+        add(f"{acquisition}/specscan_dark_number", [[r.specscan_dark_number]], "uint64")
+        add(f"{acquisition}/specscan_data_number", [[r.specscan_data_number]], "uint64")
+        add(f"{acquisition}/attenuation", [[r.attenuation]])
+        add(f"{acquisition}/beam_size_H", [[r.beam_size_H]])
+        add(f"{acquisition}/beam_size_V", [[r.beam_size_V]])
+        add(f"{acquisition}/specfile", r.specfile)
+
+        # registers.root_folder: '/home/8-id-i/2019-2/jemian_201908/A024/'
+        # registers.data_subfolder: 'A186_DOHE04_Yb010_att0_Uq0_00150'
+        # root_folder: '/home/8-id-i/2019-2/jemian_201908/A024/A186_DOHE04_Yb010_att0_Uq0_00150/'
+        root_folder = os.path.join(
+            r.root_folder,
+            r.data_subfolder
+        ).rstrip("/") + "/"  # ensure one and only one trailing `/`
+        add(f"{acquisition}/root_folder", root_folder)
+
+        # In [1]: registers.user_data_folder.get()
+        # Out[1]: '/home/8-id-i/2019-2/jemian_201908/A024'
+        # pick "jemian_201908" part
+        parent_folder = r.user_data_folder
+        if parent_folder.find("/") > -1:
+            parent_folder = parent_folder.split("/")[-2]
+        add(f"{acquisition}/parent_folder", parent_folder)
+
+        add(f"{acquisition}/data_folder", r.data_folder)
+        add(f"{acquisition}/datafilename", r.datafilename)
+        add(f"{acquisition}/beam_center_x", [[r.beam_center_x]])
+        add(f"{acquisition}/beam_center_y", [[r.beam_center_y]])
+        add(f"{acquisition}/stage_zero_x", [[r.stage_zero_x]])
+        add(f"{acquisition}/stage_zero_z", [[r.stage_zero_z]])
+        add(f"{acquisition}/stage_x", [[r.stage_x]])
+        add(f"{acquisition}/stage_z", [[r.stage_z]])
+
+        v = {True: "ENABLED", 
+             False: "DISABLED"}[r.compression == 1]
+        add(f"{acquisition}/compression", v)
+
+        if r.geometry_num == 1: ##reflection geometry
+            for key in "xspec zspec ccdxspec ccdzspec angle".split():
+                add(f"{acquisition}/{key}", [[float(getattr(r, key))]], "float64")
+
+        elif r.geometry_num == 0: ##transmission geometry
+            for key in "xspec zspec ccdxspec ccdzspec angle".split():
+                add(f"{acquisition}/{key}", [[float(-1)]])
+
+        #/measurement/instrument/source_begin
+        source = "/measurement/instrument/source_begin"
+        add(f"{source}/beam_intensity_incident", [[r.source_begin_beam_intensity_incident]])
+        add(f"{source}/beam_intensity_transmitted", [[r.source_begin_beam_intensity_transmitted]])
+        add(f"{source}/current", [[r.source_begin_current]])
+        add(f"{source}/energy", [[r.source_begin_energy]])
+        add(f"{source}/datetime", r.source_begin_datetime)
+
+        #/measurement/instrument/source_end (added in January 2019)
+        add("/measurement/instrument/source_end/current", [[r.source_end_current]])
+        add("/measurement/instrument/source_end/datetime", r.source_end_datetime)
+
+        ########################################################################################
+        #/measurement/instrument/sample
+        sample = "/measurement/sample"
+        add(f"{sample}/thickness", [[1.0]])
+        add(f"{sample}/temperature_A", [[r.temperature_A]])
+        add(f"{sample}/temperature_B", [[r.temperature_B]])
+        add(f"{sample}/temperature_A_set", [[r.temperature_A_set]])
+        add(f"{sample}/temperature_B_set", [[r.temperature_B_set]])
+        add(
+            f"{sample}/translation",
+            [[r.translation_x, r.translation_y, r.translation_z]]
+        )
+        ##new dataset added on Oct 15,2018 (2018-3) to additionally add table params
+        add(
+            f"{sample}/translation_table",
+            [[r.translation_table_x, r.translation_table_y, r.translation_table_z]]
+        )
+        add(
+            f"{sample}/orientation",
+            [[r.sample_pitch, r.sample_roll, r.sample_yaw]]
+        )
 
-            # same choices
-            v = choices[detector_specs["blemish"] == 1]
-            f["/measurement/instrument/detector/blemish_enabled"] = v
+        #######/measurement/instrument/detector#########################
+        detector = "/measurement/instrument/detector"
+        detector_specs = self.detectors.getDetectorByNumber(r.detNum)
 
-            f.create_dataset("/measurement/instrument/detector/efficiency",
-                data=[[detector_specs["efficiency"]]])
+        add(f"{detector}/manufacturer", detector_specs["manufacturer"])
 
-            f.create_dataset("/measurement/instrument/detector/adu_per_photon",
-                data=[[detector_specs["adupphot"]]])
+        ##add(f"{detector}/model", detector_specs.get("model", "UNKNOWN"))
+        ##add(f"{detector}/serial_number", detector_specs.get("serial_number", "UNKNOWN"))
 
-            if detector_specs["lld"] < 0:
-                v = abs(detector_specs["lld"])
+        add(
+            f"{detector}/bit_depth",
+            [[math.ceil(math.log(detector_specs["saturation"],2))]],
+            "uint32"
+        )
+        add(f"{detector}/x_pixel_size", [[detector_specs["dpix"]]])
+        add(f"{detector}/y_pixel_size", [[detector_specs["dpix_y"]]])
+        add(f"{detector}/x_dimension", [[int(detector_specs["ccdHardwareColSize"])]], "uint32")
+        add(f"{detector}/y_dimension", [[int(detector_specs["ccdHardwareRowSize"])]], "uint32")
+        add(f"{detector}/x_binning", [[1]], "uint32")
+        add(f"{detector}/y_binning", [[1]], "uint32")
+        add(f"{detector}/exposure_time", [[r.exposure_time]])
+        add(f"{detector}/exposure_period", [[r.exposure_period]])
+
+        for key in "number_of_bursts first_usable_burst last_usable_burst".split():
+            if r.burst_mode_state == 1:
+                v = getattr(r, key)
             else:
                 v = 0
-            f.create_dataset("/measurement/instrument/detector/lld", 
-                             data=[[float(v)]], 
-                             dtype='float64')
-
-            if detector_specs["lld"] > 0:
-                v = float(detector_specs["lld"])
-            else:
-                v = 0.0
-            f.create_dataset("/measurement/instrument/detector/sigma", data=[[v]], dtype='float64')
-
-            f.create_dataset("/measurement/instrument/detector/gain", data=[[1]], dtype='uint32')
-
-            choices = {0: "TRANSMISSION", 1: "REFLECTION"}
-            v = choices.get(registers.geometry_num.get(), "UNKNOWN")
-            f["/measurement/instrument/detector/geometry"] = v
-
-            choices = {True: "ENABLED", False: "DISABLED"}
-            v = choices[registers.kinetics_state.get() == 1]
-            f["/measurement/instrument/detector/kinetics_enabled"] = v
-
-            v = choices[registers.burst_mode_state.get() == 1]
-            f["/measurement/instrument/detector/burst_enabled"] = v
-
-            #######/measurement/instrument/detector/kinetics/######
-            if registers.kinetics_state.get() == 1:
-                f.create_dataset("/measurement/instrument/detector/kinetics/first_usable_window", 
-                    data=[[2]], dtype='uint32')
-
-                v = int(registers.kinetics_top.get()/registers.kinetics_window_size.get())-1
-                f.create_dataset("/measurement/instrument/detector/kinetics/last_usable_window", 
-                    data=[[v]], dtype='uint32')
-
-                f.create_dataset("/measurement/instrument/detector/kinetics/top", 
-                    data=[[registers.kinetics_top.get()]], dtype='uint32')
-
-                f.create_dataset("/measurement/instrument/detector/kinetics/window_size", 
-                    data=[[registers.kinetics_window_size.get()]], dtype='uint32')
-            else :
-                f.create_dataset("/measurement/instrument/detector/kinetics/first_usable_window", 
-                    data=[[0]], dtype='uint32')
-
-                f.create_dataset("/measurement/instrument/detector/kinetics/last_usable_window", 
-                    data=[[0]], dtype='uint32')
-
-                f.create_dataset("/measurement/instrument/detector/kinetics/top", 
-                    data=[[0]], dtype='uint32')
-
-                f.create_dataset("/measurement/instrument/detector/kinetics/window_size", 
-                    data=[[0]], dtype='uint32')
-
-            #######/measurement/instrument/detector/roi/######
-            f.create_dataset("/measurement/instrument/detector/roi/x1", 
-                data=[[registers.roi_x1.get()]], dtype='uint32')
-
-            f.create_dataset("/measurement/instrument/detector/roi/y1", 
-                data=[[registers.roi_y1.get()]], dtype='uint32')
-
-            f.create_dataset("/measurement/instrument/detector/roi/x2", 
-                data=[[registers.roi_x2.get()]], dtype='uint32')
-
-            f.create_dataset("/measurement/instrument/detector/roi/y2", 
-                data=[[registers.roi_y2.get()]], dtype='uint32')
+            add(f"{detector}/burst/{key}", [[v]], "uint32")
+
+        add(f"{detector}/distance", [[r.detector_distance]])
+
+        choices = {True: "ENABLED", False: "DISABLED"}
+        v = choices[detector_specs["flatfield"] == 1]
+        add(f"{detector}/flatfield_enabled", v)
+
+        # same choices
+        v = choices[detector_specs["blemish"] == 1]
+        add(f"{detector}/blemish_enabled", v)
+
+        add(f"{detector}/efficiency", [[detector_specs["efficiency"]]])
+        add(f"{detector}/adu_per_photon", [[detector_specs["adupphot"]]])
+
+        if detector_specs["lld"] < 0:
+            v = abs(detector_specs["lld"])
+        else:
+            v = 0
+        add(f"{detector}/lld", [[float(v)]], "float64")
+
+        if detector_specs["lld"] > 0:
+            v = float(detector_specs["lld"])
+        else:
+            v = 0.0
+        add(f"{detector}/sigma", [[v]], "float64")
+
+        add(f"{detector}/gain", [[1]], "uint32")
+
+        choices = {0: "TRANSMISSION", 1: "REFLECTION"}
+        v = choices.get(r.geometry_num, "UNKNOWN")
+        add(f"{detector}/geometry", v)
+
+        choices = {True: "ENABLED", False: "DISABLED"}
+        v = choices[r.kinetics_state == 1]
+        add(f"{detector}/kinetics_enabled", v)
+
+        v = choices[r.burst_mode_state == 1]
+        add(f"{detector}/burst_enabled", v)
+
+        #######/measurement/instrument/detector/kinetics/######
+        if r.kinetics_state == 1:
+            first_usable_window = 2
+            last_usable_window = int(r.kinetics_top/r.kinetics_window_size)-1
+            top = r.kinetics_top
+            window_size = r.kinetics_window_size
+        else :
+            first_usable_window = 0
+            last_usable_window = 0
+            top = 0
+            window_size = 0
+        add(f"{detector}/kinetics/first_usable_window", [[first_usable_window]], "uint32")
+        add(f"{detector}/kinetics/last_usable_window", [[last_usable_window]], "uint32")
+        add(f"{detector}/kinetics/top", [[top]], "uint32")
+        add(f"{detector}/kinetics/window_size", [[window_size]], "uint32")
+
+        #######/measurement/instrument/detector/roi/######
+        add(f"{detector}/roi/x1", [[r.roi_x1]], "uint32")
+        add(f"{detector}/roi/y1", [[r.roi_y1]], "uint32")
+        add(f"{detector}/roi/x2", [[r.roi_x2]], "uint32")
+        add(f"{detector}/roi/y2", [[r.roi_y2]], "uint32")
+
+        return layout
+
+    def _transfer_args(self, hdf_with_fullpath):
+        return dict(filePath=hdf_with_fullpath)
+
+    def _analysis_args(self,
+                       hdf_with_fullpath,
+                       qmapfile_with_fullpath=None,
+                       xpcs_group_name=None):
+        logger.info(f"self.QMAP_FOLDER_PATH={self.QMAP_FOLDER_PATH}")
+        logger.info(f"self.XPCS_QMAP_FILENAME={self.XPCS_QMAP_FILENAME}")
 
-        #####################################################################################
-        # Close file closes automatically due to the "with" opener
+        try:
+            default = os.path.join(self.QMAP_FOLDER_PATH, self.XPCS_QMAP_FILENAME)
+        except Exception as exc:
+            logger.warning(f"{exc}")
+            default = "/xpcs"
+        try:
+            qmapfile_with_fullpath = qmapfile_with_fullpath or default
+            xpcs_group_name = xpcs_group_name or "/xpcs"
+        except Exception as exc:
+            logger.warning(
+                f"{exc}"
+                f"default={default}"
+                f"qmapfile_with_fullpath]{qmapfile_with_fullpath}"
+                f"xpcs_group_name={xpcs_group_name}"
+                )
+        return dict(
+            filePath=hdf_with_fullpath,
+            qmapFile=qmapfile_with_fullpath,
+            xpcsGroupName=xpcs_group_name,
+        )
 
     def DataTransfer(self, hdf_with_fullpath):
         """
         initiate data transfer
         """
-        cmd = (
-            "source /home/dm/etc/dm.setup.sh; "
-            "dm-start-processing-job"
-            f" --workflow-name={self.transfer}"
-            f" filePath:{hdf_with_fullpath}"
-            )
+        cmd = start_processing_job_command(
+            self.transfer, self._transfer_args(hdf_with_fullpath))
         self.TRANSFER_COMMAND = cmd;
         logger.info(
             "DM Workflow call is made for DATA transfer: "
             f"{hdf_with_fullpath}"
             f"  ----{datetime.datetime.now()}"
             )
-        return unix(cmd)
+        return dm_command(cmd)
 
     def DataAnalysis(self, 
                      hdf_with_fullpath, 
@@ -665,54 +1157,115 @@ class DM_Workflow:
         
         SPEC note: hdf_with_fullpath : usually saved in global HDF5_METADATA_FILE 
         """
-        logger.info(f"self.QMAP_FOLDER_PATH={self.QMAP_FOLDER_PATH}")
-        logger.info(f"self.XPCS_QMAP_FILENAME={self.XPCS_QMAP_FILENAME}")
-
-        try:
-            default = os.path.join(self.QMAP_FOLDER_PATH, self.XPCS_QMAP_FILENAME)
-        except Exception as exc:
-            logger.warning(f"{exc}")
-            default = "/xpcs"
-        try:
-            qmapfile_with_fullpath = qmapfile_with_fullpath or default
-            xpcs_group_name = xpcs_group_name or "/xpcs"
-        except Exception as exc:
-            logger.warning(
-                f"{exc}"
-                f"default={default}"
-                f"qmapfile_with_fullpath]{qmapfile_with_fullpath}"
-                f"xpcs_group_name={xpcs_group_name}"
-                )
-
-        cmd = (
-            "source /home/dm/etc/dm.setup.sh; "
-            "dm-start-processing-job"
-            f" --workflow-name={self.analysis}"
-            f" filePath:{hdf_with_fullpath}"
-            f" qmapFile:{qmapfile_with_fullpath}"
-            f" xpcsGroupName:{xpcs_group_name}"
-            )
+        args = self._analysis_args(
+            hdf_with_fullpath, qmapfile_with_fullpath, xpcs_group_name)
+        cmd = start_processing_job_command(self.analysis, args)
         self.ANALYSIS_COMMAND = cmd;
 
         logger.info(
             f"DM Workflow call is made for XPCS Analysis: {hdf_with_fullpath}"
-            f",  {qmapfile_with_fullpath}"
+            f",  {args['qmapFile']}"
             f"  ----{datetime.datetime.now()}"
             )
-        return unix(cmd)
+        return dm_command(cmd)
+
+    def submit_job(self, hdf_with_fullpath, analysis=True, timeout=None):
+        """
+        queue data analysis (or transfer) of ``hdf_with_fullpath``
+
+        Returns at once with the job's key in ``job_table``.
+        The job is started (with retries) by ``submitter``.
+
+        PARAMETERS
+
+        hdf_with_fullpath : str
+            name of the HDF5 workflow file
+        analysis : bool
+            If True (default): use DataAnalysis workflow.
+            If False: use DataTransfer workflow.
+        timeout : float, optional
+            seconds to wait if the submission backlog is full
+        """
+        workflow_name, args = self._job_request(hdf_with_fullpath, analysis)
+        return self.submitter.submit(
+            workflow_name, args, hdf_with_fullpath, timeout=timeout)
+
+    def _job_request(self, hdf_with_fullpath, analysis):
+        """(workflow_name, args) of the job, using the present settings"""
+        if analysis in (1, 1.0, True):
+            return self.analysis, self._analysis_args(hdf_with_fullpath)
+        return self.transfer, self._transfer_args(hdf_with_fullpath)
+
+    def queue_workflow(self, hdf_with_fullpath, analysis=True, timeout=None):
+        """
+        write the HDF5 workflow file and submit its job, in the background
+
+        The registers, the workflow names and the qmap file are read
+        now, so the next acquisition may change them at once.
+        Blocks (up to ``timeout`` s) only when ``pipeline`` is full.
+        Call ``flush_workflows()`` at the end of a series.
+
+        PARAMETERS
+
+        hdf_with_fullpath : str
+            name of the HDF5 workflow file
+        analysis : bool
+            If True (default): use DataAnalysis workflow.
+            If False: use DataTransfer workflow.
+        timeout : float, optional
+            seconds to wait if the pipeline backlog is full
+        """
+        snapshot = self.snapshot_registers()
+        workflow_name, args = self._job_request(hdf_with_fullpath, analysis)
+        self.pipeline.put(
+            hdf_with_fullpath, snapshot, workflow_name, args, timeout=timeout)
+
+    def flush_workflows(self, timeout=None):
+        """
+        wait until all files from ``queue_workflow()`` are written
+
+        Their DM jobs have been queued with ``submitter`` by then.
+        Returns True when done, False on timeout.
+        """
+        done = self.pipeline.flush(timeout=timeout)
+        for filename, exc in self.pipeline.failed:
+            logger.error(f"workflow file not written: {filename}: {exc}")
+        self.pipeline.failed.clear()
+        return done
 
     def ListJobs(self):
         """
         list current jobs in the workflow
         """
         command = (
-            "source /home/dm/etc/dm.setup.sh; "
             "dm-list-processing-jobs"
             " --display-keys=startTime,endTime,sgeJobName,status,stage,runTime,id"
             " | sort -r"
             " |head -n 10"
             )
-        out, err = unix(command);
+        out, err = dm_command(command);
         logger.info("*"*30)
         logger.info(out)
         logger.info("*"*30)
+
+    def ListSubmissions(self, n=10):
+        """
+        list the most recent jobs submitted from this account
+
+        Reads the local job table, does not query the DM service.
+        Returns a ``pyRestTable.Table``.
+        """
+        tbl = pyRestTable.Table()
+        tbl.labels = "submitted status workflow dm_id attempts file".split()
+        for job in self.job_table.recent(n):
+            tbl.addRow(
+                [
+                    datetime.datetime.fromtimestamp(job["submitted"]).strftime("%Y-%m-%d %H:%M:%S"),
+                    job["status"],
+                    job["workflow"],
+                    job["dm_id"],
+                    job["attempts"],
+                    job["filename"],
+                ]
+            )
+        return tbl
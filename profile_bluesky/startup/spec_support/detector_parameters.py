@@ -1,89 +1,297 @@
-
 """Convert matlab code into a python dictionary"""
 
 
+import dataclasses
+import hashlib
+import json
+import logging
 import os
+import threading
+
+
+logger = logging.getLogger(f"main.{__name__}")
+
+MATLAB_FILE = os.path.join(os.path.dirname(__file__), "detectorinfo.m")
+CACHE_FILE = os.path.join(
+    os.environ.get("HOME", "/tmp"), ".cache", "bluesky_detectorinfo.json"
+)
+CACHE_VERSION = 1
+
+MANUFACTURERS = {
+    # 1: "Direct Detection CCD in slow mode",
+    # 5: "DALSA",
+    # 8: "PI Princeton Instruments",
+    # 13: "PI Princeton Instruments",
+    # 15: "APS Detector Pool Fast CCD",
+    # 20: "ANL-LBL FastCCD Detector",
+    25: "LAMBDA",
+    # 30: "EIGER",
+    # 35: "UFXC_128x256",
+    # 45: "RIGAKU500K",
+    46: "RIGAKU500K_NoGap",
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class DetectorParameters:
+    """
+    parameters of one detector, as defined in detectorinfo.m
+
+    Also supports dictionary-style access: ``parameters["dpix"]``
+    """
+
+    number: int
+    manufacturer: str
+    ccdHardwareColSize: int
+    ccdHardwareRowSize: int
+    ccdxsense: int
+    ccdzsense: int
+    harmonic: int
+    dpix: float         # pixel size in mm (x)
+    dpix_y: float       # pixel size in mm (y), same as dpix unless given as [x,y]
+    saturation: int     # saturation count in one pixel
+    adupphot: float     # adu per photon
+    efficiency: float
+    gain: float
+    blemish: int        # 1: uses blemish file
+    flatfield: int      # 1: uses flatfield file
+    distortion: int
+    parasitic: int
+    lld: float
+
+    def __post_init__(self):
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if field.type is float and isinstance(value, int):
+                object.__setattr__(self, field.name, float(value))
+            elif not isinstance(value, field.type):
+                raise TypeError(
+                    f"detector {self.number}: {field.name}={value!r}"
+                    f" should be {field.type.__name__}"
+                )
+        for key in "ccdHardwareColSize ccdHardwareRowSize saturation dpix dpix_y".split():
+            if getattr(self, key) <= 0:
+                raise ValueError(
+                    f"detector {self.number}: {key} must be positive,"
+                    f" found {getattr(self, key)}"
+                )
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def keys(self):
+        return [field.name for field in dataclasses.fields(self)]
+
+    def as_dict(self):
+        return dataclasses.asdict(self)
+
+
+def _file_signature(filename):
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+
+def _file_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _matlab_value(text):
+    """Try to convert to float or integer, else leave as string"""
+    if text.startswith("[") and text.endswith("]"):
+        return [_matlab_value(v.strip()) for v in text[1:-1].split(",")]
+    if text.find(".") >= 0:
+        dtype = float
+    else:
+        dtype = int
+    try:
+        return dtype(text)
+    except ValueError:
+        return text
+
+
+def parse_matlab_detectors(matlab_file=None):
+    """
+    Converts matlab code into a dictionary of DetectorParameters
+
+    keys are the detector numbers
+    """
+    matlab_file = matlab_file or MATLAB_FILE
+    raw = {}
+    with open(matlab_file, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if len(line) == 0 or line[0] == "%":
+                # ignore this line
+                continue
+
+            if line.startswith("if") and line.find("ccdimginfo.detector") != -1:
+                # matlab: if ( ccdimginfo.detector == ...
+                detNum = line.split("==")
+                detNum = detNum[1].split(")")
+                detNum = int(detNum[0].strip())
+                raw[detNum] = {}
+
+            elif line.startswith("ccdimginfo.") and line.find("=") >= 0:
+                # matlab: within if block, defines a parameter
+                line = line.split(";")[0].strip()   # chop off any comment
+                key, value = line.split("=")
+                key = key.split(".")[1].strip()     # trimming
+                value = value.strip()               # trimming
+                if len(raw) == 0:
+                    raise ValueError(
+                        f"{matlab_file}:{line_number}:"
+                        f" '{key}' defined outside of a detector block")
+                raw[detNum][key] = _matlab_value(value)
+
+    detectors = {}
+    for detNum, parameters in raw.items():
+        dpix = parameters.get("dpix")
+        if isinstance(dpix, list):
+            parameters["dpix"], parameters["dpix_y"] = dpix
+        else:
+            parameters["dpix_y"] = dpix
+        try:
+            detectors[detNum] = DetectorParameters(
+                number=detNum,
+                manufacturer=MANUFACTURERS.get(detNum, "UNKNOWN"),
+                **parameters,
+            )
+        except TypeError as exc:    # also: missing or unknown parameters
+            raise ValueError(f"{matlab_file}: detector {detNum}: {exc}") from exc
+    return detectors
+
+
+class DetectorRegistry:
+    """
+    Detector properties, parsed once from the matlab file
+
+    The parsed table is cached (``CACHE_FILE``), keyed by the
+    modification time and SHA-256 hash of the matlab file.
+    Parsing (or reading the cache) waits until first use.
+    """
+
+    def __init__(self, matlab_file=None, cache_file=None):
+        self.matlab_file = matlab_file or MATLAB_FILE
+        self.cache_file = cache_file or CACHE_FILE
+        self._by_number = None
+        self._by_manufacturer = None
+        self._lock = threading.Lock()
+
+    @property
+    def by_number(self):
+        """dictionary of DetectorParameters, keyed by detector number"""
+        if self._by_number is None:
+            self._load()
+        return self._by_number
+
+    @property
+    def by_manufacturer(self):
+        """dictionary of DetectorParameters, keyed by manufacturer (known only)"""
+        if self._by_manufacturer is None:
+            self._load()
+        return self._by_manufacturer
+
+    def _load(self):
+        with self._lock:
+            if self._by_number is not None:
+                return
+            detectors = self._read_cache()
+            if detectors is None:
+                detectors = parse_matlab_detectors(self.matlab_file)
+                self._write_cache(detectors)
+            self._by_manufacturer = {
+                v.manufacturer: v
+                for v in detectors.values()
+                if v.manufacturer != "UNKNOWN"
+            }
+            self._by_number = detectors
+
+    def _read_cache(self):
+        """return the cached table if still valid, else None"""
+        if not os.path.exists(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file, "r") as f:
+                cache = json.load(f)
+            if cache["version"] != CACHE_VERSION:
+                return None
+            detectors = {
+                int(k): DetectorParameters(**v)
+                for k, v in cache["detectors"].items()
+            }
+            if tuple(cache["signature"]) != _file_signature(self.matlab_file):
+                # touched but not necessarily changed
+                sha256 = _file_hash(self.matlab_file)
+                if cache["sha256"] != sha256:
+                    return None
+                # same content: record the new signature, not to hash it again
+                self._write_cache(detectors, sha256)
+            return detectors
+        except Exception as exc:
+            logger.debug(f"ignoring detector cache {self.cache_file}: {exc}")
+            return None
+
+    def _write_cache(self, detectors, sha256=None):
+        cache = dict(
+            version=CACHE_VERSION,
+            signature=_file_signature(self.matlab_file),
+            sha256=sha256 or _file_hash(self.matlab_file),
+            detectors={k: v.as_dict() for k, v in detectors.items()},
+        )
+        temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(temp_file, "w") as f:
+                json.dump(cache, f, indent=1)
+            os.replace(temp_file, self.cache_file)
+        except OSError as exc:
+            logger.debug(f"could not write detector cache {self.cache_file}: {exc}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+
+_registry = DetectorRegistry()
 
 
 class PythonDict:
     """
     Detector properties, as defined in matlab file
+
+    All instances share one (lazily loaded) ``DetectorRegistry``.
     """
-    def __init__(self):
-        self.masterDict = self._parse_matlab_detectors_()
-
-        self.manufacturerDict = {
-            # 1: "Direct Detection CCD in slow mode",
-            # 5: "DALSA", 
-            # 8: "PI Princeton Instruments", 
-            # 13: "PI Princeton Instruments", 
-            # 15: "APS Detector Pool Fast CCD",
-            # 20: "ANL-LBL FastCCD Detector", 
-            25: "LAMBDA", 
-            # 30: "EIGER", 
-            # 35: "UFXC_128x256", 
-            # 45: "RIGAKU500K", 
-            46: "RIGAKU500K_NoGap",
-        }
-        for k, v in self.masterDict.items():
-            v["manufacturer"] = self._getManufacturer_(k)
+    def __init__(self, registry=None):
+        self.registry = registry or _registry
+        self.manufacturerDict = MANUFACTURERS
+
+    @property
+    def masterDict(self):
+        return self.registry.by_number
 
     def getDetectorByNumber(self, detNum):
-        return self.masterDict[detNum]
+        return self.registry.by_number[int(detNum)]
+
+    def getDetectorByManufacturer(self, manufacturer):
+        return self.registry.by_manufacturer[manufacturer]
 
     def getManufacturerDict(self):
         return self.manufacturerDict
-    
+
     def _getManufacturer_(self, detNum):
         return self.manufacturerDict.get(detNum, "UNKNOWN")
 
     def getMasterDict(self):
         return self.masterDict
 
-    def _parse_matlab_detectors_(self):
-        "Converts matlab code into a python dictionary"
-        
-        masterDict = {}
-        
-        path = os.path.dirname(__file__)
-        matlab_file = os.path.join(path, "detectorinfo.m")
-        with open(matlab_file, "r") as f:
-            for line in f:
-                line = line.strip()
-                if len(line) == 0 or line[0] == "%":
-                    # ignore this line
-                    continue
-                
-                if line.startswith("if") and line.find("ccdimginfo.detector") != -1:
-                    # matlab: if ( ccdimginfo.detector == ...
-                    detNum = line.split("==")
-                    detNum = detNum[1].split(")")
-                    detNum = int(detNum[0].strip())
-                    masterDict[detNum] = {}
-            
-                elif line.startswith("ccdimginfo.") and line.find("=") >= 0:
-                    # matlab: within if block, defines a parameter
-                    line = line.split(";")[0].strip()   # chop off any comment
-                    key, value = line.split("=")
-                    key = key.split(".")[1].strip()     # trimming
-                    value = value.strip()               # trimming
-                    # Try to convert to float or integer, else leave as string
-                    if value.find(".") >= 0:
-                        dtype = float
-                    else:
-                        dtype = int
-                    try:
-                        value = dtype(value)
-                    except ValueError:
-                        pass
-                    masterDict[detNum][key] = value
-    
-        return masterDict
-
 
 if __name__ == "__main__":
     detectors = PythonDict()
-    
+
     # Print the dictionary an easy-to-read format
     import json
-    print(json.dumps(detectors.masterDict, indent=2))
+    print(json.dumps(
+        {k: v.as_dict() for k, v in detectors.masterDict.items()},
+        indent=2))
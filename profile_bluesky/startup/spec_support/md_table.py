@@ -2,12 +2,24 @@
 
 """
 print metadata PV values as a table, use ophyd
+
+All registers are connected and read in parallel.  Registers not
+connected within the timeout are reported (not waited for).
+
+    md_table.py [--timeout 2] [--csv FILE] [--json FILE]
 """
 
 from ophyd import Component, Device, EpicsSignal
 from pyRestTable import Table
+import argparse
+import concurrent.futures
+import csv
+import json
 import time
 
+SNAPSHOT_TIMEOUT = 2.0
+SNAPSHOT_THREADS = 32
+
 
 class NumReg(Device):
     description = Component(EpicsSignal, ".DESC", string=True)
@@ -38,18 +50,6 @@ class Metadata:
             for n in range(self.number_registers_max)
             ]
 
-    def _table_part(self, title, tbl, collection):
-        for n, register in enumerate(collection):
-            tbl.addRow(
-                [
-                    title,
-                    n+1,
-                    register.prefix,
-                    register.description.get(),
-                    register.signal.get(),
-                ]
-            )
-
     @property
     def connected(self):
         for register in self.strings + self.numbers:
@@ -57,24 +57,94 @@ class Metadata:
                 return False
         return True
 
-    def table(self):
+    def snapshot(self, timeout=SNAPSHOT_TIMEOUT):
+        """
+        connect and read all registers in parallel, wait at most ``timeout`` s
+
+        Returns a list of dictionaries (one per register).
+        Unconnected registers have ``connected=False`` and no values.
+        """
+        deadline = time.time() + timeout
+
+        def read(item):
+            title, n, register = item
+            row = dict(
+                type=title,
+                number=n,
+                PV=register.prefix,
+                description=None,
+                value=None,
+                connected=False,
+            )
+            try:
+                register.wait_for_connection(timeout=max(0.001, deadline - time.time()))
+                row["description"] = register.description.get()
+                row["value"] = register.signal.get()
+                row["connected"] = True
+            except TimeoutError:
+                pass
+            return row
+
+        items = [
+            ("text", n+1, register) for n, register in enumerate(self.strings)
+        ] + [
+            ("number", n+1, register) for n, register in enumerate(self.numbers)
+        ]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=SNAPSHOT_THREADS
+        ) as executor:
+            return list(executor.map(read, items))
+
+    def table(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
         tbl = Table()
         tbl.labels = "type # PV description value".split()
-        self._table_part("text", tbl, self.strings)
-        self._table_part("number", tbl, self.numbers)
+        for row in snapshot:
+            if row["connected"]:
+                tbl.addRow([row[k] for k in "type number PV description value".split()])
         return tbl
 
 
-def main():
-    md = Metadata()
+def unconnected(snapshot):
+    """PV prefixes of the registers not connected in ``snapshot``"""
+    return [row["PV"] for row in snapshot if not row["connected"]]
+
+
+def write_csv(snapshot, filename):
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(snapshot[0].keys()))
+        writer.writeheader()
+        writer.writerows(snapshot)
+
+
+def write_json(snapshot, filename):
+    with open(filename, "w") as f:
+        json.dump(snapshot, f, indent=2, default=str)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--timeout", type=float, default=SNAPSHOT_TIMEOUT,
+        help=f"seconds to wait for connections (default: {SNAPSHOT_TIMEOUT})")
+    parser.add_argument("--csv", help="also write the table to this CSV file")
+    parser.add_argument("--json", help="also write the table to this JSON file")
+    args = parser.parse_args(argv)
+
     t0 = time.time()
-    while not md.connected:
-        # check all PVs connected
-        dt = time.time()-t0
-        if dt > 0.5:
-            print(f"waited {dt:.2f}s for all registers to connect ...")
-        time.sleep(1.0)
-    print(md.table().reST(fmt="markdown"))
+    md = Metadata()
+    snapshot = md.snapshot(timeout=args.timeout)
+    print(md.table(snapshot).reST(fmt="markdown"))
+
+    missing = unconnected(snapshot)
+    if len(missing) > 0:
+        print(f"{len(missing)} register(s) not connected: {' '.join(missing)}")
+    print(f"{len(snapshot)} registers in {time.time()-t0:.3f}s")
+
+    if args.csv:
+        write_csv(snapshot, args.csv)
+    if args.json:
+        write_json(snapshot, args.json)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,322 @@
+"""
+Read the q partitions of a qmap file
+
+Qmap files (such as ``Lambda_qmap.h5``, in
+``/home/8-id-i/partitionMapLibrary/<cycle>``) assign each detector
+pixel to a dynamic (XPCS) and a static (SAXS) q bin.  Bin numbers
+start at 1, 0 means the pixel is not used.
+
+``load_qmap()`` returns the partitions as compact pixel -> bin index
+arrays (``PartitionIndex``), so any frame is binned with one
+``np.bincount``.  The index arrays are computed once per qmap file
+and saved as ``.npy`` files (``QMAP_CACHE_DIR``).  Other processes
+(and later sessions) memory-map them, not recompute them.  The last
+few are kept in memory (LRU).  A qmap file changed since (its mtime
+or size) is read again.
+
+EXAMPLE::
+
+    qmap = load_qmap("/home/8-id-i/partitionMapLibrary/2022-2/Lambda_qmap.h5")
+    intensity = qmap.static.mean(frame)     # I(q) of one frame
+"""
+
+import collections
+import hashlib
+import h5py
+import json
+import logging
+import numpy as np
+import os
+import threading
+
+
+logger = logging.getLogger(f"main.{__name__}")
+
+# HDF5 addresses of the partitions in the qmap file
+QMAP_DATASETS = dict(
+    dynamic="/data/dynamicMap",
+    static="/data/staticMap",
+    mask="/data/mask",
+    dynamic_q="/data/dqval",
+    static_q="/data/sqval",
+)
+QMAP_CACHE_DIR = os.path.join(
+    os.environ.get("HOME", "/tmp"), ".cache", "bluesky_qmap"
+)
+QMAP_CACHE_SIZE = 8     # qmaps kept in memory
+QMAP_CACHE_VERSION = 1
+
+
+class QMap:
+    """
+    q partitions of a detector, from a qmap file
+
+    ATTRIBUTES
+
+    dynamic : int array (rows, cols)
+        dynamic bin of each pixel (0: not used)
+    static : int array (rows, cols)
+        static bin of each pixel (0: not used)
+    dynamic_q : float array
+        q of each dynamic bin (bin ``k`` is ``dynamic_q[k-1]``)
+    static_q : float array
+        q of each static bin
+    """
+
+    def __init__(self, dynamic, static, dynamic_q=None, static_q=None, filename=None):
+        self.filename = filename
+        self.dynamic = np.asarray(dynamic, dtype=np.int32)
+        self.static = np.asarray(static, dtype=np.int32)
+        self.dynamic_q = np.asarray(
+            np.arange(1, self.num_dynamic + 1) if dynamic_q is None else dynamic_q,
+            dtype=float,
+        ).ravel()
+        self.static_q = np.asarray(
+            np.arange(1, self.num_static + 1) if static_q is None else static_q,
+            dtype=float,
+        ).ravel()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}({self.filename!r}, shape={self.shape},"
+            f" dynamic={self.num_dynamic}, static={self.num_static})"
+        )
+
+    @property
+    def shape(self):
+        return self.dynamic.shape
+
+    @property
+    def num_dynamic(self):
+        return int(self.dynamic.max(initial=0))
+
+    @property
+    def num_static(self):
+        return int(self.static.max(initial=0))
+
+
+def read_qmap(filename):
+    """read the partitions of qmap file ``filename``, returns a QMap"""
+    with h5py.File(filename, "r") as f:
+        arrays = {
+            key: f[address][()]
+            for key, address in QMAP_DATASETS.items()
+            if address in f
+        }
+    for key in "dynamic static".split():
+        if key not in arrays:
+            raise KeyError(f"{filename}: no {QMAP_DATASETS[key]}")
+        arrays[key] = np.squeeze(arrays[key]).astype(np.int32)
+    mask = arrays.pop("mask", None)
+    if mask is not None:
+        # masked pixels are not in any bin
+        mask = np.squeeze(mask).astype(bool)
+        for key in "dynamic static".split():
+            arrays[key][~mask] = 0
+    logger.debug("qmap %s: %s", filename, {k: np.shape(v) for k, v in arrays.items()})
+    return QMap(filename=filename, **arrays)
+
+
+class PartitionIndex:
+    """
+    sparse pixel -> bin index of one partition
+
+    ATTRIBUTES
+
+    pixels : int array
+        flat index (``row * cols + col``) of each pixel in a bin
+    bins : int array
+        bin of each of these pixels, from 0 (qmap bin 1) to ``num_bins - 1``
+    num_bins : int
+    shape : (rows, cols)
+    q : float array
+        q of each bin
+    """
+
+    def __init__(self, pixels, bins, num_bins, shape, q):
+        self.pixels = pixels
+        self.bins = bins
+        self.num_bins = int(num_bins)
+        self.shape = tuple(int(n) for n in shape)
+        self.q = q
+        self._counts = None
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(shape={self.shape},"
+            f" pixels={len(self.pixels)}, bins={self.num_bins})"
+        )
+
+    @classmethod
+    def from_map(cls, partition_map, q):
+        """index of a (rows, cols) map of bin numbers (1 .. N, 0: not used)"""
+        flat = np.asarray(partition_map).ravel()
+        pixels = np.flatnonzero(flat > 0).astype(np.int32)
+        bins = (flat[pixels] - 1).astype(np.int32)
+        num_bins = int(flat.max(initial=0))
+        return cls(pixels, bins, num_bins, np.shape(partition_map), np.asarray(q, float))
+
+    @property
+    def counts(self):
+        """number of pixels in each bin"""
+        if self._counts is None:
+            self._counts = np.bincount(self.bins, minlength=self.num_bins)
+        return self._counts
+
+    def to_map(self):
+        """(rows, cols) map of bin numbers (1 .. N, 0: not used)"""
+        partition_map = np.zeros(self.shape[0] * self.shape[1], dtype=np.int32)
+        partition_map[self.pixels] = self.bins + 1
+        return partition_map.reshape(self.shape)
+
+    def sum(self, frame):
+        """sum of ``frame`` (rows, cols) in each bin, one ``np.bincount``"""
+        values = np.asarray(frame).reshape(-1)[self.pixels]
+        return np.bincount(self.bins, weights=values, minlength=self.num_bins)
+
+    def mean(self, frame):
+        """mean of ``frame`` (rows, cols) in each bin"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sum(frame) / self.counts
+
+    def sum_frames(self, frames):
+        """sums (n, num_bins) of ``frames`` (n, rows, cols), one ``np.bincount``"""
+        frames = np.asarray(frames)
+        n = len(frames)
+        values = frames.reshape(n, -1)[:, self.pixels]
+        bins = (np.arange(n)[:, None] * self.num_bins + self.bins).ravel()
+        sums = np.bincount(bins, weights=values.ravel(), minlength=n * self.num_bins)
+        return sums.reshape(n, self.num_bins)
+
+
+class QMapPartitions:
+    """dynamic and static ``PartitionIndex`` of a qmap file"""
+
+    def __init__(self, dynamic, static, filename=None):
+        self.dynamic = dynamic
+        self.static = static
+        self.filename = filename
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}({self.filename!r},"
+            f" dynamic={self.dynamic.num_bins}, static={self.static.num_bins})"
+        )
+
+
+PARTITION_ARRAYS = "pixels bins q".split()
+
+
+class QMapCache:
+    """
+    LRU cache of qmap partitions, backed by memory-mapped ``.npy`` files
+
+    PARAMETERS
+
+    cache_dir : str, optional
+        default: ``~/.cache/bluesky_qmap``
+    maxsize : int, optional
+        qmaps kept in memory, default: 8
+    """
+
+    def __init__(self, cache_dir=None, maxsize=QMAP_CACHE_SIZE):
+        self.cache_dir = cache_dir or QMAP_CACHE_DIR
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()   # {path: (signature, partitions)}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        """QMapPartitions of qmap file ``filename``"""
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                return entry[1]
+        partitions = self._read_files(path, signature)
+        if partitions is None:
+            qmap = read_qmap(path)
+            partitions = QMapPartitions(
+                PartitionIndex.from_map(qmap.dynamic, qmap.dynamic_q),
+                PartitionIndex.from_map(qmap.static, qmap.static_q),
+                filename=path,
+            )
+            self._write_files(path, signature, partitions)
+            # memory-map what was written, as other processes will
+            partitions = self._read_files(path, signature) or partitions
+        with self._lock:
+            self._entries[path] = (signature, partitions)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return partitions
+
+    def clear(self):
+        """forget the qmaps in memory (not the files)"""
+        with self._lock:
+            self._entries.clear()
+
+    def _prefix(self, path):
+        key = hashlib.sha1(path.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{os.path.basename(path)}-{key}")
+
+    def _read_files(self, path, signature):
+        """partitions from the cache files, None if missing or out of date"""
+        prefix = self._prefix(path)
+        try:
+            with open(f"{prefix}.json", "r") as f:
+                meta = json.load(f)
+            if meta["version"] != QMAP_CACHE_VERSION:
+                return None
+            if tuple(meta["signature"]) != signature:
+                return None
+            indexes = {}
+            for part in "dynamic static".split():
+                arrays = {
+                    key: np.load(f"{prefix}.{part}_{key}.npy", mmap_mode="r")
+                    for key in PARTITION_ARRAYS
+                }
+                indexes[part] = PartitionIndex(
+                    shape=meta["shape"], num_bins=meta[f"{part}_bins"], **arrays
+                )
+        except (OSError, KeyError, ValueError) as exc:
+            logger.debug("no qmap cache for %s: %s", path, exc)
+            return None
+        return QMapPartitions(filename=path, **indexes)
+
+    def _write_files(self, path, signature, partitions):
+        """save the index arrays, each file atomically, the .json last"""
+        prefix = self._prefix(path)
+        pid = os.getpid()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            meta = dict(
+                version=QMAP_CACHE_VERSION,
+                qmap_file=path,
+                signature=list(signature),
+                shape=list(partitions.dynamic.shape),
+            )
+            for part in "dynamic static".split():
+                index = getattr(partitions, part)
+                meta[f"{part}_bins"] = index.num_bins
+                for key in PARTITION_ARRAYS:
+                    filename = f"{prefix}.{part}_{key}.npy"
+                    with open(f"{filename}.{pid}.tmp", "wb") as f:
+                        np.save(f, getattr(index, key))
+                    os.replace(f"{filename}.{pid}.tmp", filename)
+            with open(f"{prefix}.json.{pid}.tmp", "w") as f:
+                json.dump(meta, f)
+            os.replace(f"{prefix}.json.{pid}.tmp", f"{prefix}.json")
+        except OSError as exc:
+            # such as a read-only home directory: keep it in memory only
+            logger.debug("could not write qmap cache %s: %s", prefix, exc)
+
+
+qmap_cache = QMapCache()
+
+
+def load_qmap(filename):
+    """QMapPartitions of qmap file ``filename`` (cached)"""
+    return qmap_cache.get(filename)
@@ -0,0 +1,236 @@
+"""
+TCP client for the Rigaku UFXC LabView control channel
+
+Commands (such as ``FILE:F:A001`` or ``EXPOSURE``) are text lines.
+One connection is kept open (and re-opened as needed).  Commands
+may be sent without waiting for the previous reply (pipelined);
+replies are matched to commands in order.  A reply line starting
+with ``ERR`` (or ``FAIL``) is an error.  If the server closes the
+connection before a command's reply, the command fails
+(``ConnectionError``): it is not known whether the server ran it.
+A connection the server has closed is replaced before sending.
+
+The LabView server is expected to answer each command line with one
+line (``OK ...`` or ``ERR ...``).  This has been checked only with
+a local fake server (``tests/fake_rigaku_server.py``), not with the
+LabView server (which was used as ``echo ... | nc``, not reading any
+reply).  So, by default (``replies=False``), a command is done once it
+is sent.  With ``replies=True``, if a reply does not come within the
+timeout, the command fails and the connection is dropped (the replies
+that follow could no longer be matched to commands).
+
+EXAMPLE::
+
+    client = RigakuClient("rigaku1.xray.aps.anl.gov", 10000)
+    client.command("FILE:F:A001")
+"""
+
+__all__ = [
+    "RigakuClient",
+    "RigakuError",
+    "RigakuReply",
+]
+
+from collections import deque
+from collections import namedtuple
+import concurrent.futures
+import logging
+import socket
+import threading
+import time
+
+
+logger = logging.getLogger(f"main.{__name__}")
+
+RigakuReply = namedtuple("RigakuReply", "command text latency")
+
+
+class RigakuError(RuntimeError):
+    """The Rigaku server reported an error."""
+
+
+def _closed_by_server(sock):
+    """True if the server has closed ``sock`` (checked without waiting)"""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False    # open, nothing to read
+    except OSError:
+        return True
+
+
+def parse_reply(command, line, t0):
+    """RigakuReply from the server's reply ``line``, raise if an error"""
+    text = line.decode(errors="replace").strip()
+    if text.upper().startswith(("ERR", "FAIL")):
+        raise RigakuError(f"{command}: {text}")
+    return RigakuReply(command, text, time.time() - t0)
+
+
+class RigakuClient:
+    """
+    persistent, reconnecting connection to the Rigaku server
+
+    PARAMETERS
+
+    host : str
+        Rigaku server host name
+    port : int
+        Rigaku server TCP port
+    timeout : float, optional
+        seconds to connect, or to wait in ``command()``, default: 5
+    replies : bool, optional
+        the server answers each command with one line, default: False
+        (not verified with the LabView server: a command is done once sent)
+    """
+
+    def __init__(self, host, port, timeout=5.0, replies=False):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.replies = replies
+        self._sock = None
+        self._pending = None    # deque of (command, t0, future), per connection
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.host!r}, {self.port})"
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        pending = deque()
+        self._sock, self._pending = sock, pending
+        threading.Thread(
+            target=self._reader,
+            args=(sock, pending),
+            name="rigaku_reader",
+            daemon=True,
+        ).start()
+        logger.debug("connected to Rigaku server %s:%s", self.host, self.port)
+
+    def _drop(self, sock):
+        """forget this connection (if still the current one)"""
+        if self._sock is sock:
+            self._sock = None
+        try:
+            sock.shutdown(socket.SHUT_RDWR)     # wakes up its reader
+        except OSError:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _reader(self, sock, pending):
+        """match reply lines to the pending commands, in order"""
+        try:
+            for line in sock.makefile("rb"):
+                with self._lock:
+                    if len(pending) == 0:
+                        logger.warning("unexpected Rigaku reply: %s", line)
+                        continue
+                    command, t0, future = pending.popleft()
+                try:
+                    future.set_result(parse_reply(command, line, t0))
+                except RigakuError as exc:
+                    future.set_exception(exc)
+        except OSError as exc:
+            logger.debug("Rigaku connection: %s", exc)
+        with self._lock:
+            self._drop(sock)
+            failed = list(pending)
+            pending.clear()
+        # closed before their replies: did the server run them?
+        for command, t0, future in failed:
+            future.set_exception(
+                ConnectionError(
+                    f"{command}: Rigaku server {self.host}:{self.port}"
+                    " closed the connection before replying"
+                )
+            )
+
+    def send(self, command):
+        """
+        send ``command``, do not wait, returns a Future of its RigakuReply
+
+        Reconnects (once) if the connection was lost.
+        """
+        future = concurrent.futures.Future()
+        data = (command.strip() + "\n").encode()
+        with self._lock:
+            for attempt in (1, 2):
+                sock = self._sock
+                try:
+                    if sock is not None and _closed_by_server(sock):
+                        self._drop(sock)
+                        sock = None
+                    if sock is None:
+                        self._connect()
+                        sock = self._sock
+                    if self.replies:
+                        self._pending.append((command, time.time(), future))
+                    sock.sendall(data)
+                    if not self.replies:
+                        future.set_result(RigakuReply(command, "", 0))
+                    break
+                except OSError as exc:
+                    if self._pending is not None and len(self._pending) > 0:
+                        if self._pending[-1][2] is future:
+                            self._pending.pop()
+                    if sock is not None:
+                        self._drop(sock)
+                    if attempt == 2:
+                        future.set_exception(
+                            ConnectionError(
+                                f"Rigaku server {self.host}:{self.port}: {exc}"
+                            )
+                        )
+                    else:
+                        logger.debug("reconnecting to Rigaku server: %s", exc)
+        return future
+
+    def command(self, command, timeout=None):
+        """send ``command`` and wait for its RigakuReply"""
+        timeout = self.timeout if timeout is None else timeout
+        future = self.send(command)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            self.abandon(future)
+            return future.result()  # raises TimeoutError, unless just answered
+
+    def abandon(self, future):
+        """
+        stop waiting for the reply to ``future`` (such as after a timeout)
+
+        Replies are matched to commands in order: once one is missing,
+        the connection is dropped and its other waiting commands fail.
+        """
+        with self._lock:
+            pending = self._pending
+            if future.done() or pending is None:
+                return
+            if not any(f is future for _, _, f in pending):
+                return
+            failed = list(pending)
+            pending.clear()
+            if self._sock is not None:
+                self._drop(self._sock)
+        for command, t0, f in failed:
+            f.set_exception(
+                TimeoutError(
+                    f"{command}: no reply from Rigaku server"
+                    f" {self.host}:{self.port} after {time.time() - t0:.3f} s"
+                )
+            )
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._drop(self._sock)
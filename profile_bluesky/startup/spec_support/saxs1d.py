@@ -0,0 +1,159 @@
+"""
+I(q) (SAXS, 1-D) of each frame of a series, with the static q bins
+
+The static partition of the qmap file gives the q bins.  The geometry
+written to the HDF5 workflow file by ``create_hdf5_file`` (beam
+center, detector distance, pixel size, energy) gives the q of each
+pixel, so the q of each bin is the mean q of its pixels.
+
+Frames are reduced in chunks, in threads: the pixels are gathered
+(sorted by bin) with ``np.take`` and summed with ``np.add.reduceat``,
+both of which release the GIL.
+
+EXAMPLE::
+
+    result = saxs1d(hdf_file, IMMFile(imm_file).to_dask(), qmap_file)
+    print(result.q, result.intensity.mean(axis=0))
+"""
+
+import collections
+import concurrent.futures
+import h5py
+import logging
+import numpy as np
+import os
+import time
+
+from .qmap import load_qmap
+
+
+logger = logging.getLogger(f"main.{__name__}")
+
+CHUNK_FRAMES = 256
+HC = 12.3984193     # keV * Angstrom
+
+Geometry = collections.namedtuple(
+    "Geometry",
+    "beam_center_x beam_center_y distance x_pixel_size y_pixel_size energy",
+)
+SAXSResult = collections.namedtuple("SAXSResult", "q intensity counts elapsed")
+
+# HDF5 addresses (written by create_hdf5_file) of the Geometry fields
+GEOMETRY_DATASETS = dict(
+    beam_center_x="/measurement/instrument/acquisition/beam_center_x",
+    beam_center_y="/measurement/instrument/acquisition/beam_center_y",
+    distance="/measurement/instrument/detector/distance",
+    x_pixel_size="/measurement/instrument/detector/x_pixel_size",
+    y_pixel_size="/measurement/instrument/detector/y_pixel_size",
+    energy="/measurement/instrument/source_begin/energy",
+)
+
+
+def read_geometry(hdf_file):
+    """Geometry from the HDF5 workflow file (lengths: mm, energy: keV)"""
+    with h5py.File(hdf_file, "r") as f:
+        values = {
+            key: float(np.ravel(f[address][()])[0])
+            for key, address in GEOMETRY_DATASETS.items()
+        }
+    return Geometry(**values)
+
+
+def pixel_q(geometry, shape):
+    """q (1/Angstrom) of each pixel, array of ``shape`` (rows, cols)"""
+    rows, cols = np.indices(shape, dtype=float)
+    x = (cols - geometry.beam_center_x) * geometry.x_pixel_size
+    y = (rows - geometry.beam_center_y) * geometry.y_pixel_size
+    two_theta = np.arctan2(np.hypot(x, y), geometry.distance)
+    wavelength = HC / geometry.energy
+    return 4 * np.pi / wavelength * np.sin(two_theta / 2)
+
+
+class IqReducer:
+    """
+    sum each frame over the bins of a partition, chunks in threads
+
+    PARAMETERS
+
+    partition : PartitionIndex
+        such as ``load_qmap(qmap_file).static``
+    workers : int, optional
+        threads, default: number of CPUs
+    chunk_frames : int, optional
+        frames reduced at a time, default: 256
+    """
+
+    def __init__(self, partition, workers=None, chunk_frames=CHUNK_FRAMES):
+        self.partition = partition
+        self.workers = workers or os.cpu_count()
+        self.chunk_frames = chunk_frames
+        # pixels sorted by bin: each bin is one contiguous run
+        order = np.argsort(partition.bins, kind="stable")
+        self._pixels = np.asarray(partition.pixels)[order]
+        sorted_bins = np.asarray(partition.bins)[order]
+        self._bins, self._starts = np.unique(sorted_bins, return_index=True)
+
+    def sum_frames(self, frames):
+        """sums (n, num_bins) of ``frames`` (n, rows, cols)"""
+        frames = np.asarray(frames)
+        n = len(frames)
+        sums = np.zeros((n, self.partition.num_bins))
+        if n > 0 and len(self._pixels) > 0:
+            values = np.take(frames.reshape(n, -1), self._pixels, axis=1)
+            sums[:, self._bins] = np.add.reduceat(
+                values, self._starts, axis=1, dtype=float)
+        return sums
+
+    def reduce(self, frames):
+        """
+        mean (n, num_bins) of each bin of each frame
+
+        ``frames`` is any array-like (n, rows, cols) that can be sliced,
+        such as a memory map or a dask array: each chunk is read
+        (``np.asarray(frames[a:b])``) by the thread that reduces it.
+        """
+        n = len(frames)
+        chunks = [
+            (start, min(start + self.chunk_frames, n))
+            for start in range(0, n, self.chunk_frames)
+        ]
+
+        def reduce_chunk(chunk):
+            start, stop = chunk
+            return self.sum_frames(np.asarray(frames[start:stop]))
+
+        sums = np.zeros((n, self.partition.num_bins))
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            for (start, stop), result in zip(chunks, executor.map(reduce_chunk, chunks)):
+                sums[start:stop] = result
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sums / self.partition.counts
+
+
+def saxs1d(hdf_file, frames, qmap_file, workers=None, chunk_frames=CHUNK_FRAMES):
+    """
+    I(q) of each frame, returns SAXSResult
+
+    PARAMETERS
+
+    hdf_file : str
+        HDF5 workflow file of the series (for the geometry), or None
+        to use the q values of the qmap file
+    frames : array-like (n, rows, cols)
+    qmap_file : str
+        the static bins are used
+    """
+    t0 = time.time()
+    partition = load_qmap(qmap_file).static
+    if hdf_file is None:
+        q = np.asarray(partition.q)
+    else:
+        q_map = pixel_q(read_geometry(hdf_file), partition.shape).ravel()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            q = partition.sum(q_map) / partition.counts
+    reducer = IqReducer(partition, workers=workers, chunk_frames=chunk_frames)
+    intensity = reducer.reduce(frames)
+    elapsed = time.time() - t0
+    logger.debug(
+        "I(q) of %d frames, %d bins: %.3f s", len(intensity), len(q), elapsed)
+    return SAXSResult(q, intensity, partition.counts, elapsed)
@@ -42,14 +42,32 @@ this file is in:
     /home/8-id-i/partitionMapLibrary/2019-3/
 
 which will work out with the default basename and the hackulated cycle.
+
+EVENT-DRIVEN MODE:
+
+`spec_DM_support.py --events` (or `helper.py --events`) replaces the
+polling loop with EPICS monitor callbacks.  The helper sleeps until
+`workflow_start` (or `workflow_caller`) changes, takes a snapshot of
+the registers, resets `workflow_start` right away (so SPEC can continue)
+and queues the job.  Several worker threads write the HDF5 files and
+queue the workflows concurrently.  Each job's status is logged.
+In this mode, `workflow_ticker` increments once per second
+(`--ticker` option), so a SPEC checkup should watch it for a few seconds.
 """
 
+import argparse
+import collections
+import copy
+import dataclasses
 import datetime
 import epics
+import itertools
 import logging
 import os
 import pyRestTable
+import queue
 import stdlogpj     # pip install stdlogpj
+import threading
 import time
 
 from . import APS_DM_8IDI
@@ -63,9 +81,18 @@ logger = stdlogpj.standard_logging_setup(
     maxBytes=1*MB, backupCount=9)
 
 
+PUT_TIMEOUT = 1.0        # s, to wait for a caput to complete
+READBACK_TIMEOUT = 0.05  # s, then to wait for the monitor to report the new value
+PUT_LATENCY_HISTORY = 100
+
+
 class MyPV(object):
     """
     wrapper so we can read waveform strings as strings
+
+    ``put(value, wait=True)`` waits (without polling) for the record
+    to complete processing, then for the monitor to report ``value``.
+    The time of each such put is kept in ``put_latency``.
     """
     def __init__(self, pv, string=False):
         self.string = string
@@ -78,6 +105,10 @@ class MyPV(object):
         p = pv.find("Reg")
         n = int(pv[p+3:])
         self.id_str = "%s_%03d" % (self.data_type, n)
+        self.put_latency = collections.deque(maxlen=PUT_LATENCY_HISTORY)
+        self._readback = None
+        self._readback_changed = threading.Condition()
+        self._monitor_index = None
     
     def __repr__(self):
         args = '"%s"' % self.pv.pvname
@@ -93,32 +124,57 @@ class MyPV(object):
         as_string = as_string or self.string
         return self.pv.get(as_string=as_string)
 
-    def put(self, value, wait=False, timeout=30):
+    def _on_readback(self, value=None, char_value=None, **kwargs):
+        """pyepics monitor callback"""
+        with self._readback_changed:
+            self._readback = char_value if self.string else value
+            self._readback_changed.notify_all()
+
+    def _wait_readback(self, value, timeout):
+        """wait (no polling) until the monitor reports ``value``"""
+        if self._monitor_index is None:
+            self._readback = self.pv.get(as_string=self.string)
+            self._monitor_index = self.pv.add_callback(self._on_readback)
+        with self._readback_changed:
+            return self._readback_changed.wait_for(
+                lambda: self._readback == value, timeout=timeout)
+
+    def put(self, value, wait=False, timeout=PUT_TIMEOUT):
+        """
+        write ``value``, if ``wait``: return True when done, False on timeout
+        """
         if "8idi:Reg171" == self.pv.pvname:     # ticker increment
-            response = self.pv.put(value)
+            return self.pv.put(value)
 
-        else:
-            logger.debug(f'caput("{self.pv.pvname}", {value})')
+        logger.debug(f'caput("{self.pv.pvname}", {value})')
+        if not wait:
             try:
-                response = self.pv.put(value, wait=wait, timeout=timeout)
+                return self.pv.put(value)
             except Exception as exc:
                 print(exc)
-        
-            # implement the wait for ourselves
-            t0 = time.time()
-            t_end = t0 + 0.05
-            while (wait 
-                    and 
-                    time.time() < t_end 
-                    and 
-                    self.pv.get(as_string=self.string) != value
-                    ):
-                time.sleep(0.0002)
-        
-            msg = (f'value now: {self.pv.get(as_string=self.string)}'
-                   f"   in {time.time()-t0:.4f}s")
-            logger.debug(msg)
-        return response
+                return None
+
+        t0 = time.time()
+        completed = threading.Event()
+        try:
+            self.pv.put(
+                value, 
+                use_complete=True, 
+                callback=lambda **kwargs: completed.set(),
+                )
+        except Exception as exc:
+            print(exc)
+            return False
+        if not completed.wait(timeout):
+            logger.warning(f'caput("{self.pv.pvname}", {value}) not done in {timeout}s')
+            return False
+        done = self._wait_readback(value, READBACK_TIMEOUT)
+        self.put_latency.append(time.time() - t0)
+
+        msg = (f'value now: {self._readback}'
+               f"   in {self.put_latency[-1]:.4f}s")
+        logger.debug(msg)
+        return done
 
 
 class DMDBase(object):
@@ -135,6 +191,25 @@ class DMDBase(object):
                 attrs.append(k)
         return attrs
 
+    def getPutLatencyTable(self):
+        """statistics of the waited puts (in ms), for each register"""
+        tbl = pyRestTable.Table()
+        tbl.labels = "name PV puts mean_ms max_ms".split()
+        for k in sorted(self.pv_attributes):
+            obj = getattr(self, k)
+            if len(obj.put_latency) > 0:
+                latency = list(obj.put_latency)
+                tbl.addRow(
+                    [
+                        k,
+                        obj.pv.pvname,
+                        len(latency),
+                        f"{1000*sum(latency)/len(latency):.2f}",
+                        f"{1000*max(latency):.2f}",
+                    ]
+                )
+        return tbl
+
     def getTable(self):
         tbl = pyRestTable.Table()
         tbl.labels = "type name PV description value".split()
@@ -304,12 +379,7 @@ class WorkflowHelper:
                 t_next_increment = t_now + self.increment_interval
                 self.incrementTicker()
 
-            if (self.registers.workflow_start.get() != 0
-                and 
-                self.registers.workflow_caller.get().lower() == "spec"
-                and
-                not work_in_progress
-            ):
+            if self.isTriggered() and not work_in_progress:
                 work_in_progress = True
                 logger.debug("workflow handling triggered")
                 self.workflow.set_xpcs_qmap_file(
@@ -325,24 +395,224 @@ class WorkflowHelper:
                 dt = time.time() - t0
                 logger.info(f"after starting data management workflow ({dt:.3f}s)")
                 logger.info(f"workflow file: {self.workflow.hdf_workflow_file}")
-                calls = 0
-                while self.registers.workflow_start.get() != 0:
-                    self.registers.workflow_start.put(0, wait=True, timeout=0.1)
-                    calls += 1
-                    if (calls % 10) == 0:
-                        logger.warning("retrying caput(trigger PV, 0) {calls} times")
-                if calls > 1:
-                    logger.warning(f"RETRY: put trigger PV value took {calls} tries")
-                logger.debug(f"reset trigger: {self.registers.workflow_start.get()} (should be '0')")
+                self.resetStartTrigger()
                 work_in_progress = False
 
             time.sleep(self.loop_sleep)
 
+    def isTriggered(self):
+        """Has the caller ('spec') asked for a workflow?"""
+        return (
+            self.registers.workflow_start.get() != 0
+            and
+            self.registers.workflow_caller.get().lower() == "spec"
+        )
+
+    def resetStartTrigger(self):
+        """set 'workflow_start' back to 0, tell the caller we have it"""
+        calls = 0
+        while self.registers.workflow_start.get() != 0:
+            # each try waits (without polling) for completion
+            calls += 1
+            if self.registers.workflow_start.put(0, wait=True):
+                latency = self.registers.workflow_start.put_latency[-1]
+                logger.debug(f"reset trigger in {latency:.4f}s")
+                break
+            logger.warning(f"retrying caput(trigger PV, 0) {calls} times")
+        if calls > 1:
+            logger.warning(f"RETRY: put trigger PV value took {calls} tries")
+        logger.debug(f"reset trigger: {self.registers.workflow_start.get()} (should be '0')")
+
+
+@dataclasses.dataclass
+class WorkflowJob:
+    """one triggered workflow, as tracked by EventWorkflowHelper"""
+
+    number: int
+    analysis: bool
+    filename: str
+    workflow: APS_DM_8IDI.DM_Workflow   # configured for this job
+    snapshot: APS_DM_8IDI.WorkflowSnapshot
+    status: str = "queued"      # queued, running, done, failed
+    t_trigger: float = 0
+    t_start: float = None
+    t_end: float = None
+    dm_job: str = ""    # key in the DM job table
+    err: str = ""
+
+    @property
+    def workflow_name(self):
+        if self.analysis:
+            return self.workflow.analysis
+        return self.workflow.transfer
+
+
+class EventWorkflowHelper(WorkflowHelper):
+    """
+    event-driven replacement for the polling loop
+
+    PARAMETERS
+
+    workers : int
+        number of workflows that may run at the same time (default: 4)
+    ticker_interval : float
+        seconds between increments of 'workflow_ticker' (default: 1)
+    history : int
+        number of finished jobs kept in ``jobs`` (default: 100)
+    """
+
+    def __init__(self, workers=4, ticker_interval=1.0, history=100):
+        super().__init__()
+        self.increment_interval = ticker_interval
+        self.workers = workers
+        self.history = history
+
+        self.jobs = collections.OrderedDict()   # job number: WorkflowJob
+        self.job_queue = queue.Queue()
+        self._job_numbers = itertools.count(1)
+        self._trigger = threading.Event()
+
+    def _on_trigger_change(self, **kwargs):
+        """EPICS monitor callback: no CA calls here, wake the event loop"""
+        self._trigger.set()
+
+    def runEventLoop(self):
+        """
+        wait for signal ('workflow_start') to start data management workflow
+
+        * Increment 'workflow_ticker' every ``ticker_interval`` seconds
+        * when workflow_start!=0 and workflow_caller="spec",
+          - snapshot the registers and queue the job
+          - set workflow_start back to 0
+          - a worker thread writes the HDF5 file and starts the workflow
+        """
+        logger.info(f"runEventLoop() starting, {self.workers} workers")
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"workflow_worker_{i+1}", daemon=True)
+            thread.start()
+
+        for register in (self.registers.workflow_start, self.registers.workflow_caller):
+            register.pv.add_callback(self._on_trigger_change)
+        self._trigger.set()     # in case SPEC is already waiting
+
+        t_next_increment = time.time()
+        while True:
+            timeout = max(t_next_increment - time.time(), 0)
+            if self._trigger.wait(timeout=timeout):
+                self._trigger.clear()
+                if self.isTriggered():
+                    self.submitJob()
+
+            if time.time() >= t_next_increment:
+                t_next_increment = time.time() + self.increment_interval
+                self.incrementTicker()
+
+    def submitJob(self):
+        """capture everything this workflow needs from the registers, queue it"""
+        t0 = time.time()
+        logger.debug("workflow handling triggered")
+        workflow = copy.copy(self.workflow)     # other jobs may be running
+        workflow.set_xpcs_qmap_file(self.registers.xpcs_qmap_file.get())
+        workflow.transfer = self.registers.transfer.get()
+        workflow.analysis = self.registers.analysis.get()
+        job = WorkflowJob(
+            number=next(self._job_numbers),
+            analysis=self.registers.workflow_submit_xpcs_job.get() in (1, 1.0, True),
+            filename=workflow.get_workflow_filename(),
+            workflow=workflow,
+            snapshot=workflow.snapshot_registers(),
+            t_trigger=t0,
+        )
+        workflow.hdf_workflow_file = job.filename
+        self.resetStartTrigger()
+
+        self.jobs[job.number] = job
+        while len(self.jobs) > self.history:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.status in ("queued", "running"):
+                break
+            self.jobs.popitem(last=False)
+        self.job_queue.put(job)
+        logger.info(
+            f"job {job.number} queued ({time.time()-t0:.3f}s):"
+            f" workflow:{job.workflow_name}  file:{job.filename}"
+        )
+        return job
+
+    def _worker(self):
+        while True:
+            job = self.job_queue.get()
+            try:
+                self.runJob(job)
+            finally:
+                self.job_queue.task_done()
+
+    def runJob(self, job):
+        """write the HDF5 workflow file and start the DM workflow"""
+        job.status = "running"
+        job.t_start = time.time()
+        try:
+            job.workflow.create_hdf5_file(job.filename, snapshot=job.snapshot)
+            job.dm_job = job.workflow.submit_job(job.filename, analysis=job.analysis)
+            job.status = "done"
+        except Exception as exc:
+            job.err = str(exc)
+            job.status = "failed"
+        job.t_end = time.time()
+
+        msg = (
+            f"job {job.number} {job.status}"
+            f" in {job.t_end-job.t_start:.3f}s"
+            f" (waited {job.t_start-job.t_trigger:.3f}s)"
+            f": {job.filename}"
+        )
+        if job.status == "failed":
+            logger.error(f"{msg}  {job.err}")
+        else:
+            logger.info(f"{msg}  DM job {job.dm_job}")
+
+    def getJobTable(self):
+        """status of recent jobs, as a table"""
+        tbl = pyRestTable.Table()
+        tbl.labels = "# status workflow waited(s) run(s) file DM_job".split()
+        for job in list(self.jobs.values()):
+            waited, run = "", ""
+            if job.t_start is not None:
+                waited = f"{job.t_start-job.t_trigger:.3f}"
+            if job.t_end is not None:
+                run = f"{job.t_end-job.t_start:.3f}"
+            tbl.addRow(
+                [
+                    job.number, job.status, job.workflow_name,
+                    waited, run, job.filename, job.dm_job,
+                ]
+            )
+        return tbl
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="APS data management workflow helper for SPEC")
+    parser.add_argument(
+        "--events", action="store_true",
+        help="use EPICS monitors and a job queue instead of the polling loop")
+    parser.add_argument(
+        "--workers", type=int, default=4,
+        help="(--events) workflows that may run at the same time")
+    parser.add_argument(
+        "--ticker", type=float, default=1.0,
+        help="(--events) seconds between workflow_ticker increments")
+    args = parser.parse_args(argv)
 
-def main():
     logger.debug("starting")
-    helper = WorkflowHelper()
-    helper.runPollingLoop()
+    if args.events:
+        helper = EventWorkflowHelper(
+            workers=args.workers, ticker_interval=args.ticker)
+        helper.runEventLoop()
+    else:
+        helper = WorkflowHelper()
+        helper.runPollingLoop()
 
 
 if __name__ == "__main__":
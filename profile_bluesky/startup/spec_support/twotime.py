@@ -0,0 +1,143 @@
+"""
+Two-time correlation C(t1, t2), out of core, for long series
+
+For each dynamic q bin::
+
+    C(t1, t2) = <I_p(t1) I_p(t2)>_p / (<I_p(t1)>_p <I_p(t2)>_p)
+
+(averages over the pixels ``p`` of the bin).
+
+1. The frames are read once, in chunks, and reduced to a pixel
+   stream: a memory-mapped (frames, pixels) array whose columns are
+   the pixels of the selected bins, bin after bin.
+2. For each bin, C is computed in (block, block) tiles, each one a
+   matrix product of two blocks of its pixel stream.  The tiles are
+   written to a memory-mapped ``.npy`` file (bins, frames, frames).
+
+Memory use depends on ``block_frames`` and the pixels of one bin, not
+on the number of frames.  The output file grows as frames**2
+(``frame_bin`` averages frames to reduce it).
+
+Frames may come from any of the readers (``IMMFile.to_dask()``,
+``RigakuBinFile.to_dask()``, an HDF5 dataset, ...).
+
+EXAMPLE::
+
+    result = two_time(frames, load_qmap(qmap_file).dynamic, "/tmp/C.npy", q_bins=[0, 5])
+    C = result.C[1]       # (frames, frames) of bin 5, memory-mapped
+"""
+
+import collections
+import logging
+import numpy as np
+import os
+import tempfile
+import time
+
+
+logger = logging.getLogger(f"main.{__name__}")
+
+BLOCK_FRAMES = 1024
+CHUNK_FRAMES = 256
+
+TwoTimeResult = collections.namedtuple("TwoTimeResult", "C q bins filename elapsed")
+
+
+def pixel_stream(frames, partition, bins, filename, frame_bin=1, chunk_frames=CHUNK_FRAMES):
+    """
+    write the pixels of ``bins`` of each frame to a memory-mapped file
+
+    RETURNS
+
+    (stream (frames, pixels) memmap, column where each bin starts (len(bins)+1),
+    mean (frames, len(bins)) of each bin in each frame)
+    """
+    columns = [np.flatnonzero(np.asarray(partition.bins) == b) for b in bins]
+    starts = np.cumsum([0] + [len(c) for c in columns])
+    pixels = np.asarray(partition.pixels)[np.concatenate(columns)]
+    chunk_frames = max(frame_bin, chunk_frames - chunk_frames % frame_bin)
+
+    num_frames = len(frames) // frame_bin
+    stream = np.lib.format.open_memmap(
+        filename, mode="w+", dtype=np.float32, shape=(num_frames, len(pixels))
+    )
+    mean = np.zeros((num_frames, len(bins)))
+    for start in range(0, num_frames * frame_bin, chunk_frames):
+        stop = min(start + chunk_frames, num_frames * frame_bin)
+        chunk = np.asarray(frames[start:stop])
+        n = len(chunk) // frame_bin
+        values = np.take(chunk.reshape(len(chunk), -1), pixels, axis=1)
+        values = values.reshape(n, frame_bin, -1).mean(axis=1, dtype=np.float32)
+        first = start // frame_bin
+        stream[first : first + n] = values
+        mean[first : first + n] = np.add.reduceat(values, starts[:-1], axis=1) / np.diff(starts)
+    stream.flush()
+    return stream, starts, mean
+
+
+def two_time(frames, partition, filename, q_bins=None, frame_bin=1,
+             block_frames=BLOCK_FRAMES, workdir=None):
+    """
+    two-time correlation of the selected dynamic bins, returns TwoTimeResult
+
+    PARAMETERS
+
+    frames : array-like (n, rows, cols)
+    partition : PartitionIndex
+        dynamic bins, such as ``load_qmap(qmap_file).dynamic``
+    filename : str
+        output ``.npy`` file (bins, frames, frames) float32
+    q_bins : list of int, optional
+        bins (0-based) to compute, default: all
+    frame_bin : int, optional
+        average this many frames into one, default: 1
+    block_frames : int, optional
+        tile size, default: 1024
+    workdir : str, optional
+        directory for the (temporary) pixel stream, default: beside ``filename``
+    """
+    t0 = time.time()
+    counts = partition.counts
+    if q_bins is None:
+        q_bins = np.flatnonzero(counts > 0)
+    q_bins = [int(b) for b in q_bins if counts[b] > 0]
+    if len(q_bins) == 0:
+        raise ValueError("no pixels in the selected bins")
+
+    workdir = workdir or os.path.dirname(os.path.abspath(filename))
+    fd, stream_file = tempfile.mkstemp(suffix=".npy", prefix="twotime_", dir=workdir)
+    os.close(fd)
+    try:
+        stream, starts, mean = pixel_stream(frames, partition, q_bins, stream_file, frame_bin)
+        num_frames = len(stream)
+        C = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=np.float32,
+            shape=(len(q_bins), num_frames, num_frames),
+        )
+        blocks = [
+            (i, min(i + block_frames, num_frames))
+            for i in range(0, num_frames, block_frames)
+        ]
+        for k in range(len(q_bins)):
+            columns = slice(starts[k], starts[k + 1])
+            num_pixels = starts[k + 1] - starts[k]
+            for a, (i0, i1) in enumerate(blocks):
+                Xi = np.array(stream[i0:i1, columns])
+                for j0, j1 in blocks[a:]:
+                    Xj = Xi if j0 == i0 else np.array(stream[j0:j1, columns])
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        tile = (Xi @ Xj.T) / num_pixels
+                        tile /= np.outer(mean[i0:i1, k], mean[j0:j1, k])
+                    C[k, i0:i1, j0:j1] = tile
+                    if j0 != i0:
+                        C[k, j0:j1, i0:i1] = tile.T
+            C.flush()
+            logger.debug("two-time bin %d: %d frames", q_bins[k], num_frames)
+        del stream
+    finally:
+        os.remove(stream_file)
+
+    C = np.load(filename, mmap_mode="r")
+    q = np.asarray(partition.q)
+    q = q[q_bins] if len(q) > max(q_bins) else None
+    return TwoTimeResult(C, q, q_bins, filename, time.time() - t0)
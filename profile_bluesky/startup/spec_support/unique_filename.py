@@ -0,0 +1,103 @@
+"""
+Allocate unique file names: ``name.hdf``, ``name__001.hdf``, ...
+
+Each directory is listed once; the suffixes already taken are
+remembered.  A name is claimed by creating an empty file
+with ``O_CREAT | O_EXCL``, which fails if any other process
+(such as the SPEC helper) has claimed it first.  In that case,
+the next suffix is tried.
+
+EXAMPLE::
+
+    fullname = unique_filename("/home/8ididata/2022-2/user", "A001_0001-1000")
+"""
+
+import logging
+import os
+import re
+import threading
+
+
+logger = logging.getLogger(f"main.{__name__}")
+
+
+class FilenameAllocator:
+    """
+    claim unique file names, ``stem.ext`` or ``stem__NNN.ext``
+
+    The suffixes taken in each directory are cached.
+    Call ``forget(directory)`` if files there have been removed
+    and their names should be used again.
+    """
+
+    def __init__(self):
+        self._taken = {}    # {(directory, ext): {stem: set(suffixes)}}
+        self._lock = threading.Lock()
+
+    def _scan(self, directory, ext):
+        """list the directory once, return {stem: set(suffixes)}"""
+        pattern = re.compile(r"^(.*?)(?:__(\d{3,}))?" + re.escape(ext) + "$")
+        taken = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = pattern.match(entry.name)
+                if match is not None:
+                    stem, suffix = match.groups()
+                    taken.setdefault(stem, set()).add(int(suffix or 0))
+        return taken
+
+    def forget(self, directory=None):
+        """discard the cached names of ``directory`` (default: all)"""
+        with self._lock:
+            if directory is None:
+                self._taken.clear()
+            else:
+                directory = os.path.abspath(directory)
+                for key in [k for k in self._taken if k[0] == directory]:
+                    del self._taken[key]
+
+    def claim(self, directory, stem, ext=".hdf"):
+        """
+        create (empty) and return the first free file name
+
+        The directory is created if needed.
+        """
+        directory = os.path.abspath(directory)
+        with self._lock:
+            key = (directory, ext)
+            if key not in self._taken:
+                os.makedirs(directory, exist_ok=True)
+                self._taken[key] = self._scan(directory, ext)
+            taken = self._taken[key].setdefault(stem, set())
+
+            suffix = 0
+            while True:
+                while suffix in taken:
+                    suffix += 1
+                fname = stem if suffix == 0 else f"{stem}__{suffix:03d}"
+                fullname = os.path.join(directory, fname + ext)
+                try:
+                    fd = os.open(fullname, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                except FileExistsError:
+                    # claimed by another process since the directory was read
+                    taken.add(suffix)
+                    continue
+                os.close(fd)
+                taken.add(suffix)
+                break
+
+        if suffix > 0:
+            logger.info(f"using modified file name: {fullname}")
+        return fullname
+
+
+_allocator = FilenameAllocator()
+
+
+def unique_filename(directory, stem, ext=".hdf"):
+    """
+    claim a new file name in ``directory``, see ``FilenameAllocator``
+
+    Returns the absolute name of a (new, empty) file.
+    """
+    return _allocator.claim(directory, stem, ext)
@@ -0,0 +1,324 @@
+"""
+Streaming multi-tau g2 (quick look, not the DM analysis)
+
+Frames are correlated as they arrive, in chunks.  Memory is bounded:
+each level of the multi-tau scheme keeps only ``buffer_size`` frames
+(frames of level ``k`` are averages of ``2**k`` frames), so the
+buffers grow with the logarithm of the number of frames.
+
+The pixels of the dynamic q bins are divided between worker
+processes.  Each worker correlates its own pixels, the per-q sums of
+all workers are added at the end.
+
+    g2(q, tau) = sum_p <I_p(t) I_p(t+tau)>_t / sum_p <I_p>_t**2
+
+(sums over the pixels ``p`` of bin ``q``).
+
+EXAMPLE::
+
+    correlator = StreamingG2(load_qmap(qmap_file).dynamic, workers=4)
+    for start in range(0, len(frames), 500):
+        correlator.put(frames[start:start + 500])
+    result = correlator.finish()
+    print(result.tau, result.g2)
+"""
+
+import collections
+import logging
+import multiprocessing
+import numpy as np
+import queue
+import time
+
+
+logger = logging.getLogger(f"main.{__name__}")
+
+BUFFER_SIZE = 16    # frames kept at each level (even)
+MAX_LEVELS = 24     # enough for 2**24 * BUFFER_SIZE frames
+WORKERS = 4
+BACKLOG = 4         # chunks queued for each worker
+POLL_INTERVAL = 1.0     # seconds between checks that the workers are alive
+
+G2Result = collections.namedtuple("G2Result", "tau g2 q num_frames elapsed")
+
+
+class MultiTauCorrelator:
+    """
+    multi-tau autocorrelation of each pixel, frames added as they arrive
+
+    Level 0 correlates lags ``1 .. m-1`` (``m = buffer_size``),
+    level ``k > 0`` correlates lags ``m/2 .. m-1`` of frames averaged
+    over ``2**k``, that is lags ``(m/2 .. m-1) * 2**k``.
+
+    PARAMETERS
+
+    num_pixels : int
+        pixels in each frame (frames are 1-D, pixels already selected)
+    buffer_size : int, optional
+        frames kept at each level, default: 16
+    max_levels : int, optional
+        default: 24
+    """
+
+    def __init__(self, num_pixels, buffer_size=BUFFER_SIZE, max_levels=MAX_LEVELS):
+        if buffer_size < 2 or buffer_size % 2 != 0:
+            raise ValueError(f"buffer_size must be even, received {buffer_size}")
+        m = buffer_size
+        self.num_pixels = num_pixels
+        self.buffer_size = m
+        self.max_levels = max_levels
+
+        # lags (in frames of their level) and where they are in self.tau
+        self._lags = []
+        self._offsets = []
+        tau = []
+        for level in range(max_levels):
+            lags = np.arange(1 if level == 0 else m // 2, m)
+            self._offsets.append(len(tau))
+            self._lags.append(lags)
+            tau += list(lags * 2**level)
+        self.tau = np.array(tau, dtype=np.int64)
+
+        self.G = np.zeros((len(self.tau), num_pixels))     # sum of I(t) I(t+tau)
+        self.counts = np.zeros(len(self.tau), dtype=np.int64)
+        self.intensity = np.zeros(num_pixels)              # sum of I(t)
+        self.num_frames = 0
+
+        self._buffers = []      # per level: (m, num_pixels), created when needed
+        self._filled = []       # per level: frames in the buffer
+        self._position = []     # per level: where the next frame goes
+        self._pending = []      # per level: frame waiting for its pair
+
+    @property
+    def levels(self):
+        """levels in use"""
+        return len(self._buffers)
+
+    def add(self, frames):
+        """add frames, array of shape (n, num_pixels)"""
+        frames = np.asarray(frames, dtype=np.float32).reshape(-1, self.num_pixels)
+        for frame in frames:
+            self._add(0, frame)
+        self.intensity += frames.sum(axis=0, dtype=float)
+        self.num_frames += len(frames)
+
+    def _add(self, level, frame):
+        if level == len(self._buffers):
+            if level == self.max_levels:
+                return
+            self._buffers.append(np.zeros((self.buffer_size, self.num_pixels), np.float32))
+            self._filled.append(0)
+            self._position.append(0)
+            self._pending.append(None)
+        buffer = self._buffers[level]
+        position = self._position[level]
+
+        # correlate with all buffered frames at once
+        lags = self._lags[level]
+        lags = lags[lags <= self._filled[level]]
+        if len(lags) > 0:
+            first = self._offsets[level]
+            past = buffer[(position - lags) % self.buffer_size]
+            self.G[first : first + len(lags)] += past * frame
+            self.counts[first : first + len(lags)] += 1
+
+        buffer[position] = frame
+        self._position[level] = (position + 1) % self.buffer_size
+        self._filled[level] = min(self._filled[level] + 1, self.buffer_size)
+
+        # every two frames, their average goes to the next level
+        if self._pending[level] is None:
+            self._pending[level] = buffer[position]
+        else:
+            average = (self._pending[level] + frame) / 2
+            self._pending[level] = None
+            self._add(level + 1, average)
+
+    def partial_sums(self, bins, num_bins):
+        """
+        per-bin sums, to be added with those of other pixel groups
+
+        PARAMETERS
+
+        bins : int array (num_pixels)
+            bin (0 .. num_bins-1) of each pixel
+
+        RETURNS
+
+        (numerator (num_bins, num_tau), denominator (num_bins), valid taus)
+        """
+        valid = self.counts > 0
+        numerator = np.zeros((num_bins, valid.sum()))
+        for k, i in enumerate(np.flatnonzero(valid)):
+            numerator[:, k] = np.bincount(
+                bins, weights=self.G[i] / self.counts[i], minlength=num_bins
+            )
+        mean = self.intensity / max(self.num_frames, 1)
+        denominator = np.bincount(bins, weights=mean**2, minlength=num_bins)
+        return numerator, denominator, valid
+
+    def g2(self, bins, num_bins):
+        """(tau, g2 (num_bins, num_tau)) of the frames added so far"""
+        numerator, denominator, valid = self.partial_sums(bins, num_bins)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.tau[valid], numerator / denominator[:, None]
+
+
+def _g2_worker(frames_queue, results_queue, bins, num_bins, buffer_size):
+    """worker process: correlate the pixels of one group"""
+    correlator = MultiTauCorrelator(len(bins), buffer_size=buffer_size)
+    try:
+        while True:
+            frames = frames_queue.get()
+            if frames is None:
+                break
+            correlator.add(frames)
+        results_queue.put(
+            (correlator.tau, correlator.num_frames)
+            + correlator.partial_sums(bins, num_bins)
+        )
+    except Exception as exc:
+        results_queue.put(exc)
+
+
+class StreamingG2:
+    """
+    g2 of a frame series, correlated by a pool of worker processes
+
+    PARAMETERS
+
+    partition : PartitionIndex
+        the dynamic q bins (such as ``load_qmap(qmap_file).dynamic``)
+    workers : int, optional
+        worker processes, default: 4
+    buffer_size : int, optional
+        frames kept at each multi-tau level, default: 16
+    backlog : int, optional
+        chunks queued for each worker before ``put()`` waits, default: 4
+    """
+
+    def __init__(self, partition, workers=WORKERS,
+                 buffer_size=BUFFER_SIZE, backlog=BACKLOG):
+        self.num_pixels = partition.shape[0] * partition.shape[1]
+        self.num_bins = partition.num_bins
+        self.q = np.asarray(partition.q)
+        if len(partition.pixels) == 0:
+            raise ValueError("no pixels in any dynamic q bin")
+        groups = [
+            g
+            for g in np.array_split(np.arange(len(partition.pixels)), max(1, workers))
+            if len(g) > 0
+        ]
+        self._selections = [np.asarray(partition.pixels[g]) for g in groups]
+        self._reported = []     # results that arrived while checking the workers
+        self._t0 = time.time()
+
+        context = multiprocessing.get_context("spawn")  # not fork: session has threads
+        self._results = context.Queue()
+        self._queues = []
+        self._processes = []
+        for group in groups:
+            frames_queue = context.Queue(maxsize=backlog)
+            process = context.Process(
+                target=_g2_worker,
+                args=(frames_queue, self._results, np.asarray(partition.bins[group]),
+                      self.num_bins, buffer_size),
+                name="g2_worker",
+                daemon=True,
+            )
+            process.start()
+            self._queues.append(frames_queue)
+            self._processes.append(process)
+        logger.debug(
+            "g2: %d pixels in %d bins, %d workers",
+            len(partition.pixels), self.num_bins, len(groups))
+
+    def _check_workers(self):
+        """raise if a worker has failed or exited"""
+        try:
+            while True:
+                result = self._results.get_nowait()
+                if isinstance(result, Exception):
+                    self.close()
+                    raise result
+                self._reported.append(result)
+        except queue.Empty:
+            pass
+        for process in self._processes:
+            if process.exitcode not in (None, 0):
+                self.close()
+                raise RuntimeError(
+                    f"g2 worker {process.pid} exited with code {process.exitcode}")
+
+    def _put(self, frames_queue, item):
+        """put ``item`` in a worker's (bounded) queue, unless the worker died"""
+        while True:
+            try:
+                frames_queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                self._check_workers()
+                if not all(process.is_alive() for process in self._processes):
+                    self.close()
+                    raise RuntimeError("g2 worker exited before the end of the frames")
+
+    def put(self, frames):
+        """add frames (n, rows, cols), waits if the workers are behind"""
+        frames = np.asarray(frames).reshape(-1, self.num_pixels)
+        for selection, frames_queue in zip(self._selections, self._queues):
+            self._put(
+                frames_queue,
+                np.ascontiguousarray(frames[:, selection], dtype=np.float32),
+            )
+
+    def _next_result(self, deadline, timeout):
+        """next worker result, checking that the workers are still running"""
+        if len(self._reported) > 0:
+            return self._reported.pop(0)
+        while True:
+            wait = POLL_INTERVAL
+            if deadline is not None:
+                if time.time() >= deadline:
+                    raise TimeoutError(f"g2 workers not done after {timeout} s")
+                wait = min(wait, max(0, deadline - time.time()))
+            try:
+                return self._results.get(timeout=wait)
+            except queue.Empty:
+                self._check_workers()
+
+    def finish(self, timeout=None):
+        """wait for the workers, returns G2Result"""
+        for frames_queue in self._queues:
+            self._put(frames_queue, None)
+        deadline = None if timeout is None else time.time() + timeout
+        numerator = denominator = tau = None
+        num_frames = 0
+        try:
+            for _ in self._processes:
+                result = self._next_result(deadline, timeout)
+                if isinstance(result, Exception):
+                    raise result
+                all_tau, num_frames, part_numerator, part_denominator, valid = result
+                if numerator is None:
+                    tau = all_tau[valid]
+                    numerator, denominator = part_numerator, part_denominator
+                else:
+                    numerator = numerator + part_numerator
+                    denominator = denominator + part_denominator
+        finally:
+            self.close()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            g2 = numerator / denominator[:, None]
+        return G2Result(tau, g2, self.q, num_frames, time.time() - self._t0)
+
+    def close(self):
+        """stop the workers"""
+        for process in self._processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        for frames_queue in self._queues:
+            # frames still queued for a stopped worker: do not wait at exit
+            frames_queue.cancel_join_thread()
+            frames_queue.close()
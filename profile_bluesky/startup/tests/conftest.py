@@ -0,0 +1,14 @@
+"""
+pytest configuration: import ``spec_support`` from the startup directory
+
+Run from ``profile_bluesky/startup``::
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+STARTUP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if STARTUP_DIR not in sys.path:
+    sys.path.insert(0, STARTUP_DIR)
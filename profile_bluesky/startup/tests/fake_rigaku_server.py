@@ -0,0 +1,88 @@
+"""
+Local stand-in for the Rigaku LabView server, for testing
+
+::
+
+    server = FakeRigakuServer()
+    server.start()
+    client = RigakuClient(*server.address, replies=True)
+    print(client.command("EXPOSURE"))
+    server.stop()
+"""
+
+import socketserver
+import threading
+import time
+
+
+class _FakeRigakuHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.server.connections.add(self.connection)
+
+    def finish(self):
+        self.server.connections.discard(self.connection)
+        super().finish()
+
+    def handle(self):
+        server = self.server
+        for line in self.rfile:
+            command = line.decode().strip()
+            server.commands.append(command)
+            if server.delay > 0:
+                time.sleep(server.delay)
+            if command.startswith(("FILE:", "EXPOSURE")):
+                reply = f"OK {command}"
+            else:
+                reply = f"ERR unknown command {command}"
+            self.wfile.write((reply + "\n").encode())
+            if server.one_shot:
+                break   # close after each command, as the LabView server may
+
+
+class FakeRigakuServer(socketserver.ThreadingTCPServer):
+    """
+    local stand-in for the Rigaku LabView server, for testing
+
+    Accepts ``FILE:...`` and ``EXPOSURE``, replies ``OK <command>``
+    (``ERR ...`` to anything else).  All commands are kept in
+    ``commands``.
+
+    PARAMETERS
+
+    port : int, optional
+        default: 0 (any free port, see ``address``)
+    delay : float, optional
+        seconds before each reply, default: 0
+    one_shot : bool, optional
+        close the connection after each reply, default: False
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port=0, delay=0, one_shot=False):
+        super().__init__(("localhost", port), _FakeRigakuHandler)
+        self.delay = delay
+        self.one_shot = one_shot
+        self.commands = []
+        self.connections = set()
+        self._thread = None
+
+    @property
+    def address(self):
+        """(host, port) to connect"""
+        return self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="fake_rigaku", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """stop, closing the open connections (as a server restart)"""
+        self.shutdown()
+        self.server_close()
+        for connection in list(self.connections):
+            self.shutdown_request(connection)
@@ -0,0 +1,106 @@
+"""
+DM_Submitter with a fake ``dm-start-processing-job`` shell script
+"""
+
+import os
+import pytest
+import stat
+
+pytest.importorskip("h5py")
+pytest.importorskip("pyRestTable")
+
+from spec_support import APS_DM_8IDI as dm
+
+JOB_OUTPUT = "id=a5b0f25e-b8e1-4fa2-9c22-580379d47d0c owner=8idiuser status=pending"
+
+FAKE_JOBS = dict(
+    started=f'echo "{JOB_OUTPUT}"',
+    not_started='echo "cannot reach DM" >&2; exit 1',
+    hangs="sleep 3",
+)
+
+
+@pytest.fixture
+def fake_dm(tmp_path, monkeypatch):
+    """make the fake DM job command, returns its counter of runs"""
+    counter = tmp_path / "runs"
+
+    def make(behavior, use_session=True):
+        script = tmp_path / "dm-start-processing-job"
+        script.write_text(
+            "#!/bin/sh\n"
+            f'echo "$@" >> "{counter}"\n'
+            f"{FAKE_JOBS[behavior]}\n"
+        )
+        script.chmod(script.stat().st_mode | stat.S_IXUSR)
+        monkeypatch.setattr(dm, "DM_SETUP_COMMAND", "true")
+        monkeypatch.setattr(dm, "DM_START_JOB_COMMAND", str(script))
+        monkeypatch.setattr(dm, "DM_USE_SESSION", use_session)
+        return counter
+
+    yield make
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """DM shell session of all threads, short timeout"""
+    session = dm.DM_ShellSession(timeout=1)
+    monkeypatch.setattr(dm, "dm_session", lambda: session)
+    yield session
+    session.close()
+
+
+def runs(counter):
+    if not os.path.exists(counter):
+        return 0
+    with open(counter) as f:
+        return len(f.readlines())
+
+
+def start_job(tmp_path):
+    table = dm.DM_JobTable(str(tmp_path / "jobs.db"))
+    submitter = dm.DM_Submitter(table, workers=1, retries=3, backoff=0.01)
+    key = submitter.submit("xpcs8-01", {"filePath": "A001.hdf"}, "A001.hdf")
+    submitter.wait()
+    return table.get(key)
+
+
+def test_parse_job_output():
+    fields = dm.parse_job_output(JOB_OUTPUT + "\n")
+    assert fields["id"] == "a5b0f25e-b8e1-4fa2-9c22-580379d47d0c"
+    assert fields["status"] == "pending"
+    assert dm.parse_job_output("no job here") == {}
+
+
+@pytest.mark.parametrize("use_session", [True, False])
+def test_job_started(tmp_path, fake_dm, session, use_session):
+    counter = fake_dm("started", use_session)
+    job = start_job(tmp_path)
+    assert runs(counter) == 1
+    assert job["status"] == "submitted"
+    assert job["attempts"] == 1
+    assert job["dm_id"] == "a5b0f25e-b8e1-4fa2-9c22-580379d47d0c"
+    assert job["dm_status"] == "pending"
+    assert job["filename"] == "A001.hdf"
+
+
+@pytest.mark.parametrize("use_session", [True, False])
+def test_job_not_started(tmp_path, fake_dm, session, use_session):
+    """exit status without a job id: certainly not started, retried"""
+    counter = fake_dm("not_started", use_session)
+    job = start_job(tmp_path)
+    assert runs(counter) == 3
+    assert job["status"] == "failed"
+    assert job["attempts"] == 3
+    assert "cannot reach DM" in job["message"]
+    assert job["dm_id"] == ""
+
+
+def test_job_timeout(tmp_path, fake_dm, session):
+    """no answer in time: the job may have started, not retried"""
+    counter = fake_dm("hangs")
+    job = start_job(tmp_path)
+    assert runs(counter) == 1
+    assert job["status"] == "unknown"
+    assert job["attempts"] == 1
+    assert job["dm_id"] == ""
@@ -0,0 +1,126 @@
+"""
+RigakuClient with a local fake of the Rigaku LabView server
+"""
+
+import pytest
+import time
+
+from fake_rigaku_server import FakeRigakuServer
+from spec_support.rigaku_client import RigakuClient
+from spec_support.rigaku_client import RigakuError
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+
+    def make(**kwargs):
+        server = FakeRigakuServer(**kwargs)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.stop()
+
+
+def wait_for(condition, timeout=2):
+    t0 = time.time()
+    while not condition():
+        assert time.time() - t0 < timeout, "timed out"
+        time.sleep(0.01)
+
+
+def test_pipelined(make_server):
+    server = make_server()
+    client = RigakuClient(*server.address, replies=True)
+    commands = [f"FILE:F:A{i:03d}" for i in range(20)] + ["EXPOSURE"]
+    futures = [client.send(command) for command in commands]
+    replies = [future.result(timeout=2) for future in futures]
+    assert [reply.command for reply in replies] == commands
+    assert [reply.text for reply in replies] == [f"OK {c}" for c in commands]
+    assert server.commands == commands
+    client.close()
+
+
+def test_error_reply(make_server):
+    server = make_server()
+    client = RigakuClient(*server.address, replies=True)
+    with pytest.raises(RigakuError, match="unknown command"):
+        client.command("BOGUS")
+    assert client.command("EXPOSURE").text == "OK EXPOSURE"
+    client.close()
+
+
+def test_reconnect(make_server):
+    server = make_server()
+    address = server.address
+    client = RigakuClient(*address, replies=True)
+    assert client.command("FILE:F:A001").text == "OK FILE:F:A001"
+    server.stop()
+    wait_for(lambda: not client.connected)
+
+    server = make_server(port=address[1])
+    assert client.command("EXPOSURE").text == "OK EXPOSURE"
+    assert server.commands == ["EXPOSURE"]
+    client.close()
+
+
+def test_abandon_after_timeout(make_server):
+    server = make_server(delay=0.5)
+    client = RigakuClient(*server.address, timeout=0.1, replies=True)
+    other = client.send("FILE:F:A002")   # waits behind the first
+    with pytest.raises(TimeoutError):
+        client.command("FILE:F:A001")
+    with pytest.raises(TimeoutError):
+        other.result(timeout=0)
+    assert not client.connected
+
+    # late replies of the dropped connection are not taken by new commands
+    server.delay = 0
+    assert client.command("EXPOSURE", timeout=2).text == "OK EXPOSURE"
+    client.close()
+
+
+def test_one_shot(make_server):
+    """server closes after each reply: a command never succeeds unsent"""
+    server = make_server(one_shot=True)
+    for _ in range(50):
+        client = RigakuClient(*server.address, replies=True)
+        server.commands.clear()
+        assert client.command("FILE:F:A001").text == "OK FILE:F:A001"
+        try:
+            reply = client.command("EXPOSURE")
+        except ConnectionError:
+            continue    # lost on the closing connection, and reported
+        finally:
+            client.close()
+        assert reply.text == "OK EXPOSURE"
+        assert server.commands[-1] == "EXPOSURE"
+
+
+def test_one_shot_pipelined(make_server):
+    """commands waiting when the server closes fail, never succeed empty"""
+    server = make_server(one_shot=True)
+    client = RigakuClient(*server.address, replies=True)
+    futures = [client.send(f"FILE:F:A{i:03d}") for i in range(5)]
+    assert futures[0].result(timeout=2).text == "OK FILE:F:A000"
+    for future in futures[1:]:
+        try:
+            reply = future.result(timeout=2)
+        except ConnectionError:
+            continue
+        assert reply.text == f"OK {reply.command}"
+    client.close()
+
+
+def test_no_replies(make_server):
+    server = make_server()
+    client = RigakuClient(*server.address)    # default: replies=False
+    reply = client.command("FILE:F:A001")
+    assert reply.text == ""
+    client.command("EXPOSURE")
+    wait_for(lambda: len(server.commands) == 2)
+    assert server.commands == ["FILE:F:A001", "EXPOSURE"]
+    client.close()